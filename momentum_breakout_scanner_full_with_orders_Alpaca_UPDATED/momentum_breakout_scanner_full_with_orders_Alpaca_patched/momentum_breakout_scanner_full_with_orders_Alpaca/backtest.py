@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Backtest delle regole Momentum Breakout (signals.evaluate_signals) sullo storico della cache barre.
+
+Le regole sono calcolate per ogni barra oraria di ogni simbolo in un passaggio vettoriale; i segnali LONG/SHORT
+diventano i bracket che scanner.handle_results invierebbe (entry limit sul livello Donchian, stop 1%,
+take profit 2·partialAtR %, qty da riskPct, cap a buying power) e vengono simulati barra per barra
+con i limiti del bot (maxConcurrentPositions, useLongOnly, rthOnly + coda con TTL).
+
+Approssimazioni rispetto al live:
+- la barra del segnale è valutata chiusa (intrabar il bot può scattare prima, durante la barra);
+- la barra giornaliera di oggi (ancora in formazione nel live) ha come chiusura l'ultima chiusura oraria;
+- un solo bracket per simbolo alla volta; l'entry non eseguita scade dopo --entry-bars barre (live: gtc);
+- la coda (rthOnly / posti esauriti) riprova all'apertura o appena si chiude una posizione, non ad ogni scan;
+- a parità di barra stop e target: vince lo stop (adverse-first); nella barra dell'entry conta solo lo stop.
+
+Esempio:
+  python backtest.py --sync --start 2025-01-01 --end 2025-10-31
+  python backtest.py --start 2025-01-01 --end 2025-10-31 --set donchLenHours=120 --set rvMin=1.8
+  python backtest.py --start 2025-09-01 --end 2025-10-31 --parity 300
+"""
+import argparse, heapq, math, os
+from collections import Counter, deque
+import numpy as np
+import pandas as pd
+import yaml
+from numpy.lib.stride_tricks import sliding_window_view
+from bar_cache import BarCache
+from indicators import ema
+from signals import _tf_norm, evaluate_signals, sync_bar_cache
+from trade import _bracket_body, bracket_prices, calc_equity_qty
+
+NY = "America/New_York"
+# storico del backtest separato da state/bars.db: lo scanner pota la sua cache a ogni scan
+HISTORY_DB_PATH = os.environ.get("BACKTEST_DB_PATH", "state/history.db")
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--config", default="config.yaml")
+    ap.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="sovrascrive un parametro di config.yaml")
+    ap.add_argument("--tickers", default="tickers.csv")
+    ap.add_argument("--db", default=HISTORY_DB_PATH, help="cache barre (SQLite) dedicata allo storico, non quella dello scanner")
+    ap.add_argument("--sync", action="store_true", help="scarica prima le barre mancanti (ALPACA_API_KEY/SECRET)")
+    ap.add_argument("--start", required=True, help="inizio periodo (ISO, UTC)")
+    ap.add_argument("--end", required=True, help="fine periodo (ISO, UTC)")
+    ap.add_argument("--equity", type=float, default=100000.0, help="equity iniziale (come calc_equity_qty nello scanner)")
+    ap.add_argument("--bp-mult", type=float, default=1.0, help="buying power = equity * bp-mult (1 = cash, 2/4 = margin)")
+    ap.add_argument("--entry-bars", type=int, default=24, help="barre di validità dell'entry limit (0 = fino a fine periodo)")
+    ap.add_argument("--parity", type=int, default=0, help="confronta N barre a caso con signals.evaluate_signals ed esce")
+    ap.add_argument("--out", default="backtest_trades.csv")
+    return ap.parse_args()
+
+def load_cfg(path, overrides):
+    with open(path) as f: cfg = yaml.safe_load(f)
+    for kv in overrides:
+        k, v = kv.split("=", 1); cfg[k.strip()] = yaml.safe_load(v)
+    return cfg
+
+def load_universe(path):
+    df = pd.read_csv(path).dropna()
+    df["Symbol"] = df["Symbol"].astype(str).str.upper().str.strip()
+    df["Benchmark"] = df["Benchmark"].astype(str).str.upper().str.strip()
+    df = df[df["Symbol"].str.len() > 0]
+    bench_map = {s: (b if b and b != "-" else "SPY") for s, b in zip(df["Symbol"], df["Benchmark"])}
+    return df["Symbol"].tolist(), bench_map
+
+def rule_params(cfg):
+    """Parametri di evaluate_signals da config.yaml (stessi default di scanner.signal_params)."""
+    donch, base = int(cfg.get("donchLenHours", 288)), int(cfg.get("baseLenDays", 12))
+    return dict(
+        lookback=max(donch, base*24), rv_min=float(cfg.get("rvMin", 2.5)),
+        confirm_on_close=bool(cfg.get("confirmOnClose", True)), use_high_intrabar=bool(cfg.get("useHighIntrabar", False)),
+        use_1030_et=bool(cfg.get("use1030ET", False)), show_pre_signal=bool(cfg.get("showPreSignal", False)),
+        pre_buffer_pct=float(cfg.get("preBufferPct", 0.3)),
+    )
+
+def _bar_seconds(timeframe):
+    n = int("".join(ch for ch in timeframe if ch.isdigit()) or 1)
+    unit = timeframe.lstrip("0123456789").lower()
+    return n * {"min": 60, "hour": 3600, "day": 86400}.get(unit, 3600)
+
+def _epoch(times) -> np.ndarray:
+    return np.asarray(pd.array(times).as_unit("s").asi8)
+
+def _ny_dates(epoch_s) -> np.ndarray:
+    return pd.to_datetime(epoch_s, unit="s", utc=True).tz_convert(NY).tz_localize(None).to_numpy().astype("datetime64[D]")
+
+def _take(a, i):
+    """a[i] con NaN dove i è fuori dall'array."""
+    i = np.asarray(i)
+    ok = (i >= 0) & (i < len(a))
+    return np.where(ok, a[np.clip(i, 0, max(len(a) - 1, 0))] if len(a) else np.nan, np.nan)
+
+# --- regole vettoriali: per ogni barra oraria, lo stesso risultato di evaluate_signals con quella barra come ultima ---
+def _daily_join(sym_d, bench_d):
+    """Chiusure giornaliere simbolo/benchmark sulle date comuni (come signals._join_bench) e date NY."""
+    if sym_d is None or bench_d is None or sym_d.empty or bench_d.empty:
+        return np.zeros(0, dtype="datetime64[D]"), np.zeros(0), np.zeros(0)
+    _, i1, i2 = np.intersect1d(_epoch(sym_d["time"]), _epoch(bench_d["time"]), assume_unique=True, return_indices=True)
+    return _ny_dates(_epoch(sym_d["time"])[i1]), sym_d["close"].to_numpy(dtype=float)[i1], bench_d["close"].to_numpy(dtype=float)[i2]
+
+def symbol_rules(h, bench_h, sym_d, bench_d, p):
+    """
+    h / bench_h: barre orarie di simbolo e benchmark, sym_d / bench_d: giornaliere (DataFrame time/open/high/low/close/volume).
+    Ritorna un DataFrame per barra oraria con LONG/SHORT/pre_long/pre_short, hh/ll e ultima barra.
+    Filtri giornalieri: sedute complete prima del giorno della barra + la giornata in corso con chiusura = chiusura oraria.
+    """
+    t = _epoch(h["time"]); hi, lo, cl, vol = (h[c].to_numpy(dtype=float) for c in ("high", "low", "close", "volume"))
+    L = p["lookback"]
+    hh = pd.Series(hi).rolling(L, min_periods=1).max().shift(1).to_numpy()
+    ll = pd.Series(lo).rolling(L, min_periods=1).min().shift(1).to_numpy()
+    vol_ma50 = pd.Series(vol).rolling(50, min_periods=1).mean().shift(1).to_numpy()
+
+    # chiusura del benchmark all'ultima sua barra oraria <= t
+    tb = _epoch(bench_h["time"]) if bench_h is not None and not bench_h.empty else np.zeros(0, dtype=np.int64)
+    y = _take(bench_h["close"].to_numpy(dtype=float) if len(tb) else np.zeros(0), np.searchsorted(tb, t, "right") - 1)
+    x = cl
+    dd, cd, bd = _daily_join(sym_d, bench_d)
+    k = np.searchsorted(dd, _ny_dates(t), "left")      # sedute complete prima della barra
+
+    # bias EMA20 sulle ultime 3 chiusure giornaliere (le prime due complete, la terza = oggi)
+    a = 2.0 / 21.0
+    E = ema(cd[:, None], 20)[:, 0] if len(cd) else np.zeros(0)
+    e_prev = _take(E, k - 1)
+    e_today = np.where(np.isnan(e_prev), x, a * x + (1.0 - a) * e_prev)
+    c3 = (_take(cd, k - 2), _take(cd, k - 1), x); e3 = (_take(E, k - 2), e_prev, e_today)
+    valid = (k - 2 >= 0, k - 1 >= 0, np.ones(len(t), dtype=bool))
+    with np.errstate(invalid="ignore"):
+        bias_l = np.logical_and.reduce([(c > e) | ~v for c, e, v in zip(c3, e3, valid)])
+        bias_s = np.logical_and.reduce([(c < e) | ~v for c, e, v in zip(c3, e3, valid)])
+
+        # SMA200 e RS (media 50, pendenza 10) con la giornata in corso come ultimo valore
+        def last_window_sum(arr, n):
+            cs = np.concatenate([[0.0], np.cumsum(arr)])
+            return np.where(k >= n - 1, _take(cs, k) - _take(cs, k - (n - 1)), np.nan)
+        sma200 = (last_window_sum(cd, 200) + x) / 200.0
+        r = cd / bd if len(cd) else np.zeros(0); r_today = x / y
+        rs_ma50 = (last_window_sum(r, 50) + r_today) / 50.0
+        if len(r) >= 9:
+            W = sliding_window_view(r, 9)
+            sy9, sxy9 = _take(W.sum(axis=1), k - 9), _take(W @ np.arange(9.0), k - 9)
+        else:
+            sy9 = sxy9 = np.full(len(t), np.nan)
+        n = 10; sx = n * (n - 1) / 2.0; sxx = (n - 1) * n * (2 * n - 1) / 6.0
+        slope = (n * (sxy9 + (n - 1) * r_today) - sx * (sy9 + r_today)) / (n * sxx - sx * sx)
+        trend_l, trend_s = x > sma200, x < sma200
+        rs_up = (r_today > rs_ma50) & (slope > 0); rs_down = (r_today < rs_ma50) & (slope < 0)
+
+        rv = np.where(vol_ma50 > 0, vol / vol_ma50, np.nan)
+        rv_ok = rv >= p["rv_min"]
+        up_px, dn_px = (hi, lo) if (not p["confirm_on_close"] and p["use_high_intrabar"]) else (cl, cl)
+        break_up, break_dn = up_px > hh, dn_px < ll
+        allow = np.ones(len(t), dtype=bool)
+        if p["use_1030_et"]:
+            ny = pd.to_datetime(t, unit="s", utc=True).tz_convert(NY)
+            allow = np.asarray((ny.hour == 10) & (ny.minute == 30))
+        has_data = ~np.isnan(y)
+        long_core = has_data & bias_l & rs_up & trend_l & break_up & rv_ok & allow
+        short_core = has_data & bias_s & rs_down & trend_s & break_dn & rv_ok & allow
+        pre_l = pre_s = np.zeros(len(t), dtype=bool)
+        if p["show_pre_signal"]:
+            none = has_data & ~long_core & ~short_core
+            pu, pd_ = (hi, lo) if p["use_high_intrabar"] else (cl, cl)
+            pre_l = none & (hh > 0) & bias_l & rs_up & trend_l & (np.abs(pu / hh - 1.0) * 100.0 <= p["pre_buffer_pct"])
+            pre_s = none & (ll > 0) & bias_s & rs_down & trend_s & (np.abs(pd_ / ll - 1.0) * 100.0 <= p["pre_buffer_pct"])
+    return pd.DataFrame({"t": t, "LONG": long_core, "SHORT": short_core, "pre_long": pre_l, "pre_short": pre_s,
+                         "hh": hh, "ll": ll, "close": cl, "high": hi, "low": lo, "rv": rv})
+
+def scan_history(symbols, bench_map, hourly, daily, p):
+    """{simbolo: DataFrame di symbol_rules} per tutto l'universo."""
+    return {s: symbol_rules(hourly[s], hourly.get(bench_map.get(s, "SPY")), daily.get(s), daily.get(bench_map.get(s, "SPY")), p)
+            for s in symbols if s in hourly and not hourly[s].empty}
+
+def load_history(cache, symbols, bench_map, timeframe, start, end, lookback):
+    """Barre orarie (con lookback di riscaldamento) e giornaliere (400 giorni prima) di simboli e benchmark dalla cache."""
+    names = list(dict.fromkeys(symbols + [bench_map.get(s, "SPY") for s in symbols]))
+    since_h, since_d = _warmup_start(start, lookback), start - pd.Timedelta(days=400)
+    hourly, daily = cache.load(names, timeframe, since_h, end), cache.load(names, "1Day", since_d, end)
+    _warn_short_history(hourly, since_h, timeframe); _warn_short_history(daily, since_d, "1Day")
+    return hourly, daily
+
+def _warn_short_history(frames, since, label, slack=pd.Timedelta(days=5)):
+    """Avvisa se lo storico in cache parte dopo l'inizio richiesto (oltre weekend/festivi): riscaldamento troncato."""
+    late = sorted(s for s, df in frames.items() if not df.empty and df["time"].iloc[0] > since + slack)
+    if late:
+        print(f"WARNING: {label} history starts after {since:%Y-%m-%d} for {len(late)} symbol(s) "
+              f"({', '.join(late[:10])}{', ...' if len(late) > 10 else ''}): recent listings or missing bars "
+              f"(run with --sync)")
+
+def _warmup_start(start, lookback):
+    """Abbastanza giorni di calendario per `lookback` barre orarie (almeno 6.5 barre per seduta)."""
+    return start - pd.Timedelta(days=int(lookback / 6.5 * 7 / 5) + 7)
+
+# --- confronto con signals.evaluate_signals ---
+def parity(symbols, bench_map, hourly, daily, rules, p, start, samples, seed=0):
+    """Ricostruisce lo stato visto dallo scanner su N barre a caso e confronta i flag con evaluate_signals."""
+    rng = np.random.default_rng(seed)
+    start_s = int(start.timestamp())
+    cand = [(s, i) for s, r in rules.items() for i in np.flatnonzero(r["t"].to_numpy() >= start_s)]
+    picks = [cand[i] for i in rng.choice(len(cand), size=min(samples, len(cand)), replace=False)] if cand else []
+    bad = 0
+    for sym, i in picks:
+        b = bench_map.get(sym, "SPY"); h = hourly[sym].iloc[:i + 1]; t = h["time"].iloc[-1]
+        day = pd.Timestamp(t).tz_convert(NY).normalize()
+        bh = hourly.get(b); bh = bh[bh["time"] <= t] if bh is not None else None
+        if bh is None or bh.empty: continue
+
+        def with_today(d, close):
+            d = d[d["time"] < day] if d is not None else pd.DataFrame(columns=h.columns)
+            today = pd.DataFrame([{"time": day.tz_convert("UTC"), "open": close, "high": close, "low": close, "close": close, "volume": 0.0}])
+            return pd.concat([d, today], ignore_index=True)
+        dmap = {sym: with_today(daily.get(sym), float(h["close"].iloc[-1])), b: with_today(daily.get(b), float(bh["close"].iloc[-1]))}
+        res = evaluate_signals([sym], {sym: b}, {sym: h}, dmap, lookback=p["lookback"], rv_min=p["rv_min"],
+                               confirm_on_close=p["confirm_on_close"], use_high_intrabar=p["use_high_intrabar"],
+                               use_1030_et=p["use_1030_et"], show_pre_signal=p["show_pre_signal"], pre_buffer_pct=p["pre_buffer_pct"])[sym]
+        row = rules[sym].iloc[i]
+        got = tuple(bool(row[k]) for k in ("LONG", "SHORT", "pre_long", "pre_short"))
+        exp = tuple(bool(res.get(k, False)) for k in ("LONG", "SHORT", "pre_long", "pre_short"))
+        if got != exp:
+            bad += 1
+            if bad <= 10: print(f"MISMATCH {sym} {t}: vectorized={got} scanner={exp} {res.get('debug')}")
+    print(f"Parity: {len(picks) - bad}/{len(picks)} bars match")
+    return bad == 0
+
+# --- simulazione dei bracket con i limiti del bot ---
+EXIT, FILL, PLACE, SIGNAL = 0, 1, 2, 3   # a parità di tempo: prima le uscite (liberano posti), poi entry e invii
+
+def _rth_open_at(ts):
+    """Primo istante >= ts con mercato regolare aperto (lun-ven 9:30-16:00 ET; festivi ignorati)."""
+    ny = ts.tz_convert(NY)
+    for _ in range(8):
+        o, c = ny.normalize() + pd.Timedelta(hours=9, minutes=30), ny.normalize() + pd.Timedelta(hours=16)
+        if ny.weekday() < 5 and ny < c:
+            return max(ny, o).tz_convert("UTC")
+        ny = ny.normalize() + pd.Timedelta(days=1)
+    return ts
+
+def _fill_and_exit(h, i0, side, entry, sl, tp, max_bars):
+    """
+    Entry limit dalla barra i0: prima barra che tocca il prezzo (al meglio tra apertura e limite).
+    Poi stop/target dalla stessa barra (solo stop) o dalle successive, adverse-first, con gap all'apertura.
+    Ritorna (i_fill, px_fill, i_exit, px_exit, motivo) oppure None se l'entry non viene eseguita.
+    """
+    o, hi, lo, c = h
+    end = len(c) if max_bars <= 0 else min(len(c), i0 + max_bars)
+    if i0 >= end: return None
+    buy = side == "buy"
+    hit = (lo[i0:end] <= entry) if buy else (hi[i0:end] >= entry)
+    if not hit.any(): return None
+    i = i0 + int(hit.argmax())
+    px_in = min(o[i], entry) if buy else max(o[i], entry)
+    sl_hit = (lo[i:] <= sl) if buy else (hi[i:] >= sl)
+    tp_hit = (hi[i:] >= tp) if buy else (lo[i:] <= tp)
+    tp_hit[0] = False
+    any_hit = sl_hit | tp_hit
+    if not any_hit.any():
+        return i, px_in, len(c) - 1, float(c[-1]), "open"
+    k = int(any_hit.argmax()); j = i + k
+    if sl_hit[k]:
+        px = (min(o[j], sl) if buy else max(o[j], sl)) if k > 0 else sl
+        return i, px_in, j, float(px), "sl"
+    return i, px_in, j, float(max(o[j], tp) if buy else min(o[j], tp)), "tp"
+
+TRADE_COLS = ["symbol", "side", "signal_time", "entry_time", "entry_px", "exit_time", "exit_px", "qty", "pnl", "R", "exit_reason"]
+
+def simulate(rules, hourly, cfg, start, equity, bp_mult, entry_bars, bar_sec):
+    """
+    Segnali LONG/SHORT -> bracket, in ordine di tempo su tutti i simboli (heap di eventi): invio subito o alla
+    riapertura (rthOnly, entro signalQueueTTLMinutes), al massimo maxConcurrentPositions posizioni aperte
+    (se pieno: in coda finché si libera un posto, entro il TTL), qty da calc_equity_qty con cap a buying power.
+    """
+    start_s = int(start.timestamp())
+    long_only, rth_only = bool(cfg.get("useLongOnly", False)), bool(cfg.get("rthOnly", True))
+    retry, ttl = bool(cfg.get("retryMissedSignals", True)), pd.Timedelta(minutes=int(cfg.get("signalQueueTTLMinutes", 240) or 0))
+    max_pos, rr, risk_pct = int(cfg.get("maxConcurrentPositions", 5) or 5), float(cfg.get("partialAtR", 2.0)), float(cfg.get("riskPct", 1.0))
+    arrays = {s: tuple(hourly[s][c].to_numpy(dtype=float) for c in ("open", "high", "low", "close")) for s in rules}
+    times = {s: pd.DatetimeIndex(hourly[s]["time"]) for s in rules}
+
+    events, seq = [], 0
+    for sym, r in rules.items():
+        for side in ("LONG", "SHORT"):
+            for i in np.flatnonzero(r[side].to_numpy() & (r["t"].to_numpy() >= start_s)):
+                row = r.iloc[i]
+                debug = {"hh": None if math.isnan(row["hh"]) else round(row["hh"], 4),
+                         "ll": None if math.isnan(row["ll"]) else round(row["ll"], 4), "last_close": round(row["close"], 4)}
+                ts = times[sym][i] + pd.Timedelta(seconds=bar_sec)   # il bot vede la barra chiusa
+                events.append((ts, SIGNAL, seq, (sym, side, i, debug, ts))); seq += 1
+    heapq.heapify(events)
+
+    busy, open_pos, waiting = set(), {}, deque()
+    realized, committed = 0.0, {}
+    records, skipped, n_signals = [], Counter(), 0
+
+    def place(now, item):
+        nonlocal seq
+        sym, side, i, debug, ts_sig = item
+        if sym in busy: skipped["symbol_busy"] += 1; return
+        if len(open_pos) >= max_pos:
+            if retry and now - ts_sig <= ttl: waiting.append(item)
+            else: skipped["max_positions"] += 1
+            return
+        entry, sl, tp = bracket_prices(debug, side, rr)
+        qty = calc_equity_qty(equity, risk_pct, entry, sl)
+        bp = max(0.0, (equity + realized) * bp_mult - sum(committed.values()))
+        o_side = "buy" if side == "LONG" else "sell"
+        try:
+            body, used = _bracket_body(bp, sym, o_side, qty, "limit", entry, tp, sl)
+        except ValueError:
+            skipped["buying_power"] += 1; return
+        entry, qty = body["limit_price"], int(body["qty"])
+        sl, tp = body["stop_loss"]["stop_price"], body["take_profit"]["limit_price"]
+        t_arr = times[sym]
+        i0 = int(np.searchsorted(t_arr + pd.Timedelta(seconds=bar_sec), now, "right"))
+        fx = _fill_and_exit(arrays[sym], i0, o_side, entry, sl, tp, entry_bars)
+        if fx is None: skipped["entry_not_filled"] += 1; return
+        i_in, px_in, i_out, px_out, why = fx
+        pnl = (px_out - px_in) * qty if o_side == "buy" else (px_in - px_out) * qty
+        risk = abs(px_in - sl) * qty
+        rec = [sym, o_side, ts_sig, max(t_arr[i_in], now), round(px_in, 4), t_arr[i_out], round(px_out, 4), qty,
+               round(pnl, 2), round(pnl / risk, 3) if risk > 0 else 0.0, why]
+        # dall'invio il simbolo è impegnato e la buying power riservata; la posizione conta (maxConcurrentPositions) dall'entry
+        busy.add(sym); committed[sym] = used
+        heapq.heappush(events, (rec[3], FILL, seq, rec)); seq += 1
+        heapq.heappush(events, (max(t_arr[i_out], rec[3]), EXIT, seq, rec)); seq += 1
+        records.append(rec)
+
+    while events:
+        now, kind, _, item = heapq.heappop(events)
+        if kind == FILL:
+            open_pos[item[0]] = item
+            continue
+        if kind == EXIT:
+            sym = item[0]; busy.discard(sym); committed.pop(sym, None); open_pos.pop(sym, None)
+            realized += item[8]
+            while waiting and len(open_pos) < max_pos:
+                w = waiting.popleft()
+                if now - w[4] <= ttl: place(now, w)
+                else: skipped["queue_expired"] += 1
+            continue
+        if kind == SIGNAL:
+            n_signals += 1
+            if long_only and item[1] == "SHORT": skipped["long_only"] += 1; continue
+            at = _rth_open_at(now) if rth_only else now
+            if at > now:
+                if not retry or at - now > ttl: skipped["market_closed"] += 1; continue
+                heapq.heappush(events, (at, PLACE, seq, item)); seq += 1
+                continue
+        place(now, item)
+    skipped["queue_expired"] += len(waiting)
+    trades = pd.DataFrame(records, columns=TRADE_COLS).sort_values("entry_time").reset_index(drop=True)
+    return trades, n_signals, skipped
+
+def report(trades, n_signals, skipped, rules, start):
+    start_s = int(start.timestamp())
+    pre = sum(int((r["pre_long"] | r["pre_short"])[r["t"] >= start_s].sum()) for r in rules.values())
+    print(f"\n=== SIGNALS: {n_signals} (pre-signals: {pre}) | trades: {len(trades)} ===")
+    if skipped: print("Not traded: " + ", ".join(f"{k}={v}" for k, v in sorted(skipped.items())))
+    if trades.empty:
+        print("No trades."); return
+    closed = trades[trades["exit_reason"] != "open"]
+    eq = trades.sort_values("exit_time")["pnl"].cumsum()
+    wins, losses = closed.loc[closed["pnl"] > 0, "pnl"].sum(), -closed.loc[closed["pnl"] < 0, "pnl"].sum()
+    print("\n=== PORTFOLIO ===")
+    print(f"Trades: {len(trades)} (open at end: {len(trades) - len(closed)})")
+    print(f"Win rate: {100.0 * (closed['pnl'] > 0).mean() if len(closed) else 0.0:.2f}%")
+    print(f"Expectancy: {trades['pnl'].mean():.2f} | Mean R: {trades['R'].mean():.3f}")
+    print(f"Profit factor: {wins / losses if losses > 0 else float('inf'):.2f}")
+    print(f"PnL: {eq.iloc[-1]:.2f} | Max drawdown: {(eq.cummax() - eq).max():.2f}")
+    print(f"Exits: " + ", ".join(f"{k}={v}" for k, v in trades["exit_reason"].value_counts().items()))
+    by_sym = trades.groupby("symbol").agg(trades=("pnl", "size"), win_rate=("pnl", lambda s: 100.0 * (s > 0).mean()),
+                                          pnl=("pnl", "sum"), mean_R=("R", "mean")).sort_values("pnl", ascending=False)
+    print("\n=== PER SYMBOL ===")
+    with pd.option_context("display.float_format", "{:.2f}".format):
+        print(by_sym.to_string())
+
+def main():
+    args = parse_args()
+    cfg = load_cfg(args.config, args.set)
+    symbols, bench_map = load_universe(args.tickers)
+    p = rule_params(cfg)
+    timeframe = _tf_norm(cfg.get("timeframe", "1Hour")) or "1Hour"
+    start, end = pd.Timestamp(args.start, tz="UTC"), pd.Timestamp(args.end, tz="UTC")
+    cache = BarCache(args.db)
+    if args.sync:
+        key, sec = os.getenv("ALPACA_API_KEY"), os.getenv("ALPACA_API_SECRET")
+        names = list(dict.fromkeys(symbols + list(bench_map.values())))
+        bs = int(cfg.get("batchSize", 80))
+        for i in range(0, len(names), bs):
+            chunk = names[i:i+bs]
+            sync_bar_cache(chunk, timeframe, _warmup_start(start, p["lookback"]).isoformat(), end.isoformat(), key, sec, cache)
+            sync_bar_cache(chunk, "1Day", (start - pd.Timedelta(days=400)).isoformat(), end.isoformat(), key, sec, cache)
+    hourly, daily = load_history(cache, symbols, bench_map, timeframe, start, end, p["lookback"])
+    rules = scan_history(symbols, bench_map, hourly, daily, p)
+    if args.parity:
+        raise SystemExit(0 if parity(symbols, bench_map, hourly, daily, rules, p, start, args.parity) else 1)
+    trades, n_signals, skipped = simulate(rules, hourly, cfg, start, args.equity, args.bp_mult, args.entry_bars, _bar_seconds(timeframe))
+    report(trades, n_signals, skipped, rules, start)
+    trades.to_csv(args.out, index=False)
+    print(f"\nTrades exported to: {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import os, sqlite3, threading
+import pandas as pd
+from datetime import datetime, timezone
+from panel import BarPanel, FIELDS
+
+BARS_DB_PATH = os.environ.get("BARS_DB_PATH", "state/bars.db")
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS bars (
+  symbol TEXT NOT NULL,
+  timeframe TEXT NOT NULL,
+  t INTEGER NOT NULL,
+  open REAL,
+  high REAL,
+  low REAL,
+  close REAL,
+  volume REAL,
+  PRIMARY KEY (symbol, timeframe, t)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS bars_meta (
+  symbol TEXT NOT NULL,
+  timeframe TEXT NOT NULL,
+  full_day TEXT,
+  full_start INTEGER,
+  PRIMARY KEY (symbol, timeframe)
+);
+"""
+
+# colonne aggiunte dopo la prima versione: ALTER TABLE sui DB esistenti
+MIGRATIONS = (
+    ("full_start", "ALTER TABLE bars_meta ADD COLUMN full_start INTEGER"),
+)
+
+BAR_COLS = ["time", "open", "high", "low", "close", "volume"]
+
+def _epoch(ts) -> int:
+    return int(pd.Timestamp(ts).timestamp())
+
+def _epoch_series(s: pd.Series) -> pd.Series:
+    return (pd.to_datetime(s, utc=True) - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)
+
+def _today_utc() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+class BarCache:
+    """
+    Store locale (SQLite) delle barre per simbolo/timeframe.
+    - plan(): per ogni simbolo indica da dove riscaricare (tutto o solo la coda)
+    - store(): upsert delle barre scaricate (l'ultima barra, ancora in formazione, viene sovrascritta)
+    - load(): legge la finestra richiesta nel formato di fetch_bars_multi_symbols
+    Una volta al giorno ogni simbolo viene riscaricato per intero: con adjustment=all
+    split/dividendi riscrivono lo storico e la coda da sola non basterebbe.
+    """
+    def __init__(self, path: str = BARS_DB_PATH):
+        self.path = path
+        d = os.path.dirname(path)
+        if d: os.makedirs(d, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        with self._conn:
+            self._conn.executescript(SCHEMA_SQL)
+            cols = {r[1] for r in self._conn.execute("PRAGMA table_info(bars_meta)")}
+            for col, ddl in MIGRATIONS:
+                if col not in cols: self._conn.execute(ddl)
+
+    def plan(self, symbols, timeframe, start_utc):
+        """
+        {symbol: Timestamp da cui scaricare}; start_utc = download completo, None = niente da scaricare
+        (simbolo senza barre già scaricato per intero oggi: delistato, ticker errato, nessun trade nella finestra).
+        Si riscarica tutto anche se l'ultimo download completo partiva dopo start_utc (es. backtest con --start
+        precedente): la coda da sola lascerebbe un buco tra start_utc e la prima barra salvata.
+        """
+        start_utc = pd.Timestamp(start_utc)
+        today = _today_utc()
+        out = {}
+        with self._lock:
+            # una ricerca sull'indice (symbol, timeframe, t) per simbolo, non una scansione della tabella
+            last = {s: self._conn.execute("SELECT MAX(t) FROM bars WHERE symbol=? AND timeframe=?", (s, timeframe)).fetchone()[0]
+                    for s in symbols}
+            full = {s: self._conn.execute("SELECT full_day, full_start FROM bars_meta WHERE symbol=? AND timeframe=?",
+                                          (s, timeframe)).fetchone()
+                    for s in symbols}
+        for sym in symbols:
+            t = last.get(sym); f = full.get(sym)
+            if f is None or f[0] != today or f[1] is None or f[1] > _epoch(start_utc):
+                out[sym] = start_utc
+            elif t is None:
+                out[sym] = None      # fino al prossimo download completo (domani)
+            elif t < _epoch(start_utc):
+                out[sym] = start_utc
+            else:
+                out[sym] = pd.Timestamp(t, unit="s", tz="UTC")
+        return out
+
+    def store(self, symbols, timeframe, frames, full=False, start_utc=None):
+        """Upsert delle barre; con full=True sostituisce lo storico dei simboli indicati (scaricato da start_utc)."""
+        rows = []
+        for sym in symbols:
+            df = frames.get(sym)
+            if df is None or df.empty: continue
+            t = _epoch_series(df["time"])
+            rows.extend(zip([sym]*len(df), [timeframe]*len(df), t.tolist(),
+                            df["open"].astype(float).tolist(), df["high"].astype(float).tolist(),
+                            df["low"].astype(float).tolist(), df["close"].astype(float).tolist(),
+                            df["volume"].astype(float).tolist()))
+        with self._lock, self._conn:
+            if full:
+                self._conn.executemany("DELETE FROM bars WHERE symbol=? AND timeframe=?",
+                                       [(s, timeframe) for s in symbols])
+                since = _epoch(start_utc) if start_utc is not None else None
+                self._conn.executemany("INSERT OR REPLACE INTO bars_meta(symbol, timeframe, full_day, full_start) VALUES (?,?,?,?)",
+                                       [(s, timeframe, _today_utc(), since) for s in symbols])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO bars(symbol, timeframe, t, open, high, low, close, volume) VALUES (?,?,?,?,?,?,?,?)",
+                rows)
+
+    def load(self, symbols, timeframe, start_utc, end_utc):
+        with self._lock:
+            df = pd.read_sql_query(
+                "SELECT symbol, t, open, high, low, close, volume FROM bars WHERE timeframe=? AND t>=? AND t<=? ORDER BY symbol, t",
+                self._conn, params=(timeframe, _epoch(start_utc), _epoch(end_utc)))
+        wanted = set(symbols)
+        out = {}
+        for sym, g in df.groupby("symbol", sort=False):
+            if sym not in wanted: continue
+            g = g.drop(columns="symbol").reset_index(drop=True)
+            g["t"] = pd.to_datetime(g["t"], unit="s", utc=True)
+            out[sym] = g.rename(columns={"t": "time"})[BAR_COLS]
+        return out
+
+    def load_panel(self, symbols, timeframe, start_utc, end_utc, depth=None):
+        """Come load(), ma già impacchettato in un BarPanel (tempo × simbolo)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT symbol, t, open, high, low, close, volume FROM bars WHERE timeframe=? AND t>=? AND t<=? ORDER BY symbol, t",
+                (timeframe, _epoch(start_utc), _epoch(end_utc))).fetchall()
+        if not rows:
+            return BarPanel.empty(symbols)
+        sym, t, *vals = zip(*rows)
+        return BarPanel.from_long(symbols, sym, t, dict(zip(FIELDS, vals)), depth=depth)
+
+    def prune(self, timeframe, before_utc):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM bars WHERE timeframe=? AND t<?", (timeframe, _epoch(before_utc)))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Servizio dati condiviso tra più scanner (varianti di config.yaml sugli stessi ticker).
+Un solo processo scarica le barre (cache locale + coda mancante) e pubblica i BarPanel orario e giornaliero
+in un file memory-mapped (DATA_SERVICE_PATH, default state/data_service/panels.bin), riscritto in modo atomico
+ad ogni aggiornamento. Gli scanner con DATA_SERVICE_PATH impostato lo leggono in sola lettura: le pagine
+stanno una volta sola nella page cache, quindi API e RAM non crescono col numero di varianti.
+
+Gli aggiornamenti partono --delay secondi dopo ogni confine di barra in seduta (MarketClock, come gli scan in WATCH=1,
+che partono dopo scanDelaySeconds); gli scanner aspettano fino a DATA_SERVICE_WAIT secondi il pannello del confine
+appena passato, poi scaricano da soli.
+
+Esempio:
+  python data_service.py --every 30 --donch-len-hours 288
+  DATA_SERVICE_PATH=state/data_service/panels.bin python scanner.py
+"""
+import argparse, json, os, struct, sys, time
+from datetime import datetime, timezone
+import numpy as np
+import yaml
+from panel import BarPanel, FIELDS
+
+DATA_SERVICE_PATH = os.environ.get("DATA_SERVICE_PATH", "state/data_service/panels.bin")
+MAGIC = b"MBSPANEL"
+ALIGN = 64
+
+# --- formato: MAGIC | uint64 lunghezza header | header JSON | array allineati a 64 byte (t int64, OHLCV float64, n int64) ---
+def _align(x):
+    return (x + ALIGN - 1) // ALIGN * ALIGN
+
+def write_panels(path, panels: dict, meta: dict):
+    """panels: {nome: BarPanel}. Scrittura su file temporaneo + rename: i lettori vedono sempre un file completo."""
+    layout, arrays, off = {}, [], 0
+    for name, P in panels.items():
+        cols = {"t": P.t, **{f: getattr(P, f) for f in FIELDS}, "n": P.n}
+        entry = {"symbols": P.symbols, "depth": P.depth, "arrays": {}}
+        for key, a in cols.items():
+            a = np.ascontiguousarray(a, dtype=np.int64 if key in ("t", "n") else np.float64)
+            entry["arrays"][key] = [off, a.dtype.str, list(a.shape)]
+            arrays.append((off, a)); off = _align(off + a.nbytes)
+        layout[name] = entry
+    header = json.dumps({**meta, "panels": layout}).encode()
+    base = _align(len(MAGIC) + 8 + len(header))
+    d = os.path.dirname(path)
+    if d: os.makedirs(d, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for o, a in arrays:
+            f.seek(base + o); f.write(a.tobytes())
+        f.truncate(base + off)
+    os.replace(tmp, path)
+
+def read_panels(path):
+    """({nome: BarPanel con array in sola lettura sul file mappato}, meta)."""
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    if bytes(mm[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f"{path}: not a panel file")
+    hlen = struct.unpack("<Q", bytes(mm[len(MAGIC):len(MAGIC) + 8]))[0]
+    start = len(MAGIC) + 8
+    meta = json.loads(bytes(mm[start:start + hlen]))
+    base = _align(start + hlen)
+    panels = {}
+    for name, entry in meta.pop("panels").items():
+        a = {k: np.ndarray(tuple(shape), dtype=np.dtype(dt), buffer=mm, offset=base + o)
+             for k, (o, dt, shape) in entry["arrays"].items()}
+        panels[name] = BarPanel(entry["symbols"], a["t"], *(a[f] for f in FIELDS), a["n"])
+    return panels, meta
+
+class DataServiceReader:
+    """
+    Lato scanner: ripete il mapping solo quando il servizio ha sostituito il file (inode diverso).
+    read() ritorna (hourly, daily) oppure None se il file manca, è di un altro timeframe, è più vecchio di max_age
+    secondi o, dopo aver atteso fino a `wait` secondi un file nuovo, è ancora precedente a since() (epoch del confine
+    di barra appena passato, orologio del server: MarketClock.last_boundary).
+    """
+    def __init__(self, path=DATA_SERVICE_PATH, max_age=None, since=None, wait=None):
+        self.path = path
+        self.max_age = float(max_age if max_age is not None else os.environ.get("DATA_SERVICE_MAX_AGE", "3600"))
+        self.wait = float(wait if wait is not None else os.environ.get("DATA_SERVICE_WAIT", "20"))
+        self.since = since
+        self._ino, self._data = None, None
+
+    def read(self, timeframe=None):
+        since = self.since() if self.since is not None else None
+        deadline = time.monotonic() + self.wait
+        while True:
+            try:
+                st = os.stat(self.path)
+                if st.st_ino != self._ino:
+                    self._data, self._ino = read_panels(self.path), st.st_ino
+            except (OSError, ValueError) as e:
+                print(f"Data service unavailable ({e}); fetching directly", file=sys.stderr)
+                return None
+            panels, meta = self._data
+            if timeframe is not None and meta.get("timeframe") != timeframe:
+                print(f"Data service timeframe {meta.get('timeframe')} != {timeframe}; fetching directly", file=sys.stderr)
+                return None
+            if since is None or meta.get("as_of", 0) >= since:
+                break
+            if time.monotonic() >= deadline:
+                print("Data service panels predate the last bar boundary; fetching directly", file=sys.stderr)
+                return None
+            time.sleep(0.5)    # il servizio sta aggiornando: si aspetta il file nuovo (inode diverso)
+        if time.time() - meta.get("updated", 0) > self.max_age:
+            print("Data service panels are stale; fetching directly", file=sys.stderr)
+            return None
+        return panels["hourly"], panels["daily"]
+
+# --- lato servizio ---
+def refresh(path, symbols, bench_map, key, sec, cache, timeframe, donch_len_hours, batch_size, fetch_concurrency,
+            as_of=None):
+    """as_of: istante (orologio del server) da cui i dati sono aggiornati, confrontato dai lettori col loro confine."""
+    from signals import load_bars
+    as_of = time.time() if as_of is None else as_of
+    t0 = time.perf_counter()
+    hourly, daily = load_bars(symbols, bench_map, key, sec, timeframe=timeframe, donch_len_hours=donch_len_hours,
+                              batch_size=batch_size, bar_cache=cache, fetch_concurrency=fetch_concurrency)
+    now = time.time()
+    write_panels(path, {"hourly": hourly, "daily": daily},
+                 {"timeframe": timeframe, "updated": now, "as_of": as_of, "donch_len_hours": donch_len_hours})
+    print(f"[{datetime.now(timezone.utc):%Y-%m-%d %H:%M:%S}Z] panels updated: {len(hourly.symbols)} symbols, "
+          f"{hourly.depth}x{daily.depth} bars in {time.perf_counter() - t0:.1f}s")
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--config", default="config.yaml")
+    ap.add_argument("--tickers", default="tickers.csv")
+    ap.add_argument("--path", default=DATA_SERVICE_PATH)
+    ap.add_argument("--every", type=int, default=None, help="minuti tra gli aggiornamenti (default: scanEveryMinutes)")
+    ap.add_argument("--delay", type=float, default=1.0,
+                    help="secondi dopo il confine di barra (minore di scanDelaySeconds degli scanner)")
+    ap.add_argument("--donch-len-hours", type=int, default=None, help="profondità oraria: il massimo tra le varianti servite")
+    ap.add_argument("--once", action="store_true")
+    return ap.parse_args()
+
+def main():
+    from dotenv import load_dotenv
+    import pandas as pd
+    from bar_cache import BarCache
+    from signals import _tf_norm
+    from intrabar import tf_seconds
+    from market_clock import MarketClock
+    load_dotenv()
+    args = parse_args()
+    with open(args.config) as f: cfg = yaml.safe_load(f)
+    key, sec = os.getenv("ALPACA_API_KEY"), os.getenv("ALPACA_API_SECRET")
+    if not (key and sec):
+        print("Missing Alpaca API keys in environment (.env)."); sys.exit(1)
+    df = pd.read_csv(args.tickers).dropna()
+    df["Symbol"] = df["Symbol"].astype(str).str.upper().str.strip()
+    df["Benchmark"] = df["Benchmark"].astype(str).str.upper().str.strip()
+    df = df[df["Symbol"].str.len() > 0]
+    symbols = df["Symbol"].tolist()
+    bench_map = {s: (b if b and b != "-" else "SPY") for s, b in zip(df["Symbol"], df["Benchmark"])}
+
+    timeframe = _tf_norm(cfg.get("timeframe", "1Hour")) or "1Hour"
+    donch = int(args.donch_len_hours or max(int(cfg.get("donchLenHours", 288)), int(cfg.get("baseLenDays", 12)) * 24))
+    every = int(args.every or cfg.get("scanEveryMinutes", 60)) * 60
+    every = min(every, tf_seconds(timeframe) or every)
+    # stessi confini degli scanner in WATCH=1 (sedute, chiusure anticipate), qualche secondo prima di loro
+    clock = MarketClock(extended=bool(cfg.get("scanExtendedHours", False)))
+    clock.sessions()    # calendario e scarto dell'orologio prima del primo as_of
+    cache = BarCache()
+    while True:
+        try:
+            refresh(args.path, symbols, bench_map, key, sec, cache, timeframe, donch,
+                    int(cfg.get("batchSize", 80)), int(cfg.get("fetchConcurrency", 4)), as_of=clock.now())
+        except Exception as e:
+            print("Refresh error:", e, file=sys.stderr)
+        if args.once: break
+        clock.sleep_until(clock.next_fire(every, args.delay))
+
+if __name__ == "__main__":
+    main()
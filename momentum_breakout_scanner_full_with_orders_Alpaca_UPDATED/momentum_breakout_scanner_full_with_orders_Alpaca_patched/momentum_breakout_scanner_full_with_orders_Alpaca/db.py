@@ -1,4 +1,5 @@
-import sqlite3, json, os
+import atexit, sqlite3, json, os, threading
+from contextlib import contextmanager
 from datetime import datetime, timezone
 
 DB_PATH = os.environ.get("DB_PATH", "state/mbs.db")
@@ -48,50 +49,108 @@ CREATE TABLE IF NOT EXISTS positions (
   risk_r REAL,
   state TEXT
 );
+CREATE TABLE IF NOT EXISTS scan_metrics (
+  id INTEGER PRIMARY KEY,
+  ts_utc TEXT,
+  duration_s REAL,
+  symbols INTEGER,
+  alerts INTEGER,
+  api_calls INTEGER,
+  bytes_in INTEGER,
+  phases TEXT,
+  http TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_signals_symbol_ts ON signals(symbol, ts_utc);
+CREATE INDEX IF NOT EXISTS idx_signals_ts ON signals(ts_utc);
+CREATE INDEX IF NOT EXISTS idx_orders_symbol ON orders(symbol);
+CREATE INDEX IF NOT EXISTS idx_orders_ts ON orders(ts_utc);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
+CREATE INDEX IF NOT EXISTS idx_orders_alpaca_id ON orders(alpaca_id);
+CREATE INDEX IF NOT EXISTS idx_fills_order_id ON fills(order_id);
 """
 
+INSERT_SIGNAL_SQL = """INSERT INTO signals(ts_utc, symbol, side, rv, trigger, donch_h, donch_l, config)
+                VALUES (?,?,?,?,?,?,?,?)"""
+INSERT_ORDER_SQL = """INSERT INTO orders(client_id, alpaca_id, ts_utc, symbol, asset_class, side, qty, type, order_class, limit_px, stop_px, takeprofit_px, status, legs)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)"""
+UPDATE_ORDER_SQL = "UPDATE orders SET status=?, legs=? WHERE alpaca_id=?"
+INSERT_FILL_SQL = "INSERT INTO fills(order_id, ts_utc, fill_qty, fill_px, leg) VALUES (?,?,?,?,?)"
+INSERT_SCAN_METRICS_SQL = """INSERT INTO scan_metrics(ts_utc, duration_s, symbols, alerts, api_calls, bytes_in, phases, http)
+                VALUES (?,?,?,?,?,?,?,?)"""
+# tabella a rotazione: si tengono solo gli ultimi SCAN_METRICS_KEEP scan
+PRUNE_SCAN_METRICS_SQL = "DELETE FROM scan_metrics WHERE id <= (SELECT MAX(id) FROM scan_metrics) - ?"
+SCAN_METRICS_KEEP = int(os.environ.get("SCAN_METRICS_KEEP", "5000"))
+
+# Una connessione per processo (schema applicato una volta sola), condivisa tra i thread sotto lock;
+# sqlite3 tiene in cache gli statement già preparati della connessione.
+_conn, _depth, _lock = None, 0, threading.RLock()
+
 def _utcnow_str(): return datetime.now(timezone.utc).isoformat()
 
 def connect():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
     return sqlite3.connect(DB_PATH)
 
-def init_db():
-    conn = connect()
-    with conn:
+def _db():
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL"); conn.execute("PRAGMA synchronous=NORMAL")
         conn.executescript(SCHEMA_SQL)
-    conn.close()
+        _conn = conn
+    return _conn
+
+@contextmanager
+def unit_of_work():
+    """Transazione sulla connessione condivisa: tutte le scritture del blocco in un solo commit (i blocchi annidati si uniscono)."""
+    global _depth
+    with _lock:
+        conn = _db(); _depth += 1
+        try:
+            yield conn
+            if _depth == 1: conn.commit()
+        except BaseException:
+            if _depth == 1: conn.rollback()
+            raise
+        finally:
+            _depth -= 1
+
+@atexit.register
+def close():
+    global _conn
+    with _lock:
+        if _conn is not None: _conn.close(); _conn = None
+
+def init_db():
+    with unit_of_work():
+        pass
 
 def insert_signal(symbol, side, rv, trigger, donch_h, donch_l, config_dict):
-    conn = connect()
-    with conn:
-        conn.execute(
-            """INSERT INTO signals(ts_utc, symbol, side, rv, trigger, donch_h, donch_l, config)
-                VALUES (?,?,?,?,?,?,?,?)""",
-            (_utcnow_str(), symbol, side, rv, trigger, donch_h, donch_l, json.dumps(config_dict or {}))
-        )
-    conn.close()
+    insert_signals([(symbol, side, rv, trigger, donch_h, donch_l)], config_dict)
+
+def insert_signals(rows, config_dict):
+    """rows: (symbol, side, rv, trigger, donch_h, donch_l) dei segnali di uno scan, scritti con un solo executemany."""
+    ts, cfg = _utcnow_str(), json.dumps(config_dict or {})
+    with unit_of_work() as conn:
+        conn.executemany(INSERT_SIGNAL_SQL, [(ts, sym, side, rv, trig, h, l, cfg) for sym, side, rv, trig, h, l in rows])
 
 def insert_order(client_id, alpaca_id, symbol, asset_class, side, qty, type_, order_class, limit_px, stop_px, tp_px, status, legs=None):
-    conn = connect()
-    with conn:
-        conn.execute(
-            """INSERT INTO orders(client_id, alpaca_id, ts_utc, symbol, asset_class, side, qty, type, order_class, limit_px, stop_px, takeprofit_px, status, legs)
-                VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (client_id, alpaca_id, _utcnow_str(), symbol, asset_class, side, qty, type_, order_class, limit_px, stop_px, tp_px, status, json.dumps(legs or {}))
-        )
-    conn.close()
+    with unit_of_work() as conn:
+        conn.execute(INSERT_ORDER_SQL, (client_id, alpaca_id, _utcnow_str(), symbol, asset_class, side, qty, type_,
+                                        order_class, limit_px, stop_px, tp_px, status, json.dumps(legs or {})))
 
 def update_order_status(alpaca_id, status, legs=None):
-    conn = connect()
-    with conn:
-        conn.execute("UPDATE orders SET status=?, legs=? WHERE alpaca_id=?",
-                     (status, json.dumps(legs or {}), alpaca_id))
-    conn.close()
+    with unit_of_work() as conn:
+        conn.execute(UPDATE_ORDER_SQL, (status, json.dumps(legs or {}), alpaca_id))
 
 def insert_fill(order_id, fill_qty, fill_px, leg=None):
-    conn = connect()
-    with conn:
-        conn.execute("INSERT INTO fills(order_id, ts_utc, fill_qty, fill_px, leg) VALUES (?,?,?,?,?)",
-                     (order_id, _utcnow_str(), fill_qty, fill_px, leg))
-    conn.close()
+    with unit_of_work() as conn:
+        conn.execute(INSERT_FILL_SQL, (order_id, _utcnow_str(), fill_qty, fill_px, leg))
+
+def insert_scan_metrics(row, symbols, alerts):
+    """row: ScanMetrics.as_row() di uno scan (fasi e traffico per famiglia come JSON)."""
+    with unit_of_work() as conn:
+        conn.execute(INSERT_SCAN_METRICS_SQL, (_utcnow_str(), row["duration_s"], symbols, alerts, row["api_calls"],
+                                               row["bytes_in"], json.dumps(row["phases"]), json.dumps(row["http"])))
+        conn.execute(PRUNE_SCAN_METRICS_SQL, (SCAN_METRICS_KEEP,))
@@ -0,0 +1,91 @@
+import os, random, threading, time
+from urllib.parse import urlsplit
+import requests
+import metrics
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Client HTTP condiviso per Alpaca e Telegram: una Session con pool keep-alive (niente handshake TCP+TLS
+# per ogni pagina/ordine/alert), rate limit a token bucket per famiglia di endpoint e retry con backoff
+# esponenziale su 429/5xx (rispettando Retry-After).
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "5"))
+BACKOFF_BASE = float(os.environ.get("HTTP_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = 30.0
+
+class TokenBucket:
+    """Rate limit condiviso tra i thread: `rate` richieste/minuto, burst fino a `capacity`."""
+    def __init__(self, rate_per_min, capacity):
+        self.rate = float(rate_per_min) / 60.0; self.capacity = float(capacity)
+        self.tokens = self.capacity; self.ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0: return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate); self.ts = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0; return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def _bucket(name, rpm, burst):
+    return TokenBucket(int(os.environ.get(f"{name}_RPM", rpm)), int(os.environ.get(f"{name}_BURST", burst)))
+
+# Alpaca: 200 req/min per account (dati e trading contati a parte); Telegram: ~1 msg/s per chat
+BUCKETS = {
+    "alpaca_data": _bucket("ALPACA_DATA", 180, 10),
+    "alpaca_trading": _bucket("ALPACA_TRADING", 180, 10),
+    "telegram": _bucket("TELEGRAM", 60, 5),
+}
+
+def _family(url):
+    host = urlsplit(url).hostname or ""
+    if host == "data.alpaca.markets": return "alpaca_data"
+    if host.endswith("alpaca.markets"): return "alpaca_trading"
+    if host == "api.telegram.org": return "telegram"
+    return None
+
+def _session():
+    s = requests.Session()
+    # errori di connessione (richiesta non partita) e di lettura sui metodi idempotenti; gli status li gestisce request()
+    retry = Retry(total=3, connect=3, read=2, status=0, backoff_factor=BACKOFF_BASE, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=int(os.environ.get("HTTP_POOL_SIZE", "16")), max_retries=retry)
+    s.mount("https://", adapter); s.mount("http://", adapter)
+    return s
+
+SESSION = _session()
+
+def _retry_after(resp):
+    try:
+        return min(float(resp.headers.get("Retry-After", "")), BACKOFF_MAX)
+    except ValueError:
+        return None
+
+def request(method, url, timeout=20, **kw):
+    """
+    Richiesta sulla sessione condivisa. Ogni tentativo consuma un token della famiglia dell'endpoint.
+    429 si ritenta sempre (la richiesta non è stata eseguita); 5xx solo per i metodi diversi da POST,
+    per non duplicare ordini o messaggi. Dopo MAX_RETRIES ritorna l'ultima risposta (raise_for_status al chiamante).
+    """
+    family = _family(url)
+    bucket = BUCKETS.get(family)
+    for attempt in range(MAX_RETRIES + 1):
+        if bucket is not None: bucket.acquire()
+        resp = SESSION.request(method, url, timeout=timeout, **kw)
+        metrics.record_http(family, len(resp.content))
+        if resp.status_code not in RETRY_STATUS or attempt == MAX_RETRIES: return resp
+        if resp.status_code != 429 and method.upper() == "POST": return resp
+        wait = _retry_after(resp)
+        if wait is None: wait = min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX) * (0.5 + random.random() / 2)
+        time.sleep(wait)
+    return resp
+
+def get(url, **kw): return request("GET", url, **kw)
+
+def post(url, **kw): return request("POST", url, **kw)
+
+def delete(url, **kw): return request("DELETE", url, **kw)
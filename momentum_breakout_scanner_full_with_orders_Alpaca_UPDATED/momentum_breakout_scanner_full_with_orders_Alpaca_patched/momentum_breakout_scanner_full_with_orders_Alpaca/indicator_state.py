@@ -0,0 +1,118 @@
+import math
+from collections import deque
+
+# Indicatori incrementali: una barra alla volta, O(1) per aggiornamento, stato compatto e serializzabile
+# (to_dict/from_dict -> JSON) per riprendere dopo un riavvio senza warm-up.
+# value è NaN finché la finestra non ha abbastanza dati, come ewm/rolling di pandas.
+
+class EMA:
+    """EMA con alpha = 2/(span+1), inizializzata sul primo valore (come ewm(span, adjust=False))."""
+    __slots__ = ("span", "alpha", "value")
+
+    def __init__(self, span, value=math.nan):
+        self.span = int(span); self.alpha = 2.0 / (self.span + 1.0); self.value = value
+
+    def update(self, x):
+        self.value = x if math.isnan(self.value) else self.alpha * x + (1.0 - self.alpha) * self.value
+        return self.value
+
+    def to_dict(self):
+        return {"span": self.span, "value": self.value}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["span"], d["value"])
+
+class SMA:
+    """Media mobile a n barre con somma corrente; min_periods=n come rolling(n).mean(), 1 come tail(n).mean()."""
+    __slots__ = ("n", "min_periods", "window", "total", "count")
+
+    def __init__(self, n, min_periods=None, window=(), total=0.0, count=0):
+        self.n = int(n); self.min_periods = self.n if min_periods is None else int(min_periods)
+        self.window = deque(window, maxlen=self.n); self.total = float(total); self.count = int(count)
+
+    def update(self, x):
+        if len(self.window) == self.n: self.total -= self.window[0]
+        self.window.append(x); self.total += x; self.count += 1
+        if self.count % 4096 == 0: self.total = math.fsum(self.window)  # azzera l'errore accumulato
+        return self.value
+
+    @property
+    def value(self):
+        k = len(self.window)
+        return self.total / k if k >= max(self.min_periods, 1) else math.nan
+
+    def to_dict(self):
+        return {"n": self.n, "min_periods": self.min_periods, "window": list(self.window), "total": self.total, "count": self.count}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["n"], d["min_periods"], d["window"], d["total"], d["count"])
+
+class RollingMax:
+    """Massimo sulle ultime n barre (finestra parziale ammessa) con deque monotona: O(1) ammortizzato."""
+    __slots__ = ("n", "i", "dq")
+    sign = 1.0
+
+    def __init__(self, n, i=0, dq=()):
+        self.n = int(n); self.i = int(i); self.dq = deque(tuple(x) for x in dq)
+
+    def update(self, x):
+        v = self.sign * x
+        while self.dq and self.dq[-1][1] <= v: self.dq.pop()
+        self.dq.append((self.i, v)); self.i += 1
+        while self.dq[0][0] <= self.i - 1 - self.n: self.dq.popleft()
+        return self.value
+
+    @property
+    def value(self):
+        return self.sign * self.dq[0][1] if self.dq else math.nan
+
+    def to_dict(self):
+        return {"n": self.n, "i": self.i, "dq": [list(x) for x in self.dq]}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["n"], d["i"], d["dq"])
+
+class RollingMin(RollingMax):
+    """Minimo sulle ultime n barre: RollingMax sul valore cambiato di segno."""
+    __slots__ = ()
+    sign = -1.0
+
+class RollingSlope:
+    """
+    Pendenza OLS sulle ultime n barre (x = 0..n-1), come indicators.rolling_slope.
+    Σy e Σxy aggiornati in O(1): Σxy' = Σxy - (Σy - y_out) + (n-1)·y_in a finestra piena.
+    """
+    __slots__ = ("n", "window", "sy", "sxy", "count")
+
+    def __init__(self, n, window=(), sy=0.0, sxy=0.0, count=0):
+        self.n = int(n); self.window = deque(window, maxlen=self.n)
+        self.sy = float(sy); self.sxy = float(sxy); self.count = int(count)
+
+    def update(self, y):
+        if len(self.window) == self.n:
+            y_out = self.window[0]
+            self.sxy = self.sxy - (self.sy - y_out) + (self.n - 1) * y
+            self.sy = self.sy - y_out + y
+        else:
+            self.sxy += len(self.window) * y; self.sy += y
+        self.window.append(y); self.count += 1
+        if self.count % 4096 == 0:  # ricalcolo esatto periodico contro la deriva numerica
+            self.sy = math.fsum(self.window); self.sxy = math.fsum(k * v for k, v in enumerate(self.window))
+        return self.value
+
+    @property
+    def value(self):
+        n = self.n
+        if len(self.window) < n or n < 2: return math.nan
+        sx = n * (n - 1) / 2.0; sxx = (n - 1) * n * (2 * n - 1) / 6.0
+        return (n * self.sxy - sx * self.sy) / (n * sxx - sx * sx)
+
+    def to_dict(self):
+        return {"n": self.n, "window": list(self.window), "sy": self.sy, "sxy": self.sxy, "count": self.count}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["n"], d["window"], d["sy"], d["sxy"], d["count"])
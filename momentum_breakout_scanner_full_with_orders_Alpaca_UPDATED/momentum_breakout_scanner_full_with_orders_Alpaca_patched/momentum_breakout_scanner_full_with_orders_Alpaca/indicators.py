@@ -0,0 +1,88 @@
+import numpy as np
+
+# Primitive vettoriali su matrici (tempo × simbolo). Le colonne possono avere NaN in testa
+# (serie più corte, vedi panel.BarPanel): i risultati restano NaN finché la finestra non è piena,
+# come ewm(adjust=False) / rolling(n) di pandas.
+
+def ema(X, span):
+    """EMA con alpha = 2/(span+1), inizializzata sul primo valore valido di ogni colonna."""
+    X = np.asarray(X, dtype=float)
+    a = 2.0 / (span + 1.0)
+    out = np.empty_like(X)
+    state = np.full(X.shape[1:], np.nan)
+    for i in range(X.shape[0]):
+        x = X[i]
+        state = np.where(np.isnan(state), x, a * x + (1.0 - a) * state)
+        out[i] = state
+    return out
+
+def rolling_mean(X, n):
+    """Media mobile semplice a n barre; NaN se la finestra contiene valori mancanti."""
+    X = np.asarray(X, dtype=float)
+    out = np.full_like(X, np.nan)
+    if X.shape[0] < n: return out
+    miss = np.isnan(X)
+    c = np.cumsum(np.where(miss, 0.0, X), axis=0)
+    k = np.cumsum(miss, axis=0)
+    c = np.concatenate([np.zeros_like(c[:1]), c]); k = np.concatenate([np.zeros_like(k[:1]), k])
+    s = (c[n:] - c[:-n]) / n
+    out[n-1:] = np.where(k[n:] - k[:-n] > 0, np.nan, s)
+    return out
+
+def last_mean(X, n):
+    """Ultimo valore di rolling_mean(X, n), senza calcolare tutto lo storico."""
+    X = np.asarray(X, dtype=float)
+    if X.shape[0] < n: return np.full(X.shape[1:], np.nan)
+    return X[-n:].mean(axis=0)
+
+def last_slope(Y, n):
+    """
+    Pendenza OLS sui valori validi delle ultime n righe di ogni colonna (x = 0..k-1 sui soli valori validi),
+    come np.polyfit sulla finestra senza NaN; NaN con meno di 2 valori.
+    """
+    W = np.asarray(Y, dtype=float)[-n:]
+    m = ~np.isnan(W)
+    k = m.sum(axis=0)
+    x = np.where(m, np.cumsum(m, axis=0) - 1, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        y = np.where(m, W - np.where(m, W, 0.0).sum(axis=0) / k, 0.0)   # scarti dalla media: stessa pendenza
+        sx, sxx, sy, sxy = x.sum(axis=0), (x * x).sum(axis=0), y.sum(axis=0), (x * y).sum(axis=0)
+        slope = (k * sxy - sx * sy) / (k * sxx - sx * sx)
+    return np.where(k >= 2, slope, np.nan)
+
+def rolling_slope(Y, n, block=4096):
+    """
+    Pendenza OLS rolling su n barre (x = 0..n-1 nella finestra) per tutto lo storico di ogni colonna,
+    equivalente a np.polyfit(x, finestra, 1)[0] barra per barra.
+    I momenti di x (Σx, Σx²) sono costanti; Σy e Σxy si aggiornano in O(1) per barra con somme cumulative:
+    Σxy(finestra che inizia in s) = Σ i·y_i - s·Σy_i. NaN finché la finestra contiene valori mancanti.
+    Le somme ripartono ogni `block` barre per non perdere precisione su storici lunghi (barre a 1 minuto).
+    """
+    Y = np.asarray(Y, dtype=float)
+    T = Y.shape[0]
+    out = np.full_like(Y, np.nan)
+    if n < 2 or T < n: return out
+    for s in range(0, T - n + 1, block):
+        seg = Y[s:s + block + n - 1]
+        out[s + n - 1:s + len(seg)] = _slope_windows(seg, n)
+    return out
+
+def _slope_windows(Y, n):
+    """Pendenze delle finestre complete di Y (len(Y) - n + 1 righe)."""
+    T = Y.shape[0]
+    miss = np.isnan(Y)
+    # la pendenza non cambia sottraendo una costante: si lavora sugli scarti dal primo valore valido
+    first = np.argmax(~miss, axis=0)
+    ref = np.take_along_axis(np.where(miss, 0.0, Y), first[None, ...], axis=0)
+    Z = np.where(miss, 0.0, Y - ref)
+    i = np.arange(T, dtype=float).reshape((T,) + (1,) * (Y.ndim - 1))
+    zero = np.zeros((1,) + Y.shape[1:])
+    cy = np.concatenate([zero, np.cumsum(Z, axis=0)])
+    ciy = np.concatenate([zero, np.cumsum(i * Z, axis=0)])
+    k = np.concatenate([zero, np.cumsum(miss, axis=0)])
+    sy = cy[n:] - cy[:-n]
+    sxy = (ciy[n:] - ciy[:-n]) - i[:T-n+1] * sy
+    sx = n * (n - 1) / 2.0
+    sxx = (n - 1) * n * (2 * n - 1) / 6.0
+    slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+    return np.where(k[n:] - k[:-n] > 0, np.nan, slope)
@@ -0,0 +1,174 @@
+"""
+Percorso veloce per il trigger intrabar (confirmOnClose: false).
+Allo scan completo si salvano, per la barra in corso, i livelli fissati alla chiusura della precedente (Donchian HH/LL,
+media volumi a 50 barre) e i filtri giornalieri; tra due scan completi la barra in corso si ricostruisce dagli snapshot
+Alpaca (/v2/stocks/snapshots, molti simboli per richiesta): ultimo trade, barra a 1 minuto e barra del giorno.
+- massimo/minimo: la finestra Donchian contiene tutte le barre chiuse di oggi, quindi se il massimo del giorno supera
+  il massimo di quelle barre è stato fatto nella barra in corso (idem per il minimo); altrimenti trade e minuto;
+- volume: volume del giorno meno le barre chiuse di oggi (almeno il volume dell'ultimo minuto).
+Quando la barra si chiude i livelli non valgono più: check() ritorna None e serve uno scan completo.
+Frequenza per simbolo (scanTiers): i simboli vicini al livello si ricontrollano spesso, i lontani solo agli scan completi.
+"""
+import re, time
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import http_client
+from panel import BarPanel
+from signals import ALPACA_BASE, _alpaca_headers, _apply_rules, _ny_day_start, screen_context, GATE_KEYS
+
+SNAPSHOT_BATCH = 200
+
+def tf_seconds(timeframe):
+    """Durata della barra in secondi per i timeframe a minuti/ore (es. 1Hour, 15Min), None per gli altri."""
+    m = re.fullmatch(r"(\d+)(Min|Hour)", timeframe or "")
+    return int(m.group(1)) * (60 if m.group(2) == "Min" else 3600) if m else None
+
+def fetch_snapshots(symbols, key, sec, batch_size=SNAPSHOT_BATCH):
+    """{simbolo: snapshot} (latestTrade, minuteBar, dailyBar, ...) con una richiesta ogni batch_size simboli."""
+    out = {}
+    for i in range(0, len(symbols), batch_size):
+        resp = http_client.get(f"{ALPACA_BASE}/v2/stocks/snapshots", headers=_alpaca_headers(key, sec),
+                               params={"symbols": ",".join(symbols[i:i+batch_size]), "feed": "iex"}, timeout=15)
+        resp.raise_for_status(); data = resp.json()
+        out.update({s: v for s, v in data.get("snapshots", data).items() if v})
+    return out
+
+def _ts(d):
+    return pd.Timestamp(d["t"]).timestamp() if d and d.get("t") else -np.inf
+
+class IntrabarCache:
+    """
+    tiers: [(max_dist_pct, secondi)] dal più vicino al livello; un simbolo a distanza <= max_dist_pct dal suo livello
+    Donchian si ricontrolla ogni `secondi` (0 = solo allo scan completo). Senza tiers si ricontrolla tutto a ogni check().
+    clock: orologio per "adesso" (in WATCH=1 MarketClock.now, corretto sullo scarto col server Alpaca).
+    """
+    def __init__(self, timeframe="1Hour", tiers=None, clock=time.time):
+        self.step = tf_seconds(timeframe)
+        self.clock = clock
+        self.tiers = sorted(tiers or [])
+        self.bar_t = None
+        self.symbols = []
+        self.every = self.next_due = np.zeros(0)
+
+    def capture(self, symbols, bench_map, hourly, ctx, lookback, rule_kw, screen=None, idx=None, now=None):
+        """Livelli per la barra in corso a `now`: se l'ultima barra scaricata è già chiusa entra nella finestra."""
+        now = self.clock() if now is None else now
+        self.bar_t = int(now // self.step * self.step)
+        self.day_start = _ny_day_start(datetime.fromtimestamp(now, timezone.utc))
+        self.symbols, self.bench_map, self.rule_kw = list(symbols), bench_map, rule_kw
+        self.screen, self.idx = screen, idx
+        P = hourly.select(self.symbols, depth=max(lookback, 50) + 1)
+        S = len(self.symbols); nan = np.full(S, np.nan)
+        self.ctx = {k: np.asarray(ctx[k]).copy() if ctx is not None else np.zeros(S, dtype=bool) for k in ("has_data",) + GATE_KEYS}
+        self.has_data = P.n > 0
+        self.hh = self.ll = self.vol_ma50 = self.prev_high = self.prev_low = nan
+        self.prev_vol = np.zeros(S); self.run_high, self.run_low = nan.copy(), nan.copy(); self.run_vol = np.zeros(S)
+        self.every, self.next_due = np.zeros(S), np.full(S, np.inf)
+        if P.depth == 0: return
+        open_bar = P.t[-1] == self.bar_t       # ultima barra = barra in corso: resta fuori dai livelli
+        def _levels(hi, lo, v):
+            cnt = (~np.isnan(v)).sum(axis=0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                vm = np.where(cnt > 0, np.nansum(v, axis=0) / cnt, np.nan)
+            return np.fmax.reduce(hi, axis=0), np.fmin.reduce(lo, axis=0), vm
+        closed = _levels(P.high[-lookback:], P.low[-lookback:], P.volume[-50:])
+        if P.depth > 1:
+            excl = _levels(P.high[-1-lookback:-1], P.low[-1-lookback:-1], P.volume[-51:-1])
+        else:
+            excl = (nan, nan, nan)
+        self.hh, self.ll, self.vol_ma50 = (np.where(open_bar, e, c) for e, c in zip(excl, closed))
+        # barre chiuse di oggi (prima della barra in corso)
+        today = P.valid() & (P.t >= int(self.day_start.timestamp())) & (P.t < self.bar_t)
+        self.prev_high = np.fmax.reduce(np.where(today, P.high, np.nan), axis=0)
+        self.prev_low = np.fmin.reduce(np.where(today, P.low, np.nan), axis=0)
+        self.prev_vol = np.where(today, P.volume, 0.0).sum(axis=0)
+        self.run_high = np.where(open_bar, P.high[-1], np.nan)
+        self.run_low = np.where(open_bar, P.low[-1], np.nan)
+        self.run_vol = np.where(open_bar, P.volume[-1], 0.0)
+        self._schedule(np.arange(S), P.high[-1], P.low[-1], P.close[-1], self.ctx, now)
+
+    def stale(self, now=None):
+        now = self.clock() if now is None else now
+        return self.bar_t is None or int(now // self.step * self.step) != self.bar_t
+
+    def check(self, alpaca_key, alpaca_sec, now=None):
+        """
+        Risultati come evaluate_signals per la barra in corso, da snapshot, dei soli simboli in scadenza secondo i
+        livelli (tiers); None se i livelli sono scaduti.
+        """
+        now = self.clock() if now is None else now
+        if self.stale(now):
+            return None
+        sel = np.flatnonzero(self.next_due <= now)
+        if not len(sel):
+            return {}
+        syms = [self.symbols[i] for i in sel]
+        bmks = [self.bench_map.get(s, "SPY") for s in syms]
+        names = list(dict.fromkeys(syms + (bmks if self.screen is not None else [])))
+        snaps = fetch_snapshots(names, alpaca_key, alpaca_sec)
+        day0 = self.day_start.timestamp()
+        S = len(names)
+        lt_t, lt_p, mb_t, db_t = (np.full(S, -np.inf) for _ in range(4))
+        mb, db = np.full((4, S), np.nan), np.full((3, S), np.nan)
+        for j, s in enumerate(names):
+            sn = snaps.get(s) or {}
+            lt, m, d = sn.get("latestTrade") or {}, sn.get("minuteBar") or {}, sn.get("dailyBar") or {}
+            lt_t[j], mb_t[j], db_t[j] = _ts(lt), _ts(m), _ts(d)
+            lt_p[j] = lt.get("p", np.nan)
+            mb[:, j] = [m.get(k, np.nan) for k in ("h", "l", "c", "v")]
+            db[:, j] = [d.get(k, np.nan) for k in ("h", "l", "v")]
+        in_bar, min_in_bar, day_ok = lt_t >= self.bar_t, mb_t >= self.bar_t, db_t >= day0
+        close = np.where(in_bar, lt_p, np.where(min_in_bar, mb[2], np.nan))
+        have = ~np.isnan(close)
+
+        pos = {s: j for j, s in enumerate(names)}
+        si = np.array([pos[s] for s in syms], dtype=int)
+        trade = np.where(in_bar, lt_p, np.nan)[si]
+        m_h, m_l, m_v = (np.where(min_in_bar, mb[i], np.nan)[si] for i in (0, 1, 3))
+        dh, dl, dv = db[:, si]; day_ok = day_ok[si]
+        new_high = day_ok & (np.isnan(self.prev_high[sel]) | (dh > self.prev_high[sel]))
+        new_low = day_ok & (np.isnan(self.prev_low[sel]) | (dl < self.prev_low[sel]))
+        self.run_high[sel] = np.fmax.reduce([self.run_high[sel], m_h, trade, np.where(new_high, dh, np.nan)])
+        self.run_low[sel] = np.fmin.reduce([self.run_low[sel], m_l, trade, np.where(new_low, dl, np.nan)])
+        self.run_vol[sel] = np.fmax.reduce([self.run_vol[sel], np.where(day_ok, dv - self.prev_vol[sel], np.nan), m_v])
+
+        # pannello a una riga (barra in corso): i simboli con i valori ricostruiti, i benchmark con la sola chiusura
+        t = np.where(have, self.bar_t, 0).astype(np.int64)
+        hi, lo, vol = close.copy(), close.copy(), np.zeros(S)
+        hi[si], lo[si], vol[si] = self.run_high[sel], self.run_low[sel], self.run_vol[sel]
+        live = BarPanel(names, t[None, :], close[None, :], hi[None, :], lo[None, :], close[None, :], vol[None, :],
+                        have.astype(np.int64))
+        if self.screen is not None:
+            ctx = screen_context(self.screen, self.idx[sel], syms, self.bench_map, live, self.day_start)
+        else:
+            ctx = {k: v[sel] for k, v in self.ctx.items()}
+        lv = {"has_data": self.has_data[sel] & have[si], "hh": self.hh[sel], "ll": self.ll[sel],
+              "vol_ma50": self.vol_ma50[sel], "time": t[si], "close": close[si],
+              "high": self.run_high[sel], "low": self.run_low[sel], "volume": self.run_vol[sel]}
+        self._schedule(sel, np.where(have[si], hi[si], np.nan), np.where(have[si], lo[si], np.nan), close[si], ctx, now)
+        return _apply_rules(syms, self.bench_map, ctx, lv, **self.rule_kw)
+
+    def _schedule(self, sel, high, low, close, ctx, now):
+        """
+        Prossimo ricontrollo dei simboli sel: distanza % dal livello Donchian dal lato che ha il bias EMA
+        (come dist_up_pct/dist_down_pct), poi il primo livello di tiers con max_dist >= distanza.
+        Senza tiers ogni simbolo si ricontrolla a ogni giro; fuori da tutti i livelli solo allo scan completo.
+        """
+        if not self.tiers:
+            self.next_due[sel] = now; return
+        up, dn = (high, low) if self.rule_kw.get("use_high_intrabar") else (close, close)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            d_up = np.where(ctx["ema_bias_long"], np.maximum(self.hh[sel] / up - 1.0, 0.0) * 100.0, np.inf)
+            d_dn = np.where(ctx["ema_bias_short"], np.maximum(1.0 - self.ll[sel] / dn, 0.0) * 100.0, np.inf)
+        dist = np.nan_to_num(np.fmin(d_up, d_dn), nan=np.inf)
+        every = np.full(len(sel), np.inf)
+        for max_dist, sec in reversed(self.tiers):
+            every = np.where(dist <= max_dist, sec if sec > 0 else np.inf, every)
+        self.every[sel] = every
+        self.next_due[sel] = now + every
+
+    def tier_counts(self):
+        """{secondi tra i ricontrolli (0 = solo scan completo): numero di simboli}."""
+        ev, n = np.unique(np.where(np.isinf(self.every), 0, self.every), return_counts=True)
+        return {int(e): int(c) for e, c in zip(ev, n)}
@@ -0,0 +1,114 @@
+"""
+Calendario di mercato per la modalità WATCH=1: sedute Alpaca (/v2/calendar, chiusure anticipate comprese) in cache in
+state/market_calendar.json, aggiornata una volta al giorno, e scarto tra orologio locale e server (/v2/clock).
+Gli scan partono pochi secondi dopo ogni confine di barra dentro la seduta (più apertura e chiusura); fuori seduta si
+dorme fino alla prossima. Se il calendario non è disponibile si usa la sola griglia dei confini, senza filtro sedute.
+"""
+import json, os, time
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+import pytz
+from trade import _fetch
+
+CALENDAR_PATH = os.environ.get("MARKET_CALENDAR_PATH", "state/market_calendar.json")
+NY = pytz.timezone("America/New_York")
+
+def _et(date, hhmm):
+    """'2025-11-28' + '13:00' (o '1300') in epoch secondi UTC."""
+    hhmm = hhmm.replace(":", "")
+    d = datetime.strptime(f"{date} {hhmm[:2]}:{hhmm[2:4]}", "%Y-%m-%d %H:%M")
+    return NY.localize(d).timestamp()
+
+class MarketClock:
+    def __init__(self, path=CALENDAR_PATH, extended=False, days_ahead=30):
+        self.path, self.extended, self.days_ahead = path, extended, days_ahead
+        self.skew = 0.0          # orologio del server - orologio locale (secondi)
+        self._days, self._fetched = None, None
+
+    def now(self):
+        return time.time() + self.skew
+
+    def sessions(self):
+        """[(apertura, chiusura)] in epoch UTC (server), None se il calendario non è disponibile."""
+        today = datetime.now(timezone.utc).date().isoformat()
+        if self._fetched != today:
+            self._refresh(today)
+        if not self._days:
+            return None
+        o, c = ("session_open", "session_close") if self.extended else ("open", "close")
+        return [(_et(d["date"], d.get(o) or d["open"]), _et(d["date"], d.get(c) or d["close"])) for d in self._days]
+
+    def _refresh(self, today):
+        try:
+            with open(self.path) as f: cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+        horizon = (datetime.now(timezone.utc) + timedelta(days=7)).date().isoformat()
+        days = cached.get("days") or []
+        if cached.get("fetched") == today and days and days[-1]["date"] >= horizon:
+            self._days, self._fetched = days, today
+            self._measure_skew()
+            return
+        start = (datetime.now(timezone.utc) - timedelta(days=7)).date().isoformat()
+        end = (datetime.now(timezone.utc) + timedelta(days=self.days_ahead)).date().isoformat()
+        try:
+            days = _fetch(f"/v2/calendar?start={start}&end={end}", timeout=15)
+        except Exception as e:
+            print("Market calendar unavailable:", e)
+            self._days = days or None        # meglio un calendario vecchio di nessuno
+            self._fetched = today
+            return
+        d = os.path.dirname(self.path)
+        if d: os.makedirs(d, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f: json.dump({"fetched": today, "days": days}, f)
+        os.replace(tmp, self.path)
+        self._days, self._fetched = days, today
+        self._measure_skew()
+
+    def _measure_skew(self):
+        try:
+            t0 = time.time(); clock = _fetch("/v2/clock", timeout=15); t1 = time.time()
+            self.skew = pd.Timestamp(clock["timestamp"]).timestamp() - (t0 + t1) / 2
+        except Exception as e:
+            print("Market clock unavailable:", e)
+
+    def in_session(self, t=None):
+        t = self.now() if t is None else t
+        sess = self.sessions()
+        return sess is None or any(o <= t < c for o, c in sess)
+
+    def _boundaries(self, sess, every):
+        """Confini di seduta in ordine: apertura, multipli di `every` secondi dentro la seduta, chiusura."""
+        for o, c in sess:
+            first = (o // every + 1) * every
+            yield o
+            yield from range(int(first), int(c), int(every))
+            yield c
+
+    def next_fire(self, every, delay=0.0, t=None):
+        """
+        Prossimo istante di scan (orologio del server) dopo t: apertura, multipli di `every` secondi dentro la seduta
+        e chiusura (anche anticipata), più `delay` secondi perché l'ultima barra sia disponibile.
+        """
+        t = self.now() if t is None else t
+        sess = self.sessions()
+        if sess is not None:
+            for b in self._boundaries(sess, every):
+                if b + delay > t: return b + delay
+        return ((t - delay) // every + 1) * every + delay
+
+    def last_boundary(self, every, t=None):
+        """Ultimo confine (come in next_fire, senza delay) <= t: i dati devono essere aggiornati almeno fin lì."""
+        t = self.now() if t is None else t
+        sess = self.sessions()
+        last = None
+        if sess is not None:
+            for b in self._boundaries(sess, every):
+                if b > t: break
+                last = b
+        return last if last is not None else t // every * every
+
+    def sleep_until(self, t):
+        """Dorme fino all'istante t (orologio del server)."""
+        time.sleep(max(0.0, t - self.now()))
@@ -0,0 +1,98 @@
+import os, threading, time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Strumentazione dello scan: tempi per fase, chiamate API e byte scaricati per famiglia di endpoint.
+# Un solo collettore attivo per processo (condiviso dai thread di download); fuori da scan() tutto è no-op.
+# Le fasi eseguite in parallelo (pagine scaricate da più thread) sommano i tempi dei thread: possono superare il totale.
+
+PROFILE_DIR = os.environ.get("SCAN_PROFILE_DIR", "state/profiles")
+
+class ScanMetrics:
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.duration = 0.0
+        self.phases = defaultdict(lambda: [0.0, 0])   # nome -> [secondi, conteggio]
+        self.http = defaultdict(lambda: [0, 0])       # famiglia -> [chiamate, byte]
+        self._lock = threading.Lock()
+
+    def add_phase(self, name, seconds, n=1):
+        with self._lock:
+            p = self.phases[name]; p[0] += seconds; p[1] += n
+
+    def add_http(self, family, nbytes):
+        with self._lock:
+            h = self.http[family or "other"]; h[0] += 1; h[1] += nbytes
+
+    def api_calls(self): return sum(c for c, _ in self.http.values())
+
+    def bytes_in(self): return sum(b for _, b in self.http.values())
+
+    def summary(self):
+        ph = ", ".join(f"{k} {s:.2f}s" + (f"/{n}" if n > 1 else "") for k, (s, n) in self.phases.items())
+        api = ", ".join(f"{k} {c}" for k, (c, _) in sorted(self.http.items()))
+        return (f"Scan metrics: {self.duration:.2f}s | {ph} | api {self.api_calls()} calls ({api or '-'}), "
+                f"{self.bytes_in() / 1e6:.2f} MB")
+
+    def as_row(self):
+        return dict(duration_s=round(self.duration, 4), api_calls=self.api_calls(), bytes_in=self.bytes_in(),
+                    phases={k: [round(s, 4), n] for k, (s, n) in self.phases.items()},
+                    http={k: list(v) for k, v in self.http.items()})
+
+CURRENT = None
+
+@contextmanager
+def phase(name, n=1):
+    """Tempo del blocco sommato alla fase `name` dello scan in corso (n = elementi trattati, es. simboli o pagine)."""
+    m = CURRENT
+    if m is None:
+        yield; return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        m.add_phase(name, time.perf_counter() - t, n)
+
+def record_http(family, nbytes):
+    m = CURRENT
+    if m is not None: m.add_http(family, nbytes)
+
+@contextmanager
+def scan():
+    """Attiva un collettore per la durata del blocco; con SCAN_PROFILE=1 (cProfile) o =pyinstrument salva anche il profilo."""
+    global CURRENT
+    m, prev = ScanMetrics(), CURRENT
+    CURRENT = m
+    stop = _start_profiler(os.getenv("SCAN_PROFILE", "").strip().lower())
+    try:
+        yield m
+    finally:
+        m.duration = time.perf_counter() - m.t0
+        CURRENT = prev
+        if stop is not None: stop()
+
+def _start_profiler(kind):
+    if kind in ("", "0"):
+        return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    if kind == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument not installed; falling back to cProfile")
+        else:
+            prof = Profiler(); prof.start()
+            def stop():
+                prof.stop(); path = os.path.join(PROFILE_DIR, f"scan_{stamp}.html")
+                with open(path, "w") as f: f.write(prof.output_html())
+                print(f"Profile saved to {path}")
+            return stop
+    import cProfile
+    prof = cProfile.Profile(); prof.enable()
+    def stop():
+        prof.disable(); path = os.path.join(PROFILE_DIR, f"scan_{stamp}.prof")
+        prof.dump_stats(path)
+        print(f"Profile saved to {path} (python -m pstats {path})")
+    return stop
@@ -1,12 +1,116 @@
-import requests
+import atexit, os, queue, random, threading, time
+from contextlib import contextmanager
+import http_client
+
+MAX_LEN = 4096  # limite di Telegram per messaggio
 
 def send_telegram(token: str, chat_id: str, text: str):
     if not token or not chat_id:
         return
-    r = requests.post(f"https://api.telegram.org/bot{token}/sendMessage",
+    r = http_client.post(f"https://api.telegram.org/bot{token}/sendMessage",
                       json={"chat_id": chat_id, "text": text}, timeout=10)
     if r.status_code >= 300:
         try:
             print("Telegram error:", r.json())
         except Exception:
             print("Telegram error:", r.text)
+
+def split_messages(texts, limit=MAX_LEN, sep="\n\n"):
+    """Impacchetta più alert in messaggi <= limit caratteri; un alert troppo lungo va a capo sulle righe (o a taglio netto)."""
+    parts = []
+    for t in texts:
+        while len(t) > limit:
+            cut = t.rfind("\n", 0, limit)
+            cut = cut if cut > 0 else limit
+            parts.append(t[:cut]); t = t[cut:].lstrip("\n")
+        parts.append(t)
+    out, cur = [], ""
+    for p in parts:
+        if cur and len(cur) + len(sep) + len(p) > limit:
+            out.append(cur); cur = p
+        else:
+            cur = f"{cur}{sep}{p}" if cur else p
+    if cur: out.append(cur)
+    return out
+
+class TelegramNotifier:
+    """
+    Invio asincrono: send() mette il testo in coda e ritorna subito, un thread di background svuota la coda.
+    Gli alert arrivati entro `coalesce` secondi (o raccolti in un blocco batch()) partono in un solo messaggio,
+    spezzato a 4096 caratteri. Rate limit e 429 li gestisce solo http_client (famiglia "telegram"); errori di rete
+    e 5xx (che http_client non ritenta sui POST) si ritentano qui con backoff esponenziale. Il percorso di trading non aspetta mai Telegram.
+    """
+    def __init__(self, token, chat_id, coalesce=None, max_retries=None, maxsize=None):
+        self.token, self.chat_id = token, chat_id
+        self.coalesce = float(coalesce if coalesce is not None else os.environ.get("TELEGRAM_COALESCE_SECONDS", "1.0"))
+        self.max_retries = int(max_retries if max_retries is not None else os.environ.get("TELEGRAM_MAX_RETRIES", "5"))
+        self._q = queue.Queue(maxsize=int(maxsize or os.environ.get("TELEGRAM_QUEUE_MAX", "1000")))
+        self._local = threading.local()
+        self.dropped = 0
+        threading.Thread(target=self._worker, name="telegram-notifier", daemon=True).start()
+        atexit.register(self.flush)
+
+    def send(self, text: str):
+        held = getattr(self._local, "held", None)
+        if held is not None:
+            held.append(text); return
+        self._put([text])
+
+    @contextmanager
+    def batch(self):
+        """Gli alert inviati nel blocco (stesso thread) partono insieme all'uscita, come un solo messaggio."""
+        outer = getattr(self._local, "held", None)
+        self._local.held = [] if outer is None else outer
+        try:
+            yield
+        finally:
+            if outer is None:
+                held, self._local.held = self._local.held, None
+                if held: self._put(held)
+
+    def flush(self, timeout=10.0):
+        """Attende che la coda sia svuotata (al massimo timeout secondi); da chiamare prima di uscire."""
+        deadline = time.monotonic() + timeout
+        while self._q.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self._q.unfinished_tasks == 0
+
+    def _put(self, texts):
+        try:
+            self._q.put_nowait(texts)
+        except queue.Full:
+            self.dropped += len(texts)
+            print(f"Telegram queue full: dropped {len(texts)} alert(s)")
+
+    def _worker(self):
+        while True:
+            items = [self._q.get()]
+            deadline = time.monotonic() + self.coalesce
+            while True:
+                try:
+                    items.append(self._q.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                for msg in split_messages([t for texts in items for t in texts]):
+                    self._deliver(msg)
+            except Exception as e:
+                print("Telegram worker error:", e)
+            finally:
+                for _ in items: self._q.task_done()
+
+    def _deliver(self, text):
+        url = f"https://api.telegram.org/bot{self.token}/sendMessage"
+        for attempt in range(self.max_retries + 1):
+            try:
+                r = http_client.post(url, json={"chat_id": self.chat_id, "text": text}, timeout=10)
+                if r.status_code < 300: return True
+                if r.status_code < 500:      # 429 già ritentato da http_client
+                    print("Telegram error:", r.text); return False
+                err = f"HTTP {r.status_code}"
+            except Exception as e:
+                err = str(e)
+            if attempt < self.max_retries:
+                time.sleep(min(2 ** attempt, 60) * (0.5 + random.random() / 2))
+        print(f"Telegram error: giving up after {self.max_retries + 1} attempts ({err})")
+        return False
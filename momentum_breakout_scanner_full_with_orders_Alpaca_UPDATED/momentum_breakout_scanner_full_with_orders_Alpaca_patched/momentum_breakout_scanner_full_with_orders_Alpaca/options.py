@@ -1,4 +1,5 @@
-import os, requests
+import os
+import http_client
 ALP_ENV = os.environ.get("ALPACA_ENV","paper")
 ALPACA_TRADING_BASE = "https://paper-api.alpaca.markets" if ALP_ENV=="paper" else "https://api.alpaca.markets"
 
@@ -11,5 +12,5 @@ def _headers():
 def buy_call(option_symbol, qty=1, limit_px=None, tif="gtc"):
     body = {"symbol": option_symbol, "asset_class": "option", "side": "buy", "type": ("limit" if limit_px else "market"), "qty": str(qty), "time_in_force": tif}
     if limit_px: body["limit_price"] = float(limit_px)
-    r = requests.post(f"{ALPACA_TRADING_BASE}/v2/orders", json=body, headers=_headers(), timeout=15)
+    r = http_client.post(f"{ALPACA_TRADING_BASE}/v2/orders", json=body, headers=_headers(), timeout=15)
     r.raise_for_status(); return r.json()
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+FIELDS = ("open", "high", "low", "close", "volume")
+
+def _epoch_seconds(times) -> np.ndarray:
+    return np.asarray(pd.array(times).as_unit("s").asi8)
+
+class BarPanel:
+    """
+    Barre di più simboli impacchettate in matrici (tempo × simbolo), allineate a destra:
+    la riga -1 è l'ultima barra di ogni simbolo, le serie più corte hanno NaN in testa.
+    - t: epoch in secondi (int64, 0 = riga vuota)
+    - n: numero di barre valide per simbolo
+    """
+    __slots__ = ("symbols", "pos", "t", "open", "high", "low", "close", "volume", "n")
+
+    def __init__(self, symbols, t, open, high, low, close, volume, n):
+        self.symbols = list(symbols)
+        self.pos = {s: j for j, s in enumerate(self.symbols)}
+        self.t = t; self.open = open; self.high = high; self.low = low
+        self.close = close; self.volume = volume; self.n = n
+
+    @classmethod
+    def empty(cls, symbols, depth=0):
+        S = len(symbols)
+        return cls(symbols, np.zeros((depth, S), dtype=np.int64), *np.full((len(FIELDS), depth, S), np.nan),
+                   np.zeros(S, dtype=np.int64))
+
+    @classmethod
+    def from_frames(cls, frames, symbols, depth=None):
+        """frames: {symbol: DataFrame time/open/high/low/close/volume} (come fetch_bars_multi_symbols)."""
+        symbols = list(symbols)
+        cols = []
+        for sym in symbols:
+            df = frames.get(sym)
+            if df is None or df.empty:
+                cols.append(None); continue
+            if depth is not None: df = df.iloc[-depth:]
+            cols.append((_epoch_seconds(df["time"]), [df[c].to_numpy(dtype=float) for c in FIELDS]))
+        T = max([len(c[0]) for c in cols if c is not None], default=0)
+        P = cls.empty(symbols, T)
+        for j, c in enumerate(cols):
+            if c is None: continue
+            m = len(c[0]); P.n[j] = m
+            P.t[T-m:, j] = c[0]
+            for f, v in zip(FIELDS, c[1]): getattr(P, f)[T-m:, j] = v
+        return P
+
+    @classmethod
+    def from_long(cls, symbols, sym, t, values, depth=None):
+        """
+        Formato lungo (una riga per barra) ordinato per simbolo e tempo:
+        sym = simbolo di ogni riga, t = epoch secondi, values = {campo: array}.
+        """
+        symbols = list(symbols)
+        codes = pd.Index(symbols).get_indexer(np.asarray(sym, dtype=object))
+        keep = codes >= 0
+        codes = codes[keep]; t = np.asarray(t, dtype=np.int64)[keep]
+        S = len(symbols)
+        counts = np.bincount(codes, minlength=S)
+        # rango dalla fine di ogni gruppo contiguo: 0 = ultima barra del simbolo
+        change = np.flatnonzero(np.diff(codes)) + 1
+        ends = np.r_[change, len(codes)]
+        gid = np.zeros(len(codes), dtype=np.int64); gid[change] = 1; gid = np.cumsum(gid)
+        rank = ends[gid] - 1 - np.arange(len(codes)) if len(codes) else np.zeros(0, dtype=np.int64)
+        if depth is not None:
+            sel = rank < depth
+            codes, t, rank = codes[sel], t[sel], rank[sel]
+            counts = np.minimum(counts, depth)
+        else:
+            sel = slice(None)
+        T = int(counts.max()) if S else 0
+        P = cls.empty(symbols, T)
+        rows = T - 1 - rank
+        P.t[rows, codes] = t; P.n[:] = counts
+        for f in FIELDS:
+            getattr(P, f)[rows, codes] = np.asarray(values[f], dtype=float)[keep][sel]
+        return P
+
+    @property
+    def depth(self) -> int:
+        return self.t.shape[0]
+
+    def valid(self) -> np.ndarray:
+        """Maschera (tempo × simbolo) delle righe valide."""
+        return np.arange(self.depth)[:, None] >= (self.depth - self.n)[None, :]
+
+    def select(self, symbols, depth=None):
+        """Sotto-pannello con le colonne di `symbols` (vuote se assenti) e al massimo `depth` righe."""
+        symbols = list(symbols)
+        idx = np.array([self.pos.get(s, -1) for s in symbols], dtype=int)
+        T = self.depth if depth is None else min(depth, self.depth)
+        P = BarPanel.empty(symbols, T)
+        have = idx >= 0
+        if T and have.any():
+            P.t[:, have] = self.t[self.depth-T:, idx[have]]
+            for f in FIELDS: getattr(P, f)[:, have] = getattr(self, f)[self.depth-T:, idx[have]]
+        P.n[have] = np.minimum(self.n[idx[have]], T)
+        return P
+
+    def series(self, sym, field="close") -> np.ndarray:
+        j = self.pos[sym]
+        return getattr(self, field)[self.depth - self.n[j]:, j]
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Server websocket locale che riproduce barre registrate (cache state/bars.db) con il protocollo
+del feed dati Alpaca v2 (connected -> auth -> subscribe -> messaggi {"T":"b",...}).
+Serve a provare la modalità STREAM=1 offline.
+
+Esempio:
+  python replay_server.py --timeframe 1Hour --start 2025-10-01 --end 2025-10-31 --speed 0.2
+  STREAM=1 STREAM_OFFLINE=1 STREAM_RECONNECT=0 STREAM_WARMUP_END=2025-10-01 \
+    ALPACA_STREAM_URL=ws://localhost:8765 python scanner.py
+"""
+import argparse, asyncio, json
+import pandas as pd
+import websockets
+from bar_cache import BarCache, BARS_DB_PATH
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=BARS_DB_PATH, help="cache barre (SQLite)")
+    ap.add_argument("--timeframe", default="1Hour", help="timeframe registrato da riprodurre (1Hour, 1Min, ...)")
+    ap.add_argument("--start", required=True, help="inizio replica (ISO, UTC)")
+    ap.add_argument("--end", required=True, help="fine replica (ISO, UTC)")
+    ap.add_argument("--host", default="localhost")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--speed", type=float, default=0.0, help="secondi di attesa tra un timestamp e il successivo")
+    return ap.parse_args()
+
+def _ts(x) -> pd.Timestamp:
+    t = pd.Timestamp(x)
+    return t.tz_localize("UTC") if t.tzinfo is None else t.tz_convert("UTC")
+
+def load_messages(cache, symbols, timeframe, start, end):
+    """Barre raggruppate per timestamp, già nel formato dei messaggi Alpaca."""
+    frames = cache.load(symbols, timeframe, start, end)
+    rows = []
+    for sym, df in frames.items():
+        for r in df.itertuples(index=False):
+            rows.append((r.time, {"T": "b", "S": sym, "o": r.open, "h": r.high, "l": r.low, "c": r.close,
+                                  "v": r.volume, "t": r.time.strftime("%Y-%m-%dT%H:%M:%SZ")}))
+    rows.sort(key=lambda x: x[0])
+    batches = []
+    for t, m in rows:
+        if batches and batches[-1][0] == t: batches[-1][1].append(m)
+        else: batches.append((t, [m]))
+    return [b for _, b in batches]
+
+def make_handler(args):
+    cache = BarCache(args.db)
+    start, end = _ts(args.start), _ts(args.end)
+
+    async def handler(ws, path=None):
+        await ws.send(json.dumps([{"T": "success", "msg": "connected"}]))
+        json.loads(await ws.recv())
+        await ws.send(json.dumps([{"T": "success", "msg": "authenticated"}]))
+        sub = json.loads(await ws.recv())
+        symbols = sub.get("bars", [])
+        await ws.send(json.dumps([{"T": "subscription", "trades": [], "quotes": [], "bars": symbols}]))
+        if "*" in symbols:
+            symbols = [r[0] for r in cache._conn.execute("SELECT DISTINCT symbol FROM bars WHERE timeframe=?", (args.timeframe,))]
+        batches = load_messages(cache, symbols, args.timeframe, start, end)
+        print(f"Replaying {sum(len(b) for b in batches)} bars ({len(batches)} timestamps) for {len(symbols)} symbols")
+        for batch in batches:
+            await ws.send(json.dumps(batch))
+            if args.speed > 0: await asyncio.sleep(args.speed)
+        await ws.close()
+    return handler
+
+async def main():
+    args = parse_args()
+    async with websockets.serve(make_handler(args), args.host, args.port, max_size=None):
+        print(f"Replay server on ws://{args.host}:{args.port}")
+        await asyncio.Future()
+
+if __name__ == "__main__":
+    asyncio.run(main())
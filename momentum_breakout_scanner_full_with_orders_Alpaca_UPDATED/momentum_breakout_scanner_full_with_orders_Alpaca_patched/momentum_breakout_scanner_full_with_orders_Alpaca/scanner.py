@@ -1,25 +1,15 @@
 
-def _alp_headers():
-    import os
-    return {"APCA-API-KEY-ID": os.getenv("ALPACA_API_KEY",""),
-            "APCA-API-SECRET-KEY": os.getenv("ALPACA_API_SECRET","")}
-
 def _alpaca_clock_open():
     try:
-        r = requests.get("https://paper-api.alpaca.markets/v2/clock", headers=_alp_headers(), timeout=10)
-        r.raise_for_status()
-        return r.json().get("is_open", False)
+        return bool(get_clock().get("is_open", False))
     except Exception:
         return False
 
 def _open_positions_count():
     try:
-        r = requests.get("https://paper-api.alpaca.markets/v2/positions", headers=_alp_headers(), timeout=10)
-        if r.status_code == 200:
-            return len(r.json())
+        return len(get_positions())
     except Exception:
-        pass
-    return 0
+        return 0
 
 def _compute_notional():
     equity = float(get_account_equity() or 0.0)
@@ -37,50 +27,74 @@ def _compute_notional():
     return n
 
 def place_order_from_signal(sym, side, entry_type, entry_px, tp_px, sl_px):
-    if cfg_get("useLongOnly", False) and side.lower() == "sell":
-        notify(f"SKIP {sym}: long-only mode")
-        return None
+    res = place_orders_from_signals([(sym, side, entry_type, entry_px, tp_px, sl_px)])[0]
+    if isinstance(res, Exception): raise res
+    return res
 
-    if cfg_get("rthOnly", True) and not _alpaca_clock_open():
-        if cfg_get("retryMissedSignals", True):
-            enqueue(sym, side, {"entry_type":entry_type, "entry_px":entry_px, "tp_px":tp_px, "sl_px":sl_px})
-            notify(f"QUEUED {sym}: market closed")
-            return "queued"
-        else:
-            notify(f"SKIP {sym}: market closed")
-            return None
-
-    if _open_positions_count() >= int(cfg_get("maxConcurrentPositions",5) or 5):
-        if cfg_get("retryMissedSignals", True):
-            enqueue(sym, side, {"entry_type":entry_type, "entry_px":entry_px, "tp_px":tp_px, "sl_px":sl_px})
-            notify(f"QUEUED {sym}: max positions reached")
-            return "queued"
+def _queue_or_skip(queued, sym, side, payload, reason):
+    if cfg_get("retryMissedSignals", True):
+        queued.append((sym, side, payload))
+        notify(f"QUEUED {sym}: {reason}")
+        return "queued"
+    notify(f"SKIP {sym}: {reason}")
+    return None
+
+def place_orders_from_signals(signals):
+    """
+    Come place_order_from_signal per N segnali (sym, side, entry_type, entry_px, tp_px, sl_px):
+    clock, posizioni e account letti una volta, ordini inviati insieme con place_bracket_batch.
+    Ritorna una lista allineata: risposta ordine, "queued", None (scartato) o l'eccezione dell'invio.
+    """
+    out = [None] * len(signals); todo = []; queued = []
+    closed = bool(cfg_get("rthOnly", True)) and not _alpaca_clock_open()
+    slots = int(cfg_get("maxConcurrentPositions",5) or 5) - (0 if closed else _open_positions_count())
+    for i, (sym, side, entry_type, entry_px, tp_px, sl_px) in enumerate(signals):
+        if cfg_get("useLongOnly", False) and side.lower() == "sell":
+            notify(f"SKIP {sym}: long-only mode")
+            continue
+        payload = {"entry_type":entry_type, "entry_px":entry_px, "tp_px":tp_px, "sl_px":sl_px}
+        if closed:
+            out[i] = _queue_or_skip(queued, sym, side, payload, "market closed")
+        elif slots <= 0:
+            out[i] = _queue_or_skip(queued, sym, side, payload, "max positions reached")
         else:
-            notify(f"SKIP {sym}: max positions reached")
-            return None
+            slots -= 1; todo.append(i)
+    if queued: enqueue_many(queued)
+    if not todo: return out
 
-    notional = _compute_notional()
+    try:
+        notional = _compute_notional()
+    except Exception as e:
+        for i in todo: out[i] = e     # account non leggibile: i segnali in coda tornano disponibili (release)
+        return out
     tif = cfg_get("time_in_force", "gtc") or "gtc"
-    res = place_bracket_equity(sym, side, qty=None, entry_type=entry_type, entry_px=entry_px,
-                               tp_px=tp_px, sl_px=sl_px, tif=tif, extended=False, client_id=None, notional=notional)
-    notify(f"ORDER sent (bracket): {sym} notional={notional:.2f} entry={entry_px} tp={tp_px} sl={sl_px}")
-    return res
+    orders = [dict(symbol=signals[i][0], side=signals[i][1], qty=None, entry_type=signals[i][2], entry_px=signals[i][3],
+                   tp_px=signals[i][4], sl_px=signals[i][5], tif=tif, extended=False, client_id=None, notional=notional)
+              for i in todo]
+    for i, o, res in zip(todo, orders, place_bracket_batch(orders)):
+        out[i] = res
+        if not isinstance(res, Exception):
+            notify(f"ORDER sent (bracket): {o['symbol']} notional={notional:.2f} entry={o['entry_px']} tp={o['tp_px']} sl={o['sl_px']}")
+    return out
 
 def process_queued_signals():
     ttl_min = int(cfg_get("signalQueueTTLMinutes", 240) or 0)
     ttl_sec = ttl_min * 60
     if cfg_get("rthOnly", True) and not _alpaca_clock_open():
         return 0
-    processed = 0
-    for sid, sym, side, payload in fetch_due(ttl_sec):
-        try:
-            place_order_from_signal(sym, side, payload.get("entry_type"), payload.get("entry_px"),
-                                    payload.get("tp_px"), payload.get("sl_px"))
-            mark_done(sid, "sent")
-            processed += 1
-        except Exception as e:
-            notify(f"RETRY LATER {sym}: {e}")
-    return processed
+    due = fetch_due(ttl_sec, limit=int(cfg_get("signalQueueBatch", 50) or 50))
+    results = place_orders_from_signals([(sym, side, p.get("entry_type"), p.get("entry_px"), p.get("tp_px"), p.get("sl_px"))
+                                         for _, sym, side, p in due])
+    done, retry = [], []
+    for (sid, sym, _, _), res in zip(due, results):
+        if isinstance(res, Exception):
+            notify(f"RETRY LATER {sym}: {res}")
+            retry.append(sid)
+            continue
+        done.append(sid)
+    if done: mark_many(done, "sent")
+    if retry: release(retry)
+    return len(done)
 
 
 CFG_DEFAULTS = {
@@ -92,7 +106,8 @@ CFG_DEFAULTS = {
     "maxNotional": None,
     "maxConcurrentPositions": 5,
     "retryMissedSignals": True,
-    "signalQueueTTLMinutes": 240
+    "signalQueueTTLMinutes": 240,
+    "signalQueueBatch": 50
 }
 def cfg_get(name, fallback=None):
     try:
@@ -101,15 +116,20 @@ def cfg_get(name, fallback=None):
         return CFG_DEFAULTS.get(name, fallback)
 
 import json
-from signal_queue import enqueue, fetch_due, mark_done
-from trade import get_account_equity, place_bracket_equity
-import os, time, json, sys, yaml
+from signal_queue import enqueue_many, fetch_due, mark_many, release
+from trade import get_account_equity, get_clock, get_positions, place_bracket_batch, bracket_prices, calc_equity_qty
+import os, time, json, sys, yaml, requests
 import pandas as pd
 from dotenv import load_dotenv
-from signals import compute_signals_for_symbols
-from notify.telegram import send_telegram
-from db import init_db, insert_signal
-from trade import place_bracket_equity
+from signals import compute_signals_for_symbols, DailyScreen
+import metrics
+from notify.telegram import TelegramNotifier
+from contextlib import nullcontext
+from db import init_db, insert_signals, insert_scan_metrics
+from bar_cache import BarCache
+from data_service import DataServiceReader
+from intrabar import IntrabarCache, tf_seconds
+from market_clock import MarketClock
 
 load_dotenv()
 with open("config.yaml", "r") as f:
@@ -120,6 +140,8 @@ ALPACA_SEC = os.getenv("ALPACA_API_SECRET")
 TG_TOKEN   = os.getenv("TELEGRAM_BOT_TOKEN")
 TG_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 TELEGRAM_ENABLED = bool(TG_TOKEN and TG_CHAT_ID and os.getenv("TELEGRAM_SILENT","0") != "1")
+# invio in background: notify() non aspetta mai la rete, gli alert di uno scan partono come un solo messaggio
+NOTIFIER = TelegramNotifier(TG_TOKEN, TG_CHAT_ID) if TELEGRAM_ENABLED else None
 
 if not (ALPACA_KEY and ALPACA_SEC):
     print("Missing Alpaca API keys in environment (.env)."); sys.exit(1)
@@ -130,6 +152,24 @@ if not os.path.exists(STATE_PATH):
     with open(STATE_PATH, "w") as f: json.dump({}, f)
 
 init_db()
+BAR_CACHE = BarCache() if CFG.get("barCache", True) else None
+# scan a due stadi: filtri giornalieri una volta al giorno, barre orarie solo per i simboli che possono scattare
+DAILY_SCREEN = DailyScreen() if CFG.get("dailyScreen", False) else None
+# trigger intrabar: tra due scan completi la barra in corso si ricontrolla dagli snapshot (WATCH=1)
+INTRABAR_EVERY = int(CFG.get("intrabarEverySeconds", 0) or 0)
+SCAN_TIERS = [(float(t["maxDistPct"]), int(t.get("everySeconds", 0) or 0)) for t in CFG.get("scanTiers") or []]
+# calendario e orologio del mercato (WATCH=1): scan allineati alle barre in seduta, "adesso" corretto sullo scarto col server
+MARKET_CLOCK = MarketClock(extended=bool(CFG.get("scanExtendedHours", False)))
+INTRABAR = (IntrabarCache(CFG.get("timeframe", "1Hour"), tiers=SCAN_TIERS, clock=MARKET_CLOCK.now)
+            if INTRABAR_EVERY > 0 and not CFG.get("confirmOnClose", True) and tf_seconds(CFG.get("timeframe", "1Hour"))
+            else None)
+# barre lette dal servizio dati condiviso (data_service.py) invece di scaricarle in ogni istanza: solo pannelli
+# aggiornati almeno all'ultimo confine di barra (se serve si aspetta il servizio, al massimo DATA_SERVICE_WAIT secondi)
+SCAN_STEP = int(CFG.get("scanEveryMinutes", 60)) * 60
+SCAN_STEP = min(SCAN_STEP, tf_seconds(CFG.get("timeframe", "1Hour")) or SCAN_STEP)
+DATA_SERVICE = (DataServiceReader(os.environ["DATA_SERVICE_PATH"], max_age=os.getenv("DATA_SERVICE_MAX_AGE", SCAN_STEP + 60),
+                                  since=lambda: MARKET_CLOCK.last_boundary(SCAN_STEP))
+                if os.getenv("DATA_SERVICE_PATH") else None)
 
 def load_tickers():
     df = pd.read_csv("tickers.csv").dropna()
@@ -146,30 +186,67 @@ def save_state(state):
     with open(STATE_PATH, "w") as f: json.dump(state, f, indent=2)
 
 def notify(text: str):
-    if TELEGRAM_ENABLED: send_telegram(TG_TOKEN, TG_CHAT_ID, text)
+    if NOTIFIER is not None: NOTIFIER.send(text)
     else: print("\n=== ALERT / INFO ===\n" + text + "\n====================\n")
 
-def calc_equity_qty(account_equity_usd: float, risk_pct: float, entry_px: float, stop_px: float):
-    risk_value = account_equity_usd * (risk_pct/100.0)
-    per_share_risk = max(abs(entry_px - stop_px), 1e-4)
-    qty = int(risk_value // per_share_risk)
-    return max(qty, 1)
-
-def run_scan():
+def load_universe():
     tickers_df = load_tickers()
     symbols = tickers_df["Symbol"].tolist()
     bench_map = {row["Symbol"]: (row["Benchmark"] if row["Benchmark"] and row["Benchmark"] != "-" else "SPY") for _, row in tickers_df.iterrows()}
+    return symbols, bench_map
 
-    results = compute_signals_for_symbols(
-        symbols=symbols, bench_map=bench_map, alpaca_key=ALPACA_KEY, alpaca_sec=ALPACA_SEC,
+def signal_params():
+    return dict(
         timeframe=CFG.get("timeframe","1Hour"), base_len_days=int(CFG.get("baseLenDays",12)),
         donch_len_hours=int(CFG.get("donchLenHours",288)), rv_min=float(CFG.get("rvMin",2.5)),
         confirm_on_close=bool(CFG.get("confirmOnClose", True)), use_high_intrabar=bool(CFG.get("useHighIntrabar", False)),
         use_1030_et=bool(CFG.get("use1030ET", False)), show_pre_signal=bool(CFG.get("showPreSignal", False)),
-        pre_buffer_pct=float(CFG.get("preBufferPct", 0.3)), batch_size=int(CFG.get("batchSize", 80)),
+        pre_buffer_pct=float(CFG.get("preBufferPct", 0.3)),
     )
 
-    state = load_state(); alerts_sent = 0; enable_trading = bool(CFG.get("enableTrading", False))
+def run_scan():
+    with metrics.scan() as m:
+        with metrics.phase("tickers"):
+            symbols, bench_map = load_universe()
+
+        results = compute_signals_for_symbols(
+            symbols=symbols, bench_map=bench_map, alpaca_key=ALPACA_KEY, alpaca_sec=ALPACA_SEC,
+            batch_size=int(CFG.get("batchSize", 80)),
+            bar_cache=BAR_CACHE, fetch_concurrency=int(CFG.get("fetchConcurrency", 4)), data_service=DATA_SERVICE,
+            daily_screen=DAILY_SCREEN, intrabar=INTRABAR, **signal_params(),
+        )
+
+        alerts_sent = handle_results(results)
+    print(f"Scan complete. Alerts sent: {alerts_sent}")
+    print(m.summary())
+    if CFG.get("scanMetrics", True):
+        insert_scan_metrics(m.as_row(), len(symbols), alerts_sent)
+    if alerts_sent == 0:
+        print_pre_signals(results)
+
+def run_intrabar_check():
+    """Ricontrollo della barra in corso da snapshot; False se la barra dei livelli in cache è chiusa (serve uno scan completo)."""
+    t0 = time.perf_counter()
+    results = INTRABAR.check(ALPACA_KEY, ALPACA_SEC)
+    if results is None:
+        return False
+    if results:
+        alerts_sent = handle_results(results)
+        tiers = ", ".join(f"{f'{e}s' if e else 'scan'}:{n}" for e, n in sorted(INTRABAR.tier_counts().items()))
+        print(f"Intrabar check: {len(results)} symbols, alerts sent: {alerts_sent} ({time.perf_counter() - t0:.2f}s; tiers {tiers})")
+    return True
+
+def handle_results(results):
+    """Alert, DB e ordini per i segnali LONG/SHORT nuovi (dedup per simbolo/lato/barra in state.json)."""
+    with (NOTIFIER.batch() if NOTIFIER is not None else nullcontext()):
+        return _handle_results(results)
+
+def _handle_results(results):
+    with metrics.phase("state_io"):
+        state = load_state()
+    alerts_sent = 0; enable_trading = bool(CFG.get("enableTrading", False))
+    orders = []  # inviati tutti insieme su un solo snapshot dell'account
+    rows = []    # segnali da registrare nel DB, un solo executemany a fine scan
     for sym, res in results.items():
         for side in ("LONG","SHORT"):
             if not res.get(side, False): continue
@@ -181,57 +258,86 @@ def run_scan():
                 f"Bias3D: {res.get('ema_bias','?')} | RS: {res.get('rs_dir','?')} | Trend200D: {res.get('trend_ok','?')}",
                 f"Trigger: {res.get('trigger_info','')}"
             ]
-            notify("\n".join([p for p in parts if p]))
-            insert_signal(sym, side, res.get("rv_val"), res.get("trigger_info"), res.get("debug",{}).get("hh"), res.get("debug",{}).get("ll"), CFG)
+            with metrics.phase("notify"):
+                notify("\n".join([p for p in parts if p]))
+            rows.append((sym, side, res.get("rv_val"), res.get("trigger_info"), res.get("debug",{}).get("hh"), res.get("debug",{}).get("ll")))
             if enable_trading:
-                entry_px = res.get("debug",{}).get("hh") if side=="LONG" else res.get("debug",{}).get("ll")
-                if entry_px is None or entry_px==0: entry_px = res.get("debug",{}).get("last_close", 0.0)
-                sl_px = entry_px * (0.99 if side=="LONG" else 1.01)
-                rr = float(CFG.get("partialAtR", 2.0))
-                tp_px = entry_px * (1 + 0.01*rr*2) if side=="LONG" else entry_px * (1 - 0.01*rr*2)
+                entry_px, sl_px, tp_px = bracket_prices(res.get("debug",{}), side, float(CFG.get("partialAtR", 2.0)))
                 qty = calc_equity_qty(100000.0, float(CFG.get("riskPct",1.0)), entry_px, sl_px)
-                try:
-                    place_bracket_equity(symbol=sym, side=("buy" if side=="LONG" else "sell"), qty=qty, entry_type="limit", entry_px=entry_px, tp_px=tp_px, sl_px=sl_px)
-                    notify(f"ORDER sent (bracket): {sym} qty={qty} entry={entry_px} tp={tp_px} sl={sl_px}")
-                except Exception as e:
-                    msg = str(e)
-                    try:
-                        import requests
-                        if isinstance(e, requests.HTTPError) and getattr(e, "response", None):
-                            msg = e.response.text
-                    except Exception:
-                        pass
-                    notify(f"ORDER error: {sym} {msg}")
+                orders.append(dict(symbol=sym, side=("buy" if side=="LONG" else "sell"), qty=qty, entry_type="limit", entry_px=entry_px, tp_px=tp_px, sl_px=sl_px))
             state[key] = last_ts; alerts_sent += 1
-    save_state(state)
-    print(f"Scan complete. Alerts sent: {alerts_sent}")
-    if alerts_sent == 0:
-        pre_lines = []
-        for sym, res in results.items():
-            if res.get("pre_long") or res.get("pre_short"):
-                d = res.get("debug", {})
-                side = "LONG" if res.get("pre_long") else "SHORT"
-                pre_lines.append(f"{sym} PRE-{side} | rv={d.get('rv_val')} hh={d.get('hh')} ll={d.get('ll')} dist_up%={d.get('dist_up_pct')} dist_dn%={d.get('dist_down_pct')}")
-        if pre_lines:
-            print("\n--- PRE-SIGNALS ---\n" + "\n".join(pre_lines))
+    if rows:
+        with metrics.phase("db"):
+            insert_signals(rows, CFG)
+    placed = []
+    if orders:
+        with metrics.phase("orders", len(orders)):
+            placed = place_bracket_batch(orders)
+    for o, r in zip(orders, placed):
+        if isinstance(r, Exception):
+            msg = str(r)
+            if isinstance(r, requests.HTTPError) and getattr(r, "response", None) is not None:
+                msg = r.response.text
+            notify(f"ORDER error: {o['symbol']} {msg}")
         else:
-            import random
-            sample = random.sample(list(results.items()), k=min(5, len(results)))
-            print("\n--- DEBUG SAMPLE (5) ---")
-            for sym, res in sample:
-                d = res.get("debug", {})
-                print(f"{sym}: Lbias={d.get('ema_bias_long')} RSup={d.get('rs_up')} T200L={d.get('trend_ok_long')} BU={d.get('break_up')} RVok={d.get('rv_ok')} rv={d.get('rv_val')}")
+            notify(f"ORDER sent (bracket): {o['symbol']} qty={o['qty']} entry={o['entry_px']} tp={o['tp_px']} sl={o['sl_px']}")
+    with metrics.phase("state_io"):
+        save_state(state)
+    return alerts_sent
+
+def print_pre_signals(results):
+    pre_lines = []
+    for sym, res in results.items():
+        if res.get("pre_long") or res.get("pre_short"):
+            d = res.get("debug", {})
+            side = "LONG" if res.get("pre_long") else "SHORT"
+            pre_lines.append(f"{sym} PRE-{side} | rv={d.get('rv_val')} hh={d.get('hh')} ll={d.get('ll')} dist_up%={d.get('dist_up_pct')} dist_dn%={d.get('dist_down_pct')}")
+    if pre_lines:
+        print("\n--- PRE-SIGNALS ---\n" + "\n".join(pre_lines))
+    else:
+        import random
+        sample = random.sample(list(results.items()), k=min(5, len(results)))
+        print("\n--- DEBUG SAMPLE (5) ---")
+        for sym, res in sample:
+            d = res.get("debug", {})
+            print(f"{sym}: Lbias={d.get('ema_bias_long')} RSup={d.get('rs_up')} T200L={d.get('trend_ok_long')} BU={d.get('break_up')} RVok={d.get('rv_ok')} rv={d.get('rv_val')}")
+
+def run_stream_mode():
+    from stream import run_stream
+    symbols, bench_map = load_universe()
+    run_stream(symbols, bench_map, signal_params(), ALPACA_KEY, ALPACA_SEC, on_results=handle_results,
+               bar_cache=BAR_CACHE, batch_size=int(CFG.get("batchSize", 80)),
+               fetch_concurrency=int(CFG.get("fetchConcurrency", 4)),
+               warmup_end=os.getenv("STREAM_WARMUP_END") or None, offline=os.getenv("STREAM_OFFLINE","0") == "1",
+               reconnect=os.getenv("STREAM_RECONNECT","1") == "1",
+               save_every=int(os.getenv("STREAM_STATE_EVERY", "300")))
 
 if __name__ == "__main__":
     watch = os.getenv("WATCH","0") == "1"
-    if not watch:
+    if os.getenv("STREAM","0") == "1":
+        run_stream_mode()
+    elif not watch:
         run_scan()
     else:
         import sys
-        interval = int(CFG.get("scanEveryMinutes",60))
+        # scan allineati alla chiusura delle barre, solo in seduta (calendario Alpaca, chiusure anticipate comprese)
+        clock = MARKET_CLOCK
+        clock.sessions()    # calendario e scarto dell'orologio prima del primo scan
+        every = SCAN_STEP
+        delay = float(CFG.get("scanDelaySeconds", 3))
         while True:
             try:
                 run_scan()
             except Exception as e:
                 print("Scan error:", e, file=sys.stderr)
-            time.sleep(interval * 60)
+            next_scan = clock.next_fire(every, delay)
+            if not clock.in_session():
+                print(f"Market closed: next scan at {pd.Timestamp(next_scan, unit='s', tz='America/New_York'):%Y-%m-%d %H:%M:%S %Z}")
+            # tra uno scan e l'altro: ricontrolli intrabar da snapshot, solo in seduta; alla chiusura della barra parte lo scan
+            while INTRABAR is not None and clock.in_session() and clock.now() + INTRABAR_EVERY < next_scan:
+                time.sleep(INTRABAR_EVERY)
+                try:
+                    if not run_intrabar_check(): break
+                except Exception as e:
+                    print("Intrabar check error:", e, file=sys.stderr)
+            clock.sleep_until(next_scan)
@@ -1,38 +1,115 @@
 
-import os, sqlite3, time, json
+import atexit, os, sqlite3, threading, time, json, uuid
+from contextlib import contextmanager
 
 DB_PATH = os.environ.get("SIGNALS_DB_PATH", os.path.join(os.path.dirname(__file__), "signals.db"))
 
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS pending_signals (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  symbol TEXT NOT NULL,
+  side TEXT NOT NULL,
+  payload TEXT NOT NULL,
+  created_ts INTEGER NOT NULL,
+  status TEXT NOT NULL DEFAULT 'queued'
+);
+"""
+
+# colonne aggiunte dopo la prima versione: ALTER TABLE sui DB esistenti
+MIGRATIONS = (
+    ("priority", "ALTER TABLE pending_signals ADD COLUMN priority INTEGER NOT NULL DEFAULT 0"),
+    ("lease_id", "ALTER TABLE pending_signals ADD COLUMN lease_id TEXT"),
+    ("lease_until", "ALTER TABLE pending_signals ADD COLUMN lease_until INTEGER"),
+)
+
+INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_pending_status_created ON pending_signals(status, created_ts);
+CREATE INDEX IF NOT EXISTS idx_pending_due ON pending_signals(status, priority DESC, created_ts, id);
+CREATE INDEX IF NOT EXISTS idx_pending_lease ON pending_signals(status, lease_until);
+CREATE INDEX IF NOT EXISTS idx_pending_symbol ON pending_signals(symbol);
+"""
+
+LEASE_SECONDS = int(os.environ.get("SIGNAL_LEASE_SECONDS", "120"))
+
+# Connessione persistente: WAL e schema una volta per processo, accesso serializzato dal lock
+_c, _lock = None, threading.Lock()
+
 def _conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("CREATE TABLE IF NOT EXISTS pending_signals (         id INTEGER PRIMARY KEY AUTOINCREMENT,         symbol TEXT NOT NULL,         side TEXT NOT NULL,         payload TEXT NOT NULL,         created_ts INTEGER NOT NULL,         status TEXT NOT NULL DEFAULT 'queued'     )")
-    conn.commit()
-    return conn
-
-def enqueue(symbol:str, side:str, payload:dict):
-    c = _conn()
-    c.execute("INSERT INTO pending_signals(symbol, side, payload, created_ts, status) VALUES (?,?,?,?,?)",
-              (symbol, side, json.dumps(payload), int(time.time()), "queued"))
-    c.commit()
-    c.close()
-
-def fetch_due(ttl_seconds:int):
+    global _c
+    if _c is None:
+        # autocommit: le transazioni si aprono esplicitamente (BEGIN IMMEDIATE per il lease)
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.executescript(SCHEMA_SQL)
+        conn.execute("BEGIN IMMEDIATE")  # più processi possono migrare lo stesso DB insieme
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(pending_signals)")}
+        for col, ddl in MIGRATIONS:
+            if col not in cols: conn.execute(ddl)
+        conn.execute("COMMIT")
+        conn.executescript(INDEX_SQL)
+        _c = conn
+    return _c
+
+@atexit.register
+def close():
+    global _c
+    with _lock:
+        if _c is not None: _c.close(); _c = None
+
+@contextmanager
+def _tx(immediate=False):
+    """Transazione esplicita; IMMEDIATE prende subito il lock di scrittura (serializza i worker di più processi)."""
+    with _lock:
+        c = _conn()
+        c.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield c
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+
+def enqueue(symbol:str, side:str, payload:dict, priority:int=0):
+    enqueue_many([(symbol, side, payload)], priority)
+
+def enqueue_many(items, priority:int=0):
+    """items: (symbol, side, payload) accodati in una sola transazione; priority più alta = servito prima."""
     now = int(time.time())
-    c = _conn()
-    rows = c.execute("SELECT id, symbol, side, payload, created_ts FROM pending_signals WHERE status='queued'").fetchall()
-    out = []
-    for rid, sym, side, payload, created in rows:
-        if ttl_seconds <= 0 or now - int(created) <= ttl_seconds:
-            out.append((rid, sym, side, json.loads(payload)))
-        else:
-            c.execute("UPDATE pending_signals SET status='expired' WHERE id=?", (rid,))
-    c.commit()
-    c.close()
-    return out
+    with _tx() as c:
+        c.executemany("INSERT INTO pending_signals(symbol, side, payload, created_ts, status, priority) VALUES (?,?,?,?,?,?)",
+                      [(sym, side, json.dumps(payload), now, "queued", int(priority)) for sym, side, payload in items])
+
+def fetch_due(ttl_seconds:int, limit:int=50, lease_seconds:int=LEASE_SECONDS):
+    """
+    Prende in lease fino a `limit` segnali dovuti (priorità, poi ordine di arrivo), in una transazione IMMEDIATE:
+    due worker non ricevono mai la stessa riga. Prima, con UPDATE indicizzati: i lease scaduti tornano in coda
+    e le righe più vecchie di ttl_seconds passano a 'expired'. Le righe restituite vanno chiuse con
+    mark_done/mark_many oppure rimesse in coda con release.
+    """
+    now = int(time.time()); lease = uuid.uuid4().hex
+    with _tx(immediate=True) as c:
+        c.execute("UPDATE pending_signals SET status='queued', lease_id=NULL, lease_until=NULL "
+                  "WHERE status='leased' AND lease_until < ?", (now,))
+        if ttl_seconds > 0:
+            c.execute("UPDATE pending_signals SET status='expired' WHERE status='queued' AND created_ts < ?",
+                      (now - int(ttl_seconds),))
+        c.execute("UPDATE pending_signals SET status='leased', lease_id=?, lease_until=? WHERE id IN ("
+                  "SELECT id FROM pending_signals WHERE status='queued' ORDER BY priority DESC, created_ts, id LIMIT ?)",
+                  (lease, now + int(lease_seconds), int(limit)))
+        rows = c.execute("SELECT id, symbol, side, payload FROM pending_signals WHERE lease_id=? AND status='leased' "
+                         "ORDER BY priority DESC, created_ts, id", (lease,)).fetchall()
+    return [(rid, sym, side, json.loads(payload)) for rid, sym, side, payload in rows]
 
 def mark_done(signal_id:int, status:str="sent"):
-    c = _conn()
-    c.execute("UPDATE pending_signals SET status=? WHERE id=?", (status, signal_id))
-    c.commit()
-    c.close()
+    mark_many([signal_id], status)
+
+def mark_many(signal_ids, status:str="sent"):
+    with _tx() as c:
+        c.executemany("UPDATE pending_signals SET status=?, lease_id=NULL, lease_until=NULL WHERE id=?",
+                      [(status, sid) for sid in signal_ids])
+
+def release(signal_ids):
+    """Rimette in coda righe in lease (invio fallito): torneranno nel prossimo fetch_due."""
+    with _tx() as c:
+        c.executemany("UPDATE pending_signals SET status='queued', lease_id=NULL, lease_until=NULL "
+                      "WHERE id=? AND status='leased'", [(sid,) for sid in signal_ids])
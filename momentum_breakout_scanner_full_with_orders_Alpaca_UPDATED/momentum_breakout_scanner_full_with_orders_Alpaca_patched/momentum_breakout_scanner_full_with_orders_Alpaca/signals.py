@@ -1,28 +1,64 @@
-import math, pytz, requests
+import hashlib, json, math, os, pytz
+import http_client, metrics
 import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from panel import BarPanel
+from indicators import ema, last_mean, last_slope, rolling_slope
 
 ALPACA_BASE = "https://data.alpaca.markets"
+DAILY_SCREEN_PATH = os.environ.get("DAILY_SCREEN_PATH", "state/daily_screen.npz")
+NY = pytz.timezone("America/New_York")
 
 def _alpaca_headers(key, sec):
     return {"APCA-API-KEY-ID": key, "APCA-API-SECRET-KEY": sec}
 
-def _ny_time(ts_utc): return ts_utc.astimezone(pytz.timezone("America/New_York"))
+def _ny_time(ts_utc): return ts_utc.astimezone(NY)
+
+def _ny_day_start(ts_utc):
+    """Mezzanotte di New York (in UTC) del giorno di ts_utc: le barre giornaliere Alpaca hanno questo timestamp."""
+    d = _ny_time(ts_utc).date()
+    return NY.localize(datetime(d.year, d.month, d.day)).astimezone(timezone.utc)
 
 def _tf_norm(tf: str) -> str:
     tf = (tf or "").strip()
     return {"1H":"1Hour","1h":"1Hour","1hour":"1Hour"}.get(tf, tf)
 
-def fetch_bars_multi_symbols(symbols, timeframe, start_iso, end_iso, key, sec):
+def fetch_bars_multi_symbols(symbols, timeframe, start_iso, end_iso, key, sec, cache=None):
+    if cache is None:
+        return _download_bars(symbols, timeframe, start_iso, end_iso, key, sec)
+    sync_bar_cache(symbols, timeframe, start_iso, end_iso, key, sec, cache)
+    return cache.load(symbols, timeframe, pd.Timestamp(start_iso), pd.Timestamp(end_iso))
+
+def sync_bar_cache(symbols, timeframe, start_iso, end_iso, key, sec, cache):
+    """Porta la cache al passo: scarica solo la coda mancante (o tutto, una volta al giorno)."""
+    start = pd.Timestamp(start_iso)
+    with metrics.phase("cache_plan"):
+        plan = cache.plan(symbols, timeframe, start)
+    full_syms = [s for s, since in plan.items() if since == start]
+    tail_syms = [s for s, since in plan.items() if since is not None and since != start]
+    if full_syms:
+        frames = _download_bars(full_syms, timeframe, start_iso, end_iso, key, sec)
+        with metrics.phase("cache_store"):
+            cache.store(full_syms, timeframe, frames, full=True, start_utc=start)
+            cache.prune(timeframe, start)
+    if tail_syms:
+        since = min(plan[s] for s in tail_syms)
+        frames = _download_bars(tail_syms, timeframe, since.isoformat(), end_iso, key, sec)
+        with metrics.phase("cache_store"):
+            cache.store(tail_syms, timeframe, frames)
+
+def _download_bars(symbols, timeframe, start_iso, end_iso, key, sec):
     url = f"{ALPACA_BASE}/v2/stocks/bars"
     headers = _alpaca_headers(key, sec)
     params = {"timeframe": timeframe, "symbols": ",".join(symbols), "start": start_iso, "end": end_iso, "limit": 10000, "adjustment": "all", "feed": "iex"}
     all_bars, next_token = {}, None
     while True:
         if next_token: params["page_token"] = next_token
-        resp = requests.get(url, headers=headers, params=params, timeout=30)
-        resp.raise_for_status(); data = resp.json(); bars = data.get("bars", {})
+        with metrics.phase(f"fetch_{timeframe}"):
+            resp = http_client.get(url, headers=headers, params=params, timeout=30)
+            resp.raise_for_status(); data = resp.json(); bars = data.get("bars", {})
         for sym, entries in bars.items(): all_bars.setdefault(sym, []).extend(entries)
         next_token = data.get("next_page_token")
         if not next_token: break
@@ -37,124 +73,362 @@ def fetch_bars_multi_symbols(symbols, timeframe, start_iso, end_iso, key, sec):
     return out
 
 def linreg_slope(y_vals):
-    y = np.array(y_vals, dtype=float); x = np.arange(len(y), dtype=float)
+    y = np.array(y_vals, dtype=float)
     if len(y) < 2: return 0.0
-    return np.polyfit(x, y, 1)[0]
+    return float(rolling_slope(y, len(y))[-1])
 
 def compute_signals_for_symbols(symbols, bench_map, alpaca_key, alpaca_sec,
                                 timeframe="1Hour", base_len_days=12, donch_len_hours=288,
                                 rv_min=2.5, confirm_on_close=True, use_high_intrabar=False,
                                 use_1030_et=False, batch_size=80,
-                                show_pre_signal=False, pre_buffer_pct=0.3):
+                                show_pre_signal=False, pre_buffer_pct=0.3, bar_cache=None,
+                                fetch_concurrency=4, data_service=None, daily_screen=None, intrabar=None):
+
+    # pannelli pubblicati da data_service.py (se attivo e aggiornato), altrimenti download/cache locale
+    panels = None
+    if data_service is not None:
+        with metrics.phase("data_service"):
+            panels = data_service.read(_tf_norm(timeframe) or "1Hour")
+    if panels is None and daily_screen is not None:
+        return _staged_scan(symbols, bench_map, alpaca_key, alpaca_sec, daily_screen, timeframe, donch_len_hours,
+                            max(donch_len_hours, base_len_days*24), batch_size, bar_cache, fetch_concurrency,
+                            dict(rv_min=rv_min, confirm_on_close=confirm_on_close, use_high_intrabar=use_high_intrabar,
+                                 use_1030_et=use_1030_et, show_pre_signal=show_pre_signal, pre_buffer_pct=pre_buffer_pct),
+                            intrabar=intrabar)
+    if panels is not None:
+        hourly, daily = panels
+    else:
+        with metrics.phase("bars"):
+            hourly, daily = load_bars(symbols, bench_map, alpaca_key, alpaca_sec, timeframe=timeframe,
+                                      donch_len_hours=donch_len_hours, batch_size=batch_size,
+                                      bar_cache=bar_cache, fetch_concurrency=fetch_concurrency)
+    return evaluate_signals(symbols, bench_map, hourly, daily,
+                            lookback=max(donch_len_hours, base_len_days*24), rv_min=rv_min,
+                            confirm_on_close=confirm_on_close, use_high_intrabar=use_high_intrabar,
+                            use_1030_et=use_1030_et, show_pre_signal=show_pre_signal, pre_buffer_pct=pre_buffer_pct,
+                            intrabar=intrabar)
 
+def load_bars(symbols, bench_map, alpaca_key, alpaca_sec, timeframe="1Hour", donch_len_hours=288,
+              batch_size=80, bar_cache=None, fetch_concurrency=4, end_utc=None, sync=True, with_hourly=True, with_daily=True):
+    """
+    Barre orarie e giornaliere di simboli + benchmark fino a end_utc (default: adesso).
+    Con la cache ritorna due BarPanel (sync=False legge solo la cache, senza rete), altrimenti due dict di DataFrame;
+    None al posto delle barre escluse con with_hourly / with_daily.
+    """
     timeframe = _tf_norm(timeframe) or "1Hour"
-    now_utc = datetime.now(timezone.utc)
+    now_utc = datetime.now(timezone.utc) if end_utc is None else pd.Timestamp(end_utc).to_pydatetime()
     end_utc = now_utc - timedelta(minutes=1)
     hours_back = max(donch_len_hours + 60, 400)
     start_h = now_utc - timedelta(hours=hours_back)
     start_d = now_utc - timedelta(days=400)
     benches = sorted(set([b for b in bench_map.values() if b and b != "-"]))
     unique_symbols = list(dict.fromkeys(symbols + benches))
+    # chunk orari e giornalieri in parallelo (la paginazione di ogni chunk resta sequenziale)
     hourly, daily = {}, {}
-    for i in range(0, len(unique_symbols), batch_size):
-        chunk = unique_symbols[i:i+batch_size]
-        out = fetch_bars_multi_symbols(chunk, timeframe, start_h.isoformat(), end_utc.isoformat(), alpaca_key, alpaca_sec)
-        hourly.update(out)
-    for i in range(0, len(unique_symbols), batch_size):
-        chunk = unique_symbols[i:i+batch_size]
-        out = fetch_bars_multi_symbols(chunk, "1Day", start_d.isoformat(), end_utc.isoformat(), alpaca_key, alpaca_sec)
-        daily.update(out)
+    jobs = [(dest, tf, start, unique_symbols[i:i+batch_size])
+            for dest, tf, start, on in ((hourly, timeframe, start_h, with_hourly), (daily, "1Day", start_d, with_daily)) if on
+            for i in range(0, len(unique_symbols), batch_size)]
+    if bar_cache is not None and not sync:
+        jobs = []
+    def _fetch(job):
+        dest, tf, start, chunk = job
+        if bar_cache is not None:
+            sync_bar_cache(chunk, tf, start.isoformat(), end_utc.isoformat(), alpaca_key, alpaca_sec, bar_cache)
+            return dest, {}
+        return dest, fetch_bars_multi_symbols(chunk, tf, start.isoformat(), end_utc.isoformat(), alpaca_key, alpaca_sec)
+    with ThreadPoolExecutor(max_workers=max(1, int(fetch_concurrency))) as pool:
+        for dest, out in pool.map(_fetch, jobs):
+            dest.update(out)
+    if bar_cache is not None:
+        # dalla cache si leggono direttamente le matrici (tempo × simbolo), senza un DataFrame per simbolo
+        with metrics.phase("cache_load"):
+            hourly = bar_cache.load_panel(unique_symbols, timeframe, start_h, end_utc) if with_hourly else None
+            daily = bar_cache.load_panel(unique_symbols, "1Day", start_d, end_utc) if with_daily else None
+        return hourly, daily
+    return (hourly if with_hourly else None), (daily if with_daily else None)
+
+def _join_bench(daily, symbols, bench_map):
+    """Chiusure simbolo/benchmark sulle date comuni (inner join), impacchettate a destra."""
+    bmks = [bench_map.get(s, "SPY") for s in symbols]
+    P = daily.select(list(dict.fromkeys(symbols + bmks)))
+    si = np.array([P.pos[s] for s in symbols], dtype=int); bi = np.array([P.pos[b] for b in bmks], dtype=int)
+    C = P.close[:, si].copy(); B = P.close[:, bi].copy()
+    n = np.minimum(P.n[si], P.n[bi])
+    same = (P.n[si] == P.n[bi]) & (P.t[:, si] == P.t[:, bi]).all(axis=0)
+    for j in np.flatnonzero(~same):
+        _, i1, i2 = np.intersect1d(P.series(symbols[j], "t"), P.series(bmks[j], "t"), assume_unique=True, return_indices=True)
+        m = len(i1); n[j] = m
+        C[:, j] = np.nan; B[:, j] = np.nan
+        if m:
+            C[-m:, j] = P.series(symbols[j], "close")[i1]; B[-m:, j] = P.series(bmks[j], "close")[i2]
+    has_data = (P.n[si] > 0) & (P.n[bi] > 0)
+    return C, B, n, has_data
+
+def daily_context(symbols, bench_map, daily):
+    """daily: BarPanel. Filtri giornalieri di tutto l'universo in un passaggio: bias EMA20 (3 barre), trend SMA200, RS vs benchmark."""
+    C, B, n, has_data = _join_bench(daily, symbols, bench_map)
+    return _daily_gates(C, B, ema(C, 20), n, has_data)
+
+def _daily_gates(C, B, E, n, has_data):
+    """Filtri sulle ultime righe di chiusure C, benchmark B ed EMA20 E (allineate a destra; bastano 200 righe, di E le ultime 3)."""
+    S = C.shape[1]
+    if C.shape[0] == 0:
+        f = np.zeros(S, dtype=bool)
+        return {"has_data": has_data, "ema_bias_long": f, "ema_bias_short": f, "trend_ok_long": f,
+                "trend_ok_short": f, "rs_up": f, "rs_down": f}
+    valid3 = (np.arange(C.shape[0])[:, None] >= (C.shape[0] - n)[None, :])[-3:]
+    c3, e3 = C[-3:], E[-3:]
+    sma200 = last_mean(C, 200)
+    RS = C / B
+    rs_ma50 = last_mean(RS, 50)
+    rs_slope = last_slope(RS, 10)       # come la baseline: anche con meno di 10 valori (almeno 2)
+    with np.errstate(invalid="ignore"):
+        return {
+            "has_data": has_data,
+            "ema_bias_long":  (n > 0) & ((c3 > e3) | ~valid3).all(axis=0),
+            "ema_bias_short": (n > 0) & ((c3 < e3) | ~valid3).all(axis=0),
+            "trend_ok_long":  C[-1] > sma200,
+            "trend_ok_short": C[-1] < sma200,
+            "rs_up":   (RS[-1] > rs_ma50) & (rs_slope > 0),
+            "rs_down": (RS[-1] < rs_ma50) & (rs_slope < 0),
+        }
+
+def intraday_levels(symbols, hourly, lookback):
+    """hourly: BarPanel. Donchian HH/LL e media volumi a 50 barre sulle barre precedenti l'ultima, più l'ultima barra."""
+    P = hourly.select(symbols, depth=max(lookback, 50) + 1)
+    S = len(symbols); nan = np.full(S, np.nan)
+    out = {"has_data": P.n > 0, "hh": nan, "ll": nan, "vol_ma50": nan, "time": np.zeros(S, dtype=np.int64),
+           "close": nan, "high": nan, "low": nan, "volume": nan}
+    if P.depth == 0: return out
+    out.update(time=P.t[-1], close=P.close[-1], high=P.high[-1], low=P.low[-1], volume=P.volume[-1])
+    if P.depth > 1:
+        out["hh"] = np.fmax.reduce(P.high[-1-lookback:-1], axis=0)
+        out["ll"] = np.fmin.reduce(P.low[-1-lookback:-1], axis=0)
+        v = P.volume[-51:-1]; cnt = (~np.isnan(v)).sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out["vol_ma50"] = np.where(cnt > 0, np.nansum(v, axis=0) / cnt, np.nan)
+    return out
+
+def _signal_result(res, g, bar, rv_min, confirm_on_close, use_high_intrabar, use_1030_et, show_pre_signal, pre_buffer_pct):
+    """Regole di ingresso per un simbolo: g = filtri giornalieri, bar = livelli Donchian + ultima barra."""
+    ema_bias_long, ema_bias_short = bool(g["ema_bias_long"]), bool(g["ema_bias_short"])
+    trend_ok_long, trend_ok_short = bool(g["trend_ok_long"]), bool(g["trend_ok_short"])
+    rs_up, rs_down = bool(g["rs_up"]), bool(g["rs_down"])
+    hh, ll, vol_ma50 = float(bar["hh"]), float(bar["ll"]), float(bar["vol_ma50"])
+    last_time = pd.Timestamp(int(bar["time"]), unit="s", tz="UTC")
+    last_close = float(bar["close"]); last_high = float(bar["high"]); last_low = float(bar["low"]); last_vol = float(bar["volume"])
+    rv_val = float(last_vol / vol_ma50) if (vol_ma50 and vol_ma50 > 0) else np.nan
+    rv_ok  = bool(rv_val >= float(rv_min)) if not math.isnan(rv_val) else False
+    if confirm_on_close:
+        break_up   = (not math.isnan(hh)) and (last_close > hh)
+        break_down = (not math.isnan(ll)) and (last_close < ll)
+        trig_info = "close vs Donchian (confirmed)"
+    else:
+        if use_high_intrabar:
+            break_up   = (not math.isnan(hh)) and (last_high > hh)
+            break_down = (not math.isnan(ll)) and (last_low  < ll)
+            trig_info = "intrabar HIGH/LOW vs Donchian"
+        else:
+            break_up   = (not math.isnan(hh)) and (last_close > hh)
+            break_down = (not math.isnan(ll)) and (last_close < ll)
+            trig_info = "close intrabar vs Donchian"
+    allow_bar = True
+    if use_1030_et:
+        ny = last_time.tz_convert("America/New_York"); allow_bar = (ny.hour==10 and ny.minute==30)
+    long_core  = (ema_bias_long and rs_up   and trend_ok_long  and break_up   and rv_ok and allow_bar)
+    short_core = (ema_bias_short and rs_down and trend_ok_short and break_down and rv_ok and allow_bar)
+    pre_long = pre_short = False
+    dist_up_pct = dist_down_pct = None
+    if show_pre_signal and not long_core and not short_core:
+        if not math.isnan(hh) and hh > 0:
+            dist_up_pct = abs((last_high if use_high_intrabar else last_close) / hh - 1.0) * 100.0
+            pre_long = (ema_bias_long and rs_up and trend_ok_long and dist_up_pct is not None and dist_up_pct <= pre_buffer_pct)
+        if not math.isnan(ll) and ll > 0:
+            dist_down_pct = abs((last_low if use_high_intrabar else last_close) / ll - 1.0) * 100.0
+            pre_short = (ema_bias_short and rs_down and trend_ok_short and dist_down_pct is not None and dist_down_pct <= pre_buffer_pct)
+    res["debug"] = {
+        "ema_bias_long": ema_bias_long,
+        "ema_bias_short": ema_bias_short,
+        "rs_up": rs_up,
+        "rs_down": rs_down,
+        "trend_ok_long": trend_ok_long,
+        "trend_ok_short": trend_ok_short,
+        "break_up": bool(break_up),
+        "break_down": bool(break_down),
+        "rv_ok": rv_ok,
+        "rv_val": None if math.isnan(rv_val) else round(rv_val, 2),
+        "hh": None if math.isnan(hh) else round(hh, 4),
+        "ll": None if math.isnan(ll) else round(ll, 4),
+        "last_close": round(last_close, 4),
+        "last_high": round(last_high, 4),
+        "last_low": round(last_low, 4),
+        "dist_up_pct": None if dist_up_pct is None else round(dist_up_pct, 3),
+        "dist_down_pct": None if dist_down_pct is None else round(dist_down_pct, 3),
+    }
+    res.update({
+        "LONG": bool(long_core), "SHORT": bool(short_core),
+        "pre_long": bool(pre_long), "pre_short": bool(pre_short),
+        "rv_val": None if math.isnan(rv_val) else round(rv_val, 2),
+        "ema_bias": f"L:{ema_bias_long} / S:{ema_bias_short}",
+        "rs_dir": f"UP:{rs_up} / DOWN:{rs_down}",
+        "trend_ok": f"L:{trend_ok_long} / S:{trend_ok_short}",
+        "trigger_info": trig_info,
+        "bar_time": last_time.isoformat(),
+    })
+    return res
+
+GATE_KEYS = ("ema_bias_long", "ema_bias_short", "trend_ok_long", "trend_ok_short", "rs_up", "rs_down")
+BAR_KEYS = ("hh", "ll", "vol_ma50", "time", "close", "high", "low", "volume")
+
+def evaluate_signals(symbols, bench_map, hourly, daily, lookback, rv_min=2.5, confirm_on_close=True,
+                     use_high_intrabar=False, use_1030_et=False, show_pre_signal=False, pre_buffer_pct=0.3, intrabar=None):
+    """
+    Valuta le regole su barre già scaricate (dict {simbolo: DataFrame} o BarPanel):
+    gli indicatori sono calcolati per tutto l'universo in matrici (tempo × simbolo).
+    Con intrabar (intrabar.IntrabarCache) salva anche i livelli della barra in corso per i ricontrolli da snapshot.
+    """
+    symbols = list(symbols)
+    names = list(dict.fromkeys(symbols + [bench_map.get(s, "SPY") for s in symbols]))
+    with metrics.phase("panels"):
+        if not isinstance(hourly, BarPanel): hourly = BarPanel.from_frames(hourly, symbols, depth=max(lookback, 50) + 1)
+        if not isinstance(daily, BarPanel): daily = BarPanel.from_frames(daily, names)
+    with metrics.phase("daily_context", len(symbols)):
+        ctx = daily_context(symbols, bench_map, daily)
+    with metrics.phase("intraday_levels", len(symbols)):
+        lv = intraday_levels(symbols, hourly, lookback)
+    rule_kw = dict(rv_min=rv_min, confirm_on_close=confirm_on_close, use_high_intrabar=use_high_intrabar,
+                   use_1030_et=use_1030_et, show_pre_signal=show_pre_signal, pre_buffer_pct=pre_buffer_pct)
+    if intrabar is not None:
+        intrabar.capture(symbols, bench_map, hourly, ctx, lookback, rule_kw)
+    with metrics.phase("rules", len(symbols)):
+        return _apply_rules(symbols, bench_map, ctx, lv, **rule_kw)
+
+def _apply_rules(symbols, bench_map, ctx, lv, rv_min, confirm_on_close, use_high_intrabar, use_1030_et,
+                 show_pre_signal, pre_buffer_pct):
     results = {}
-    for sym in symbols:
+    for j, sym in enumerate(symbols):
         res = {"benchmark": bench_map.get(sym, "SPY"), "rv_min": rv_min, "debug": {}}
+        if not (lv["has_data"][j] and ctx["has_data"][j]):
+            res["debug"]["reason"] = "missing_data"; results[sym] = res; continue
         try:
-            hdf = hourly.get(sym, pd.DataFrame()); ddf = daily.get(sym, pd.DataFrame())
-            bmk = bench_map.get(sym, "SPY"); bdf = daily.get(bmk, pd.DataFrame())
-            if hdf is None or ddf is None or hdf.empty or ddf.empty or bdf is None or bdf.empty:
-                res["debug"]["reason"] = "missing_data"; results[sym] = res; continue
-            ddf = ddf.set_index("time"); bdf = bdf.set_index("time")
-            join = ddf[["close"]].join(bdf[["close"]].rename(columns={"close":"bench"}), how="inner")
-            join["ema20"] = join["close"].ewm(span=20, adjust=False).mean()
-            join["sma200"] = join["close"].rolling(200).mean()
-            join["rs"] = join["close"] / join["bench"]
-            join["rs_ma50"] = join["rs"].rolling(50).mean()
-            lr_window = join["rs"].tail(10).dropna().values
-            rs_slope = linreg_slope(lr_window) if len(lr_window) >= 2 else 0.0
-            last3 = join.tail(3)
-            ema_bias_long  = bool((last3["close"] > last3["ema20"]).all())
-            ema_bias_short = bool((last3["close"] < last3["ema20"]).all())
-            trend_ok_long  = bool(join["close"].iloc[-1] > join["sma200"].iloc[-1])
-            trend_ok_short = bool(join["close"].iloc[-1] < join["sma200"].iloc[-1])
-            rs_up   = bool((join["rs"].iloc[-1] > join["rs_ma50"].iloc[-1]) and (rs_slope > 0))
-            rs_down = bool((join["rs"].iloc[-1] < join["rs_ma50"].iloc[-1]) and (rs_slope < 0))
-            hdf = hdf.set_index("time")
-            lookback = max(donch_len_hours, base_len_days*24)
-            prev = hdf.iloc[:-1] if len(hdf) > 1 else hdf.iloc[:0]
-            hh = prev["high"].tail(lookback).max() if not prev.empty else np.nan
-            ll = prev["low"].tail(lookback).min() if not prev.empty else np.nan
-            last_bar = hdf.iloc[-1]
-            last_time = last_bar.name
-            last_close = float(last_bar["close"]); last_high = float(last_bar["high"]); last_low = float(last_bar["low"]); last_vol = float(last_bar["volume"])
-            vol_ma50 = prev["volume"].tail(50).mean() if not prev.empty else np.nan
-            rv_val = float(last_vol / vol_ma50) if (vol_ma50 and vol_ma50 > 0) else np.nan
-            rv_ok  = bool(rv_val >= float(rv_min)) if not math.isnan(rv_val) else False
-            if confirm_on_close:
-                break_up   = (not math.isnan(hh)) and (last_close > hh)
-                break_down = (not math.isnan(ll)) and (last_close < ll)
-                trig_info = "close vs Donchian (confirmed)"
-            else:
-                if use_high_intrabar:
-                    break_up   = (not math.isnan(hh)) and (last_high > hh)
-                    break_down = (not math.isnan(ll)) and (last_low  < ll)
-                    trig_info = "intrabar HIGH/LOW vs Donchian"
-                else:
-                    break_up   = (not math.isnan(hh)) and (last_close > hh)
-                    break_down = (not math.isnan(ll)) and (last_close < ll)
-                    trig_info = "close intrabar vs Donchian"
-            allow_bar = True
-            if use_1030_et:
-                ny = last_time.tz_convert("America/New_York"); allow_bar = (ny.hour==10 and ny.minute==30)
-            long_core  = (ema_bias_long and rs_up   and trend_ok_long  and break_up   and rv_ok and allow_bar)
-            short_core = (ema_bias_short and rs_down and trend_ok_short and break_down and rv_ok and allow_bar)
-            pre_long = pre_short = False
-            dist_up_pct = dist_down_pct = None
-            if show_pre_signal and not long_core and not short_core:
-                if not math.isnan(hh) and hh > 0:
-                    dist_up_pct = abs((last_high if use_high_intrabar else last_close) / hh - 1.0) * 100.0
-                    pre_long = (ema_bias_long and rs_up and trend_ok_long and dist_up_pct is not None and dist_up_pct <= pre_buffer_pct)
-                if not math.isnan(ll) and ll > 0:
-                    dist_down_pct = abs((last_low if use_high_intrabar else last_close) / ll - 1.0) * 100.0
-                    pre_short = (ema_bias_short and rs_down and trend_ok_short and dist_down_pct is not None and dist_down_pct <= pre_buffer_pct)
-            res["debug"] = {
-                "ema_bias_long": ema_bias_long,
-                "ema_bias_short": ema_bias_short,
-                "rs_up": rs_up,
-                "rs_down": rs_down,
-                "trend_ok_long": trend_ok_long,
-                "trend_ok_short": trend_ok_short,
-                "break_up": bool(break_up),
-                "break_down": bool(break_down),
-                "rv_ok": rv_ok,
-                "rv_val": None if math.isnan(rv_val) else round(rv_val, 2),
-                "hh": None if math.isnan(hh) else round(hh, 4),
-                "ll": None if math.isnan(ll) else round(ll, 4),
-                "last_close": round(last_close, 4),
-                "last_high": round(last_high, 4),
-                "last_low": round(last_low, 4),
-                "dist_up_pct": None if dist_up_pct is None else round(dist_up_pct, 3),
-                "dist_down_pct": None if dist_down_pct is None else round(dist_down_pct, 3),
-            }
-            res.update({
-                "LONG": bool(long_core), "SHORT": bool(short_core),
-                "pre_long": bool(pre_long), "pre_short": bool(pre_short),
-                "rv_val": None if math.isnan(rv_val) else round(rv_val, 2),
-                "ema_bias": f"L:{ema_bias_long} / S:{ema_bias_short}",
-                "rs_dir": f"UP:{rs_up} / DOWN:{rs_down}",
-                "trend_ok": f"L:{trend_ok_long} / S:{trend_ok_short}",
-                "trigger_info": trig_info,
-                "bar_time": last_bar.name.tz_convert("UTC").isoformat(),
-            })
+            _signal_result(res, {k: ctx[k][j] for k in GATE_KEYS}, {k: lv[k][j] for k in BAR_KEYS},
+                           rv_min, confirm_on_close, use_high_intrabar, use_1030_et, show_pre_signal, pre_buffer_pct)
         except Exception as e:
             res["error"] = str(e)
         results[sym] = res
     return results
+
+# --- scan a due stadi: filtri giornalieri una volta per seduta, barre orarie solo per i simboli che possono scattare ---
+def build_daily_screen(symbols, bench_map, daily):
+    """
+    daily: barre giornaliere delle sole sedute complete. Conserva le ultime 200 chiusure simbolo/benchmark e le ultime
+    2 EMA20 (quanto serve a _daily_gates con la giornata in corso in coda) e i filtri senza la giornata in corso.
+    `alive`: il simbolo può ancora dare LONG (ultime 2 chiusure sopra l'EMA20) o SHORT (sotto); trend e RS dipendono
+    dalla chiusura di oggi e restano al secondo stadio, quindi lo screening non scarta mai un segnale possibile.
+    """
+    C, B, n, has_data = _join_bench(daily, symbols, bench_map)
+    E = ema(C, 20)
+    gates = _daily_gates(C, B, E, n, has_data)
+    valid2 = (np.arange(C.shape[0])[:, None] >= (C.shape[0] - n)[None, :])[-2:]
+    with np.errstate(invalid="ignore"):
+        long2 = ((C[-2:] > E[-2:]) | ~valid2).all(axis=0)
+        short2 = ((C[-2:] < E[-2:]) | ~valid2).all(axis=0)
+    return {**gates, "C": C[-200:], "B": B[-200:], "E": E[-2:], "n": n, "alive": has_data & (n > 0) & (long2 | short2)}
+
+def screen_context(screen, idx, symbols, bench_map, hourly, day_start):
+    """
+    Filtri giornalieri dei simboli (posizioni idx nello screening) come daily_context: se simbolo e benchmark hanno
+    barre orarie di oggi, la giornata in corso entra come ultima seduta con chiusura = ultima chiusura oraria
+    (come backtest.symbol_rules); altrimenti valgono i filtri delle sole sedute complete.
+    """
+    H = hourly.select(symbols, depth=1); HB = hourly.select([bench_map.get(s, "SPY") for s in symbols], depth=1)
+    base = {k: screen[k][idx] for k in ("has_data",) + GATE_KEYS}
+    if H.depth == 0 or HB.depth == 0:
+        return base
+    ts0 = int(day_start.timestamp())
+    x, y = H.close[-1], HB.close[-1]
+    today = (H.n > 0) & (HB.n > 0) & (H.t[-1] >= ts0) & (HB.t[-1] >= ts0)
+    E, n = screen["E"][:, idx], screen["n"][idx]
+    a = 2.0 / 21.0
+    e_prev = E[-1] if len(E) else np.full(len(idx), np.nan)
+    e_today = np.where(np.isnan(e_prev), x, a * x + (1.0 - a) * e_prev)
+    live = _daily_gates(np.vstack([screen["C"][:, idx], x]), np.vstack([screen["B"][:, idx], y]),
+                        np.vstack([E, e_today]), n + 1, base["has_data"])
+    return {k: np.where(today, live[k], base[k]) for k in base}
+
+class DailyScreen:
+    """
+    Cache dello stadio giornaliero: si ricalcola al primo scan di ogni giorno (New York) o se cambia l'universo,
+    e si salva in DAILY_SCREEN_PATH (state/daily_screen.npz) per gli scan lanciati come processi separati.
+    """
+    ARRAYS = ("has_data",) + GATE_KEYS + ("C", "B", "E", "n", "alive")
+
+    def __init__(self, path=DAILY_SCREEN_PATH):
+        self.path = path
+        self._key, self._screen = None, None
+
+    def get(self, symbols, bench_map, day_start, load_daily):
+        """Screening del giorno; load_daily() -> barre giornaliere delle sedute complete, chiamato solo se serve ricalcolare."""
+        key = hashlib.sha1(json.dumps([day_start.isoformat(), list(symbols),
+                                       [bench_map.get(s, "SPY") for s in symbols]]).encode()).hexdigest()
+        if self._key != key:
+            self._screen, self._key = self._load(key), key
+        if self._screen is None:
+            daily = load_daily()
+            if not isinstance(daily, BarPanel):
+                daily = BarPanel.from_frames(daily, list(dict.fromkeys(list(symbols) + [bench_map.get(s, "SPY") for s in symbols])))
+            self._screen = build_daily_screen(list(symbols), bench_map, daily)
+            self._save(key)
+            print(f"Daily screen {day_start.date()}: {int(self._screen['alive'].sum())}/{len(symbols)} symbols can fire today")
+        return self._screen
+
+    def _load(self, key):
+        try:
+            with np.load(self.path) as f:
+                if str(f["key"]) != key: return None
+                return {k: f[k] for k in self.ARRAYS}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _save(self, key):
+        d = os.path.dirname(self.path)
+        if d: os.makedirs(d, exist_ok=True)
+        tmp = f"{self.path}.tmp.npz"
+        np.savez(tmp, key=np.array(key), **{k: self._screen[k] for k in self.ARRAYS})
+        os.replace(tmp, self.path)
+
+def _staged_scan(symbols, bench_map, alpaca_key, alpaca_sec, daily_screen, timeframe, donch_len_hours, lookback,
+                 batch_size, bar_cache, fetch_concurrency, rule_kw, intrabar=None):
+    symbols = list(symbols)
+    day_start = _ny_day_start(datetime.now(timezone.utc))
+    with metrics.phase("daily_screen"):
+        screen = daily_screen.get(symbols, bench_map, day_start, lambda: load_bars(
+            symbols, bench_map, alpaca_key, alpaca_sec, timeframe=timeframe, batch_size=batch_size, bar_cache=bar_cache,
+            fetch_concurrency=fetch_concurrency, end_utc=day_start, with_hourly=False)[1])
+    idx = np.flatnonzero(screen["alive"])
+    alive = [symbols[j] for j in idx]
+    results = {}
+    if alive:
+        alive_bench = {s: bench_map.get(s, "SPY") for s in alive}
+        with metrics.phase("bars"):
+            hourly, _ = load_bars(alive, alive_bench, alpaca_key, alpaca_sec, timeframe=timeframe,
+                                  donch_len_hours=donch_len_hours, batch_size=batch_size, bar_cache=bar_cache,
+                                  fetch_concurrency=fetch_concurrency, with_daily=False)
+        with metrics.phase("panels"):
+            if not isinstance(hourly, BarPanel):
+                hourly = BarPanel.from_frames(hourly, list(dict.fromkeys(alive + list(alive_bench.values()))),
+                                              depth=max(lookback, 50) + 1)
+        with metrics.phase("daily_context", len(alive)):
+            ctx = screen_context(screen, idx, alive, bench_map, hourly, day_start)
+        with metrics.phase("intraday_levels", len(alive)):
+            lv = intraday_levels(alive, hourly, lookback)
+        if intrabar is not None:
+            intrabar.capture(alive, bench_map, hourly, ctx, lookback, rule_kw, screen=screen, idx=idx)
+        with metrics.phase("rules", len(alive)):
+            results = _apply_rules(alive, bench_map, ctx, lv, **rule_kw)
+    elif intrabar is not None:
+        intrabar.capture([], bench_map, BarPanel.empty([]), None, lookback, rule_kw)
+    for sym in symbols:
+        if sym not in results:
+            results[sym] = {"benchmark": bench_map.get(sym, "SPY"), "rv_min": rule_kw["rv_min"], "debug": {"reason": "daily_screen"}}
+    return {sym: results[sym] for sym in symbols}
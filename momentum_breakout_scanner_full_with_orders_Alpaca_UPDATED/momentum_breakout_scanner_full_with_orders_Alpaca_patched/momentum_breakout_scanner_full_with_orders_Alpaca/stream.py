@@ -0,0 +1,270 @@
+import asyncio, json, os, sys, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import websockets
+from panel import BarPanel
+from signals import load_bars, _signal_result
+from indicator_state import EMA, SMA, RollingMax, RollingMin, RollingSlope
+
+ALPACA_STREAM_URL = os.environ.get("ALPACA_STREAM_URL", "wss://stream.data.alpaca.markets/v2/iex")
+INDICATOR_STATE_PATH = os.environ.get("INDICATOR_STATE_PATH", "state/indicators.json")
+RULE_KEYS = ("rv_min", "confirm_on_close", "use_high_intrabar", "use_1030_et", "show_pre_signal", "pre_buffer_pct")
+
+def _tf_minutes(tf: str) -> int:
+    tf = (tf or "1Hour").strip()
+    for unit, mult in (("Hour", 60), ("Min", 1), ("H", 60), ("h", 60), ("T", 1), ("m", 1)):
+        if tf.endswith(unit):
+            return int(tf[:-len(unit)] or 1) * mult
+    return 60
+
+def _epoch(ts) -> int:
+    return int(pd.Timestamp(ts).timestamp())
+
+def _ny_midnight(epoch_s: int) -> pd.Timestamp:
+    return pd.Timestamp(epoch_s, unit="s", tz="UTC").tz_convert("America/New_York").normalize()
+
+class SymbolState:
+    """Stato incrementale di un simbolo: barra in formazione, livelli Donchian/volumi sulle barre chiuse, filtri giornalieri."""
+    __slots__ = ("bar", "hh", "ll", "vol", "ema20", "sma200", "rs_ma50", "rs_slope", "bias", "close", "rs", "daily_t")
+
+    def __init__(self, lookback):
+        self.bar = None  # [t, open, high, low, close, volume] del periodo corrente
+        self.hh, self.ll, self.vol = RollingMax(lookback), RollingMin(lookback), SMA(50, min_periods=1)
+        self.ema20, self.sma200 = EMA(20), SMA(200)
+        self.rs_ma50, self.rs_slope = SMA(50), RollingSlope(10)
+        self.bias = deque(maxlen=3)  # [close > ema20, close < ema20] delle ultime 3 sessioni
+        self.close = self.rs = np.nan; self.daily_t = 0
+
+    def push_bar(self, bar):
+        """Chiude la barra corrente (entra nei livelli) e apre `bar`."""
+        if self.bar is not None:
+            self.hh.update(self.bar[2]); self.ll.update(self.bar[3]); self.vol.update(self.bar[5])
+        self.bar = bar
+
+    def push_daily(self, t, close, bench_close):
+        e = self.ema20.update(close); self.sma200.update(close)
+        self.bias.append([close > e, close < e])
+        self.rs = close / bench_close; self.rs_ma50.update(self.rs); self.rs_slope.update(self.rs)
+        self.close = close; self.daily_t = t
+
+    def gates(self):
+        ma, slope = self.rs_ma50.value, self.rs_slope.value
+        return {
+            "ema_bias_long": all(b[0] for b in self.bias), "ema_bias_short": all(b[1] for b in self.bias),
+            "trend_ok_long": self.close > self.sma200.value, "trend_ok_short": self.close < self.sma200.value,
+            "rs_up": self.rs > ma and slope > 0, "rs_down": self.rs < ma and slope < 0,
+        }
+
+    def to_dict(self):
+        d = {k: getattr(self, k) for k in ("bar", "close", "rs", "daily_t")}
+        d.update({k: getattr(self, k).to_dict() for k in ("hh", "ll", "vol", "ema20", "sma200", "rs_ma50", "rs_slope")})
+        d["bias"] = list(self.bias)
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        st = cls.__new__(cls)
+        st.bar, st.close, st.rs, st.daily_t = d["bar"], d["close"], d["rs"], d["daily_t"]
+        st.hh, st.ll, st.vol = RollingMax.from_dict(d["hh"]), RollingMin.from_dict(d["ll"]), SMA.from_dict(d["vol"])
+        st.ema20, st.sma200 = EMA.from_dict(d["ema20"]), SMA.from_dict(d["sma200"])
+        st.rs_ma50, st.rs_slope = SMA.from_dict(d["rs_ma50"]), RollingSlope.from_dict(d["rs_slope"])
+        st.bias = deque(d["bias"], maxlen=3)
+        return st
+
+class StreamingScanner:
+    """
+    Modalità a eventi: le barre a 1 minuto del websocket vengono aggregate nelle barre del timeframe
+    di scansione (1Hour di default). Per ogni simbolo c'è uno SymbolState con indicatori incrementali
+    (indicator_state.py): ad ogni barra ricevuta le regole di compute_signals_for_symbols si rivalutano
+    in O(1) solo per quel simbolo.
+    I filtri giornalieri usano le sessioni chiuse e avanzano al cambio di giorno (NY) con le sole sessioni nuove.
+    Lo stato si salva in JSON (save/restore): al riavvio si recuperano solo le barre mancanti.
+    """
+    def __init__(self, symbols, bench_map, params, daily_loader=None):
+        self.symbols = list(symbols); self.bench_map = bench_map
+        self.lookback = max(int(params["donch_len_hours"]), int(params["base_len_days"]) * 24)
+        self.depth = max(self.lookback, 50) + 1
+        self.rules = {k: params[k] for k in RULE_KEYS}
+        self.bar_seconds = _tf_minutes(params.get("timeframe", "1Hour")) * 60
+        self.daily_loader = daily_loader
+        self.state = {}   # simbolo -> SymbolState
+        self.gates = {}   # simbolo -> filtri giornalieri (dalle sessioni chiuse)
+        self._set_day(None)
+
+    def warm_up(self, hourly, daily, day=None):
+        """Porta lo stato al passo con lo storico: simboli nuovi da zero, quelli ripristinati solo con le barre successive."""
+        if not isinstance(hourly, BarPanel): hourly = BarPanel.from_frames(hourly, self.symbols, depth=self.depth)
+        P = hourly.select(self.symbols, depth=self.depth)
+        for j, sym in enumerate(self.symbols):
+            st = self.state.get(sym)
+            if st is None: st = self.state[sym] = SymbolState(self.lookback)
+            k = P.depth - P.n[j]
+            rows = np.column_stack([P.t[k:, j], P.open[k:, j], P.high[k:, j], P.low[k:, j], P.close[k:, j], P.volume[k:, j]])
+            if st.bar is not None:
+                rows = rows[rows[:, 0] >= st.bar[0]]
+            for r in rows.tolist():
+                r[0] = int(r[0])
+                if st.bar is not None and r[0] == st.bar[0]: st.bar = r  # periodo salvato a metà: vale lo storico
+                else: st.push_bar(r)
+        self.set_daily(daily, day)
+
+    def set_daily(self, daily, day=None):
+        """Aggiunge agli stati le sessioni giornaliere chiuse successive all'ultima già vista (inner join col benchmark)."""
+        names = list(dict.fromkeys(self.symbols + [self.bench_map.get(s, "SPY") for s in self.symbols]))
+        if not isinstance(daily, BarPanel): daily = BarPanel.from_frames(daily, names)
+        for sym in self.symbols:
+            bmk = self.bench_map.get(sym, "SPY")
+            st = self.state.get(sym)
+            if st is None: st = self.state[sym] = SymbolState(self.lookback)
+            if sym not in daily.pos or bmk not in daily.pos: continue
+            ts, tb = daily.series(sym, "t"), daily.series(bmk, "t")
+            _, i1, i2 = np.intersect1d(ts, tb, assume_unique=True, return_indices=True)
+            new = ts[i1] > st.daily_t
+            for t, c, b in zip(ts[i1][new].tolist(), daily.series(sym, "close")[i1][new].tolist(),
+                               daily.series(bmk, "close")[i2][new].tolist()):
+                st.push_daily(t, c, b)
+            if st.daily_t: self.gates[sym] = st.gates()
+        self._set_day(day)
+
+    def _set_day(self, day):
+        self.day = day
+        if day is None: self._day_start = self._day_end = 0
+        else: self._day_start, self._day_end = _epoch(day), _epoch(day + pd.DateOffset(days=1))
+
+    def pending_day(self, t):
+        """Giorno (mezzanotte New York) le cui barre giornaliere vanno caricate prima della barra t, altrimenti None."""
+        if self.daily_loader is None or self._day_start <= t < self._day_end: return None
+        day = _ny_midnight(t)
+        return day if day != self.day else None
+
+    def on_bar(self, sym, t, o, h, l, c, v):
+        """Barra in arrivo (t = epoch secondi dell'apertura). Ritorna il risultato per il simbolo o None."""
+        day = self.pending_day(t)
+        if day is not None: self.set_daily(self.daily_loader(day), day)
+        st = self.state.get(sym)
+        if st is None: return None
+        b = t - t % self.bar_seconds
+        cur = st.bar
+        if cur is not None and cur[0] == b:
+            cur[2] = max(cur[2], h); cur[3] = min(cur[3], l); cur[4] = c; cur[5] += v
+        elif cur is None or b > cur[0]:
+            st.push_bar([b, o, h, l, c, v])
+        else:
+            return None  # barra in ritardo su un periodo già chiuso
+        return self.evaluate(sym)
+
+    def evaluate(self, sym):
+        st = self.state.get(sym); g = self.gates.get(sym)
+        if st is None or st.bar is None or g is None: return None
+        t, o, h, l, c, v = st.bar
+        bar = {"hh": st.hh.value, "ll": st.ll.value, "vol_ma50": st.vol.value,
+               "time": t, "open": o, "high": h, "low": l, "close": c, "volume": v}
+        res = {"benchmark": self.bench_map.get(sym, "SPY"), "rv_min": self.rules["rv_min"], "debug": {}}
+        return _signal_result(res, g, bar, **self.rules)
+
+    def _signature(self):
+        return {"lookback": self.lookback, "bar_seconds": self.bar_seconds}
+
+    def save(self, path=INDICATOR_STATE_PATH):
+        """Scrive lo stato di tutti i simboli (file temporaneo + rename, mai un JSON a metà)."""
+        doc = {"signature": self._signature(), "day": self.day.isoformat() if self.day is not None else None,
+               "symbols": {s: st.to_dict() for s, st in self.state.items()}}
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f: json.dump(doc, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    def restore(self, path=INDICATOR_STATE_PATH) -> bool:
+        """Ricarica lo stato salvato se compatibile con i parametri correnti; i simboli non presenti partiranno da zero."""
+        try:
+            with open(path) as f: doc = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if doc.get("signature") != self._signature(): return False
+        wanted = set(self.symbols)
+        self.state = {s: SymbolState.from_dict(d) for s, d in doc["symbols"].items() if s in wanted}
+        self.gates = {s: st.gates() for s, st in self.state.items() if st.daily_t}
+        self._set_day(pd.Timestamp(doc["day"]).tz_convert("America/New_York") if doc.get("day") else None)
+        return True
+
+class StreamError(RuntimeError):
+    """Messaggio {"T":"error"} dal server: si chiude la connessione e ci si riconnette."""
+
+async def _handshake(ws, key, sec, symbols):
+    json.loads(await ws.recv())  # [{"T":"success","msg":"connected"}]
+    await ws.send(json.dumps({"action": "auth", "key": key, "secret": sec}))
+    msg = json.loads(await ws.recv())
+    if not any(m.get("msg") == "authenticated" for m in msg):
+        raise RuntimeError(f"stream auth failed: {msg}")
+    await ws.send(json.dumps({"action": "subscribe", "bars": list(symbols)}))
+
+async def consume(scanner, url, key, sec, on_results, reconnect=True, state_path=None, save_every=300):
+    """
+    Legge le barre dal websocket; i segnali vengono gestiti da un worker separato per non fermare la lettura.
+    Con state_path lo stato degli indicatori viene salvato ogni save_every secondi.
+    """
+    loop = asyncio.get_running_loop()
+    last_save = time.monotonic()
+    worker = ThreadPoolExecutor(max_workers=1)
+    def _done(fut):
+        if fut.exception(): print("Signal handling error:", fut.exception(), file=sys.stderr)
+    backoff = 1
+    try:
+        while True:
+            try:
+                async with websockets.connect(url, max_size=None, ping_interval=20) as ws:
+                    await _handshake(ws, key, sec, scanner.symbols)
+                    backoff = 1
+                    async for raw in ws:
+                        fired = {}
+                        for m in json.loads(raw):
+                            if m.get("T") == "error": raise StreamError(f"stream error: {m}")
+                            if m.get("T") != "b": continue
+                            t = _epoch(m["t"]); day = scanner.pending_day(t)
+                            if day is not None:
+                                # REST bloccante fuori dall'event loop: i ping del websocket continuano
+                                daily = await loop.run_in_executor(None, scanner.daily_loader, day)
+                                scanner.set_daily(daily, day)
+                            res = scanner.on_bar(m["S"], t, float(m["o"]), float(m["h"]),
+                                                 float(m["l"]), float(m["c"]), float(m["v"]))
+                            if res and (res.get("LONG") or res.get("SHORT")): fired[m["S"]] = res
+                        if fired:
+                            loop.run_in_executor(worker, on_results, fired).add_done_callback(_done)
+                        if state_path and time.monotonic() - last_save >= save_every:
+                            scanner.save(state_path); last_save = time.monotonic()
+                if not reconnect: return
+            except (websockets.ConnectionClosed, OSError, StreamError) as e:
+                if not reconnect: return
+                print("Stream disconnected:", e, file=sys.stderr)
+            await asyncio.sleep(backoff); backoff = min(backoff * 2, 60)
+    finally:
+        worker.shutdown(wait=True)
+
+def run_stream(symbols, bench_map, params, key, sec, on_results, bar_cache=None, url=ALPACA_STREAM_URL,
+               warmup_end=None, offline=False, reconnect=True, batch_size=80, fetch_concurrency=4,
+               state_path=INDICATOR_STATE_PATH, save_every=300):
+    """
+    Warm-up con le barre storiche (cache o REST) fino a warmup_end, poi segue il websocket.
+    Se state_path contiene uno stato compatibile si riparte da quello e si applicano solo le barre mancanti;
+    lo stato viene risalvato periodicamente e all'uscita. offline=True legge solo la cache locale
+    (per la replica con replay_server.py).
+    """
+    def _load(end):
+        return load_bars(symbols, bench_map, key, sec, timeframe=params.get("timeframe", "1Hour"),
+                         donch_len_hours=int(params["donch_len_hours"]), batch_size=batch_size,
+                         bar_cache=bar_cache, fetch_concurrency=fetch_concurrency, end_utc=end, sync=not offline)
+    end = pd.Timestamp(warmup_end) if warmup_end else pd.Timestamp.now(tz="UTC")
+    day = _ny_midnight(int(end.timestamp()))
+    hourly, _ = _load(end)
+    _, daily = _load(day)
+    scanner = StreamingScanner(symbols, bench_map, params, daily_loader=lambda d: _load(d)[1])
+    if state_path and scanner.restore(state_path):
+        print(f"Indicator state restored from {state_path} ({len(scanner.state)} symbols)")
+    scanner.warm_up(hourly, daily, day)
+    print(f"Streaming {len(symbols)} symbols from {url}")
+    try:
+        asyncio.run(consume(scanner, url, key, sec, on_results, reconnect=reconnect,
+                            state_path=state_path, save_every=save_every))
+    finally:
+        if state_path: scanner.save(state_path)
@@ -1,4 +1,6 @@
-import requests, os, math, time
+import requests, os, math, time, threading
+from concurrent.futures import ThreadPoolExecutor
+import http_client
 from db import insert_order, update_order_status  # lasciato per compat; non obbligatorio
 
 # ---- Alpaca endpoints ----
@@ -7,6 +9,29 @@ ALPACA_TRADING_BASE = "https://paper-api.alpaca.markets" if ALP_ENV == "paper" e
 
 SAFE_BP_BUFFER = float(os.environ.get("SAFE_BP_BUFFER", "0.95"))  # usa max 95% della buying power
 
+# ---- Cache a tempo per account/clock/posizioni ----
+# In un burst di ordini le stesse letture si ripetono per ogni segnale: si tengono per pochi secondi
+# e si invalidano (account/posizioni) ad ogni invio di ordine.
+CACHE_TTL = {
+    "account": float(os.environ.get("ALPACA_ACCOUNT_TTL", "5")),
+    "positions": float(os.environ.get("ALPACA_POSITIONS_TTL", "5")),
+    "clock": float(os.environ.get("ALPACA_CLOCK_TTL", "30")),
+}
+_cache, _cache_lock = {}, threading.Lock()
+
+def _cached(name, loader):
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(name)
+        if hit and now - hit[0] < CACHE_TTL[name]: return hit[1]
+    value = loader()
+    with _cache_lock: _cache[name] = (time.monotonic(), value)
+    return value
+
+def invalidate_cache(*names):
+    with _cache_lock:
+        for n in (names or list(_cache)): _cache.pop(n, None)
+
 def _headers():
     return {
         "APCA-API-KEY-ID": os.environ.get("ALPACA_API_KEY", ""),
@@ -21,11 +46,17 @@ def _client_id(symbol: str) -> str:
     base = f"{symbol}-{int(time.time())}"
     return base[:48]
 
-def _get_account():
-    r = requests.get(f"{ALPACA_TRADING_BASE}/v2/account", headers=_headers(), timeout=20)
+def _fetch(path, timeout=20):
+    r = http_client.get(f"{ALPACA_TRADING_BASE}{path}", headers=_headers(), timeout=timeout)
     r.raise_for_status()
     return r.json()
 
+def _get_account():
+    return _cached("account", lambda: _fetch("/v2/account"))
+
+def get_positions():
+    return _cached("positions", lambda: _fetch("/v2/positions"))
+
 def _cap_notional_to_bp(bp: float, requested_notional: float) -> float:
     """Cap del notional per restare entro BP * buffer."""
     return min(float(requested_notional), float(bp) * SAFE_BP_BUFFER)
@@ -36,6 +67,24 @@ def _qty_from_notional(notional: float, px: float) -> int:
         return 0
     return max(0, int(math.floor(float(notional) / float(px))))
 
+# ---------- LIVELLI E SIZE DEL BRACKET DA UN SEGNALE ----------
+def bracket_prices(debug: dict, side: str, partial_at_r: float = 2.0):
+    """
+    (entry, stop, take profit) per un segnale LONG/SHORT: entry limit sul livello Donchian rotto
+    (o sull'ultima chiusura), stop all'1%, take profit a 2·partialAtR %.
+    """
+    entry_px = debug.get("hh") if side == "LONG" else debug.get("ll")
+    if entry_px is None or entry_px == 0: entry_px = debug.get("last_close", 0.0)
+    sl_px = entry_px * (0.99 if side == "LONG" else 1.01)
+    tp_px = entry_px * (1 + 0.01*partial_at_r*2) if side == "LONG" else entry_px * (1 - 0.01*partial_at_r*2)
+    return entry_px, sl_px, tp_px
+
+def calc_equity_qty(account_equity_usd: float, risk_pct: float, entry_px: float, stop_px: float):
+    risk_value = account_equity_usd * (risk_pct/100.0)
+    per_share_risk = max(abs(entry_px - stop_px), 1e-4)
+    qty = int(risk_value // per_share_risk)
+    return max(qty, 1)
+
 # ---------- SIMPLE EQUITY ORDER ----------
 def place_simple_equity(symbol, side, qty=None, type_="market", limit_price=None, tif="day", extended=False, client_id=None, notional=None):
     """
@@ -102,14 +151,7 @@ def place_simple_equity(symbol, side, qty=None, type_="market", limit_price=None
     if body["type"] == "market" and body.get("extended_hours"):
         raise ValueError("market orders are not allowed with extended_hours=True; use limit")
 
-    url = f"{ALPACA_TRADING_BASE}/v2/orders"
-    r = requests.post(url, json=body, headers=_headers(), timeout=20)
-    try:
-        r.raise_for_status()
-    except requests.HTTPError as e:
-        detail = getattr(e.response, "text", "")
-        raise RuntimeError(f"Alpaca order error: {detail}") from e
-    return r.json()
+    return _submit_order(body)
 
 # ---------- BRACKET ORDER ----------
 def place_bracket_equity(symbol, side, qty=None, entry_type="market", entry_px=None, tp_px=None, sl_px=None,
@@ -122,13 +164,46 @@ def place_bracket_equity(symbol, side, qty=None, entry_type="market", entry_px=N
     """
     if _panic():
         return {"ok": False, "detail": "panic mode active"}
+    bp = float(_get_account().get("buying_power", 0))
+    body, _ = _bracket_body(bp, symbol, side, qty, entry_type, entry_px, tp_px, sl_px, tif, extended, client_id, notional)
+    return _submit_order(body)
 
+def place_bracket_batch(orders, max_workers=8):
+    """
+    Più bracket su un'unica lettura dell'account: ogni ordine viene cappato sulla buying power residua
+    dopo i precedenti, poi gli ordini partono in parallelo (rate limit del client HTTP).
+    orders: lista di kwargs di place_bracket_equity. Ritorna una lista allineata di risposte o eccezioni.
+    """
+    if _panic():
+        return [{"ok": False, "detail": "panic mode active"} for _ in orders]
+    try:
+        bp = float(_get_account().get("buying_power", 0))
+    except Exception as e:
+        return [e for _ in orders]     # come gli errori del singolo ordine: il chiamante salva comunque lo stato
+    bodies = []
+    for o in orders:
+        try:
+            body, used = _bracket_body(bp, **o)
+            bp = max(0.0, bp - used); bodies.append(body)
+        except ValueError as e:
+            bodies.append(e)
+    def _send(body):
+        if isinstance(body, Exception): return body
+        try:
+            return _submit_order(body)
+        except Exception as e:
+            return e
+    if not bodies: return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(bodies)))) as ex:
+        return list(ex.map(_send, bodies))
+
+def _bracket_body(bp, symbol, side, qty=None, entry_type="market", entry_px=None, tp_px=None, sl_px=None,
+                  tif="gtc", extended=False, client_id=None, notional=None):
+    """Body del bracket con cap a BP; ritorna anche il notional impegnato (0 se non noto: market a qty)."""
     if qty is not None and notional is not None:
         raise ValueError("Pass only qty OR notional")
 
     # --- Cap a buying power ---
-    acc = _get_account()
-    bp = float(acc.get("buying_power", 0))
     px = float(entry_px) if (entry_type == "limit" and entry_px is not None) else None
 
     if px is not None:
@@ -169,6 +244,7 @@ def place_bracket_equity(symbol, side, qty=None, entry_type="market", entry_px=N
         if notional < 1:
             raise ValueError("notional < 1$")
         body["notional"] = round(notional, 2)
+        used = notional
     else:
         if qty is None:
             raise ValueError("qty or notional required")
@@ -176,13 +252,17 @@ def place_bracket_equity(symbol, side, qty=None, entry_type="market", entry_px=N
         if q < 1:
             raise ValueError("qty < 1")
         body["qty"] = str(q)
+        used = q * px if px is not None else 0.0
 
     # MARKET + extended non è consentito
     if body["type"] == "market" and body.get("extended_hours"):
         raise ValueError("market orders are not allowed with extended_hours=True; use limit")
+    return body, used
 
+def _submit_order(body):
     url = f"{ALPACA_TRADING_BASE}/v2/orders"
-    r = requests.post(url, json=body, headers=_headers(), timeout=20)
+    r = http_client.post(url, json=body, headers=_headers(), timeout=20)
+    invalidate_cache("account", "positions")
     try:
         r.raise_for_status()
     except requests.HTTPError as e:
@@ -198,34 +278,24 @@ def place_limit_partial(symbol, side, qty, limit_px, tif="day", client_id=None):
         "time_in_force": tif, "qty": str(int(qty)),
         "client_order_id": client_id or _client_id(symbol),
     }
-    url = f"{ALPACA_TRADING_BASE}/v2/orders"
-    r = requests.post(url, json=body, headers=_headers(), timeout=20)
-    try:
-        r.raise_for_status()
-    except requests.HTTPError as e:
-        detail = getattr(e.response, "text", "")
-        raise RuntimeError(f"Alpaca order error: {detail}") from e
-    return r.json()
+    return _submit_order(body)
 
 def panic_close_all():
     if not _panic():
         return {"ok": True, "detail": "not in panic mode"}
     # Cancella ordini aperti
-    requests.delete(f"{ALPACA_TRADING_BASE}/v2/orders", headers=_headers(), timeout=20)
+    http_client.delete(f"{ALPACA_TRADING_BASE}/v2/orders", headers=_headers(), timeout=20)
+    invalidate_cache()
     # Chiude posizioni a market
-    r = requests.get(f"{ALPACA_TRADING_BASE}/v2/positions", headers=_headers(), timeout=20)
-    r.raise_for_status()
-    for p in r.json():
+    for p in _fetch("/v2/positions"):
         sym = p["symbol"]; q = abs(int(float(p["qty"])))
         side = "sell" if float(p["qty"]) > 0 else "buy"
         place_simple_equity(sym, side, qty=q, type_="market", tif="day", extended=False)
     return {"ok": True}
 
 
-def _get_clock():
-    r = requests.get(f"{ALPACA_TRADING_BASE}/v2/clock", headers=_headers(), timeout=15)
-    r.raise_for_status()
-    return r.json()
+def get_clock():
+    return _cached("clock", lambda: _fetch("/v2/clock", timeout=15))
 
 def get_account_equity():
     acc = _get_account()
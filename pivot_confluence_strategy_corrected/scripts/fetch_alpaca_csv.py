@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
 """
-Scarica minute bars da Alpaca e salva CSV per backtest.
+Scarica minute bars da Alpaca e le salva per il backtest: archivio colonnare .npy (default, vedi
+src/utils/barstore.py) oppure CSV con --format csv.
+
+Il periodo è diviso in chunk di --chunk-days giorni scaricati in parallelo (--workers) entro un budget di
+richieste al minuto (--rpm). I chunk salvati finiscono in un checkpoint ({out}/.fetch_checkpoint.json):
+rilanciando il comando si scaricano solo i chunk mancanti e si uniscono all'archivio esistente.
 
 Usage (dentro Docker):
   docker compose run --rm --entrypoint "" strategy \
@@ -10,12 +15,19 @@ Usage (dentro Docker):
 
 import os
 import sys
+import json
 import time
 import argparse
-from datetime import datetime, timezone
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
 
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from utils import barstore
+
 try:
     from alpaca_trade_api.rest import REST, TimeFrame, TimeFrameUnit, APIError
 except Exception as e:
@@ -28,13 +40,93 @@ def parse_args():
     ap.add_argument("--symbols", nargs="+", required=True, help="Lista simboli es. SPY QQQ IWM")
     ap.add_argument("--start", required=True, help="Data start (YYYY-MM-DD)")
     ap.add_argument("--end", required=True, help="Data end inclusa (YYYY-MM-DD)")
-    ap.add_argument("--out", default="./data", help="Cartella output CSV")
+    ap.add_argument("--out", default="./data", help="Cartella output")
+    ap.add_argument("--format", default="npy", choices=["npy", "csv"], help="npy = archivio colonnare (data.source: npy)")
     ap.add_argument("--timeframe", default="1m", help="1m, 5m, 15m ... (solo minuti)")
     ap.add_argument("--feed", default=None, help="feed Alpaca (es. iex, sip). Di solito lasciare vuoto.")
     ap.add_argument("--adjustment", default="raw", choices=["raw", "split", "all"], help="Aggiustamento prezzi")
+    ap.add_argument("--chunk-days", type=int, default=7, help="Giorni per richiesta (una settimana di 1m sta in una pagina)")
+    ap.add_argument("--workers", type=int, default=4, help="Download concorrenti")
+    ap.add_argument("--rpm", type=int, default=180, help="Budget richieste/minuto (Alpaca: 200)")
+    ap.add_argument("--flush-every", type=int, default=26, help="Chunk per simbolo accumulati prima di scrivere su disco")
+    ap.add_argument("--full", action="store_true", help="Ignora il checkpoint e riscarica tutto il periodo")
     return ap.parse_args()
 
 
+class TokenBucket:
+    """Budget di richieste condiviso tra i thread: rpm al minuto, burst fino a `capacity`."""
+    def __init__(self, rpm, capacity=5):
+        self.rate = rpm / 60.0
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.ts = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+                self.ts = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+BUCKET = TokenBucket(0)
+
+
+class Checkpoint:
+    """
+    Intervalli di giorni [start, end] già scaricati e salvati, per simbolo. Chiave = timeframe|feed|adjustment|format:
+    cambiando uno di questi parametri si riparte da zero. Il file JSON è riscritto in modo atomico.
+    """
+    NAME = ".fetch_checkpoint.json"
+
+    def __init__(self, folder, key):
+        self.path = os.path.join(folder, self.NAME)
+        try:
+            with open(self.path) as f:
+                self.data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.data = {}
+        self.done = self.data.setdefault(key, {})
+
+    def covered(self, sym, a: date, b: date) -> bool:
+        return any(date.fromisoformat(s) <= a and b <= date.fromisoformat(e) for s, e in self.done.get(sym, []))
+
+    def add(self, sym, a: date, b: date):
+        """Aggiunge [a, b] e fonde gli intervalli sovrapposti o adiacenti."""
+        iv = sorted([(date.fromisoformat(s), date.fromisoformat(e)) for s, e in self.done.get(sym, [])] + [(a, b)])
+        merged = [list(iv[0])]
+        for s, e in iv[1:]:
+            if s <= merged[-1][1] + timedelta(days=1):
+                merged[-1][1] = max(merged[-1][1], e)
+            else:
+                merged.append([s, e])
+        self.done[sym] = [[s.isoformat(), e.isoformat()] for s, e in merged]
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(tmp, self.path)
+
+
+def chunks(start: date, end: date, days: int):
+    """[start, end] diviso in intervalli di `days` giorni (estremi inclusi)."""
+    out, a = [], start
+    while a <= end:
+        b = min(a + timedelta(days=days - 1), end)
+        out.append((a, b))
+        a = b + timedelta(days=1)
+    return out
+
+
 def get_tf(tf_str: str) -> TimeFrame:
     # accetta “1m, 5m, 15m, 30m, 60m”
     if not tf_str.endswith("m"):
@@ -57,6 +149,7 @@ def round_trip(client: REST, *args, **kwargs):
     """Chiamata con retry/backoff semplice per evitare rate-limit."""
     backoff = 1.0
     for attempt in range(7):
+        BUCKET.acquire()
         try:
             return client.get_bars(*args, **kwargs)
         except APIError as e:
@@ -106,6 +199,8 @@ def fetch_symbol(client: REST, symbol: str, start: str, end: str, tf: TimeFrame,
                 "close": float(b.c),
                 "volume": int(b.v),
             })
+        if not rows:  # chunk senza sedute (weekend, festivi)
+            return pd.DataFrame()
         df = pd.DataFrame(rows).set_index("timestamp")
 
     if df.empty:
@@ -122,31 +217,114 @@ def fetch_symbol(client: REST, symbol: str, start: str, end: str, tf: TimeFrame,
     return df
 
 
+_local = threading.local()
+
+
+def fetch_chunk(symbol, a: date, b: date, tf, args) -> pd.DataFrame:
+    # un client REST (e una sessione HTTP) per thread
+    if not hasattr(_local, "client"):
+        _local.client = get_rest_client()
+    return fetch_symbol(_local.client, symbol, a.isoformat(), b.isoformat(), tf, args.feed, args.adjustment)
+
+
+def write_csv(out_path, df):
+    """CSV con timestamp ISO +00:00 e header richiesti dal backtest; unisce le barre già presenti."""
+    n_old = 0
+    if os.path.exists(out_path):
+        old = barstore.read_csv(out_path)
+        n_old = len(old)
+        df = pd.concat([old[~old.index.isin(df.index)], df]).sort_index()
+    df_reset = df.reset_index()
+    # timestamp in ISO con offset esplicito
+    df_reset["timestamp"] = df_reset["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S%z")
+    # Inserisci i due punti nel +0000 -> +00:00 per compatibilità
+    df_reset["timestamp"] = df_reset["timestamp"].str.replace(r"(\+|\-)(\d{2})(\d{2})$", r"\1\2:\3", regex=True)
+    tmp = out_path + ".tmp"
+    df_reset.to_csv(tmp, index=False, columns=["timestamp", "open", "high", "low", "close", "volume"])
+    os.replace(tmp, out_path)
+    return len(df) - n_old
+
+
+def seed_from_store(ckpt, folder, sym):
+    """Archivio .npy già presente ma senza checkpoint: i giorni tra la prima e la penultima data valgono come scaricati."""
+    rec = barstore.open_bars(barstore.path_for(folder, sym))
+    if len(rec) == 0:
+        return
+    first = pd.Timestamp(int(rec["ts"][0]), tz="UTC").date()
+    last = pd.Timestamp(int(rec["ts"][-1]), tz="UTC").date() - timedelta(days=1)  # l'ultimo giorno può essere parziale
+    if first <= last:
+        ckpt.add(sym, first, last)
+
+
 def main():
+    global BUCKET
     args = parse_args()
     os.makedirs(args.out, exist_ok=True)
 
-    client = get_rest_client()
+    get_rest_client()  # verifica le credenziali prima di partire
     tf = get_tf(args.timeframe)
+    BUCKET = TokenBucket(args.rpm)
+    ckpt = Checkpoint(args.out, f"{args.timeframe}|{args.feed or ''}|{args.adjustment}|{args.format}")
+    if args.full:
+        ckpt.done.clear()
 
+    start, end = date.fromisoformat(args.start), date.fromisoformat(args.end)
+    tasks = []
     for sym in args.symbols:
-        print(f"Downloading {sym} {args.timeframe} bars from Alpaca...")
-        df = fetch_symbol(client, sym, args.start, args.end, tf, args.feed, args.adjustment)
-        if df.empty:
-            print(f"WARNING: nessun dato per {sym} nel periodo richiesto.")
-            continue
-
-        # CSV con timestamp ISO +00:00 e header richiesti dal backtest
-        out_path = os.path.join(args.out, f"{sym}.csv")
-        df_reset = df.reset_index()
-        # timestamp in ISO con offset esplicito
-        df_reset["timestamp"] = df_reset["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S%z")
-        # Inserisci i due punti nel +0000 -> +00:00 per compatibilità
-        df_reset["timestamp"] = df_reset["timestamp"].str.replace(r"(\+|\-)(\d{2})(\d{2})$", r"\1\2:\3", regex=True)
-
-        df_reset.rename(columns={"timestamp": "timestamp"}, inplace=True)
-        df_reset.to_csv(out_path, index=False, columns=["timestamp", "open", "high", "low", "close", "volume"])
-        print(f"Saved {out_path}")
+        if args.format == "npy" and sym not in ckpt.done:
+            seed_from_store(ckpt, args.out, sym)
+        tasks += [(sym, a, b) for a, b in chunks(start, end, args.chunk_days) if not ckpt.covered(sym, a, b)]
+    if not tasks:
+        print("Everything up to date.")
+        return
+    print(f"Downloading {len(tasks)} chunks ({args.chunk_days}d) for {len(set(t[0] for t in tasks))} symbols, "
+          f"{args.workers} workers, {args.rpm} req/min...")
+
+    # un chunk entra nel checkpoint solo se è già chiuso (non include barre ancora in arrivo)
+    settled = datetime.now(timezone.utc) - timedelta(minutes=20)
+    remaining = Counter(t[0] for t in tasks)
+    pending = defaultdict(list)
+    failed = 0
+
+    def flush(sym):
+        items = pending.pop(sym, [])
+        frames = [df for _, _, df in items if not df.empty]
+        added = 0
+        if frames:
+            df = pd.concat(frames).sort_index()
+            df = df[~df.index.duplicated(keep="last")]
+            if args.format == "npy":
+                added = barstore.merge_bars(barstore.path_for(args.out, sym), df)
+            else:
+                added = write_csv(os.path.join(args.out, f"{sym}.csv"), df)
+        for a, b, _ in items:
+            if datetime.combine(b, datetime.max.time(), timezone.utc) < settled:
+                ckpt.add(sym, a, b)
+        ckpt.save()
+        print(f"{sym}: +{added} bars ({len(items)} chunks, {remaining[sym]} left)")
+
+    ex = ThreadPoolExecutor(max_workers=args.workers)
+    try:
+        futs = {ex.submit(fetch_chunk, sym, a, b, tf, args): (sym, a, b) for sym, a, b in tasks}
+        for fut in as_completed(futs):
+            sym, a, b = futs[fut]
+            remaining[sym] -= 1
+            try:
+                pending[sym].append((a, b, fut.result()))
+            except Exception as e:
+                failed += 1
+                print(f"ERROR {sym} {a}..{b}: {e}", file=sys.stderr)
+            if pending[sym] and (remaining[sym] == 0 or len(pending[sym]) >= args.flush_every):
+                flush(sym)
+    finally:
+        # anche su Ctrl-C: niente nuovi chunk, si salva quanto già scaricato
+        ex.shutdown(wait=False, cancel_futures=True)
+        for sym in [s for s, items in pending.items() if items]:
+            flush(sym)
+
+    if failed:
+        print(f"WARNING: {failed} chunk falliti, rilancia il comando per riprovarli.")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,6 @@
+import os
 import pandas as pd
+from utils import barstore
 
 class Backtester:
     def __init__(self, cfg):
@@ -8,13 +10,21 @@ class Backtester:
         self.commission = float(cfg['backtest'].get('commission_per_share', 0.0))
         self.slip_bps   = float(cfg['backtest'].get('slippage_bps', 0.0))
         self.max_hold   = int(cfg['backtest'].get('max_hold_min', 30))
+        self.vectorized = bool(cfg['backtest'].get('vectorized', True))
 
-    def _load_csv_folder(self, folder, symbols):
+    def _load_folder(self, folder, symbols):
+        """
+        Barre dei simboli tra start_date ed end_date. Con data.source: npy legge l'archivio colonnare
+        (memory-map, solo le righe del periodo); se per un simbolo manca il .npy ripiega sul CSV.
+        """
+        use_store = self.cfg['data'].get('source', 'csv') == 'npy'
         out = {}
         for s in symbols:
-            df = pd.read_csv(f"{folder}/{s}.csv")
-            df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
-            df = df.set_index('timestamp').sort_index()
+            path = barstore.path_for(folder, s)
+            if use_store and os.path.exists(path):
+                out[s] = barstore.load_bars(path, self.start, self.end)
+                continue
+            df = barstore.read_csv(f"{folder}/{s}.csv")
             df = df.loc[self.start:self.end].copy()
             for c in ['open','high','low','close','volume']:
                 if c not in df.columns:
@@ -44,60 +54,105 @@ class Backtester:
         px_entry_raw = float(sym_df.iloc[start_idx]['close'])
         return ts_entry, px_entry_raw
 
-    def _simulate_exit_bracket(self, sym_df, i_entry, side, sl, tp):
+    @staticmethod
+    def _bar_arrays(sym_df):
+        """(low, high, close) come array NumPy, da calcolare una volta per simbolo."""
+        return (sym_df['low'].to_numpy(dtype=float), sym_df['high'].to_numpy(dtype=float),
+                sym_df['close'].to_numpy(dtype=float))
+
+    def _simulate_exit_bracket(self, sym_df, i_entry, side, sl, tp, arrays=None):
+        """
+        Prima barra dopo l'entry (entro max_hold) che tocca SL o TP; se le tocca entrambe vince SL (adverse-first).
+        Altrimenti uscita 'timeout' al close dell'ultima barra della finestra.
+        """
+        low, high, close = arrays if arrays is not None else self._bar_arrays(sym_df)
         last_i = min(i_entry + self.max_hold, len(sym_df) - 1)
-        for i in range(i_entry + 1, last_i + 1):
-            lo, hi = sym_df.iloc[i][['low','high']]
-            if side == 'buy':
-                hit_sl = lo <= sl
-                hit_tp = hi >= tp
-                if hit_sl and hit_tp: return sym_df.index[i], float(sl), 'sl'
-                if hit_sl: return sym_df.index[i], float(sl), 'sl'
-                if hit_tp: return sym_df.index[i], float(tp), 'tp'
-            else:
-                hit_sl = hi >= sl
-                hit_tp = lo <= tp
-                if hit_sl and hit_tp: return sym_df.index[i], float(sl), 'sl'
-                if hit_sl: return sym_df.index[i], float(sl), 'sl'
-                if hit_tp: return sym_df.index[i], float(tp), 'tp'
-        ts_exit = sym_df.index[last_i]
-        px_exit = float(sym_df.iloc[last_i]['close'])
-        return ts_exit, px_exit, 'timeout'
+        lo, hi = low[i_entry + 1:last_i + 1], high[i_entry + 1:last_i + 1]
+        if side == 'buy':
+            hit_sl, hit_tp = lo <= sl, hi >= tp
+        else:
+            hit_sl, hit_tp = hi >= sl, lo <= tp
+        hit = hit_sl | hit_tp
+        if hit.any():
+            k = int(hit.argmax())
+            ts_exit = sym_df.index[i_entry + 1 + k]
+            return (ts_exit, float(sl), 'sl') if hit_sl[k] else (ts_exit, float(tp), 'tp')
+        return sym_df.index[last_i], float(close[last_i]), 'timeout'
+
+    def signals(self, strategy, data_map):
+        """
+        Segnali dell'intero periodo: generate_signals della strategia se disponibile (backtest.vectorized, default true),
+        altrimenti on_bar_backtest su ogni timestamp della timeline dei simboli principali.
+        """
+        if self.vectorized and hasattr(strategy, 'generate_signals'):
+            return strategy.generate_signals(data_map)
+        timeline = sorted(set().union(*[data_map[s].index for s in self.cfg['universe']['main']]))
+        out = []
+        for ts in timeline:
+            out.extend(strategy.on_bar_backtest(ts, data_map))
+        return out
 
-    def run(self, strategy):
+    def load_data(self):
         symbols = self.cfg['universe']['main'] + sorted(set(
             x for v in self.cfg['universe'].get('confirms', {}).values() for x in v
         ))
-        data_map = self._load_csv_folder(self.cfg['data']['folder'], symbols)
+        return self._load_folder(self.cfg['data']['folder'], symbols)
+
+    TRADE_COLS = ['ts','symbol','side','px_entry','px_exit','qty','pnl','R','exit_reason']
+
+    def run(self, strategy):
+        data_map = self.load_data()
         strategy.on_backtest_init(data_map)
+        df = self.simulate(self.signals(strategy, data_map), data_map)
+        return self.report(df)
 
+    def simulate(self, signals, data_map, arrays=None):
+        """Entry alla barra successiva + bracket OCO per ogni segnale; ritorna i trade ordinati per ts."""
+        if arrays is None:
+            arrays = {s: self._bar_arrays(df) for s, df in data_map.items()}
         records = []
-        timeline = sorted(set().union(*[data_map[s].index for s in self.cfg['universe']['main']]))
-
-        for ts in timeline:
-            signals = strategy.on_bar_backtest(ts, data_map)
-            for (ts_sig, sym, side, entry_stop, qty, sl, tp) in signals:
-                sym_df = data_map[sym]
-                ent = self._simulate_entry(sym_df, ts_sig, side, entry_stop)
-                if ent is None:
-                    continue
-                ts_entry, px_entry_raw = ent
-                px_entry, fees_in = self._apply_costs(px_entry_raw, side, qty)
-
-                i_entry = sym_df.index.get_loc(ts_entry)
-                ts_exit, px_exit_raw, hit = self._simulate_exit_bracket(sym_df, i_entry, side, sl, tp)
-                exit_side = 'sell' if side == 'buy' else 'buy'
-                px_exit, fees_out = self._apply_costs(px_exit_raw, exit_side, qty)
-
-                pnl = (px_exit - px_entry) * qty if side == 'buy' else (px_entry - px_exit) * qty
-                pnl -= (fees_in + fees_out)
-                risk_per_share = abs(px_entry - sl)
-                R = (pnl / (risk_per_share * qty)) if risk_per_share > 0 else 0.0
-
-                records.append([ts_entry, sym, side, round(px_entry,5), round(px_exit,5), int(qty), round(pnl,5), round(R,3), hit])
-
-        cols = ['ts','symbol','side','px_entry','px_exit','qty','pnl','R','exit_reason']
-        df = pd.DataFrame(records, columns=cols).sort_values('ts')
+        for sig in signals:
+            ts_sig, sym, side, entry_stop, qty, sl, tp = sig[:7]
+            ent = self._simulate_entry(data_map[sym], ts_sig, side, entry_stop)
+            if ent is None:
+                continue
+            records.append(self._trade(data_map[sym], ent, sym, side, qty, sl, tp, arrays[sym])[1])
+        return pd.DataFrame(records, columns=self.TRADE_COLS).sort_values('ts')
+
+    def _trade(self, sym_df, ent, sym, side, qty, sl, tp, arrays=None):
+        """Trade completo da un'entry (ts_entry, px_entry_raw): ritorna (ts_exit, record con TRADE_COLS)."""
+        ts_entry, px_entry_raw = ent
+        px_entry, fees_in = self._apply_costs(px_entry_raw, side, qty)
+
+        i_entry = sym_df.index.get_loc(ts_entry)
+        ts_exit, px_exit_raw, hit = self._simulate_exit_bracket(sym_df, i_entry, side, sl, tp, arrays)
+        exit_side = 'sell' if side == 'buy' else 'buy'
+        px_exit, fees_out = self._apply_costs(px_exit_raw, exit_side, qty)
+
+        pnl = (px_exit - px_entry) * qty if side == 'buy' else (px_entry - px_exit) * qty
+        pnl -= (fees_in + fees_out)
+        risk_per_share = abs(px_entry - sl)
+        R = (pnl / (risk_per_share * qty)) if risk_per_share > 0 else 0.0
+
+        return ts_exit, [ts_entry, sym, side, round(px_entry,5), round(px_exit,5), int(qty), round(pnl,5), round(R,3), hit]
+
+    @staticmethod
+    def summarize(df):
+        """Metriche aggregate dei trade: numero, win rate %, expectancy (PnL medio), R medio, max drawdown."""
+        tot = len(df)
+        if tot == 0:
+            return {'trades': 0, 'win_rate': 0.0, 'expectancy': 0.0, 'mean_R': 0.0, 'max_dd': 0.0, 'pnl': 0.0}
+        eq = df['pnl'].cumsum()
+        return {
+            'trades': tot,
+            'win_rate': 100.0 * int((df['pnl'] > 0).sum()) / tot,
+            'expectancy': float(df['pnl'].mean()),
+            'mean_R': float(df['R'].mean()),
+            'max_dd': float((eq.cummax() - eq).max()),
+            'pnl': float(eq.iloc[-1]),
+        }
+
+    def report(self, df):
         if len(df) == 0:
             print("\n=== BACKTEST SUMMARY ===")
             print("No trades.\n")
@@ -105,22 +160,15 @@ class Backtester:
             return []
 
         print("\n=== BACKTEST SUMMARY ===")
-        print(df[['ts','symbol','side','px_entry','px_exit','qty','pnl','R','exit_reason']].to_string(index=False))
-
-        wins = (df['pnl'] > 0).sum()
-        tot  = len(df)
-        wr   = 100.0 * wins / tot if tot else 0.0
-        exp  = df['pnl'].mean() if tot else 0.0
-        mR   = df['R'].mean() if tot else 0.0
-        eq   = df['pnl'].cumsum()
-        mdd  = float((eq.cummax() - eq).max()) if len(eq) else 0.0
+        print(df[self.TRADE_COLS].to_string(index=False))
 
+        m = self.summarize(df)
         print("\n=== METRICHE ===")
-        print(f"Trades: {tot}")
-        print(f"Win rate: {wr:.2f}%")
-        print(f"Expectancy (media PnL trade): {exp:.4f}")
-        print(f"Media R: {mR:.2f}")
-        print(f"Max Drawdown: {mdd:.4f}\n")
+        print(f"Trades: {m['trades']}")
+        print(f"Win rate: {m['win_rate']:.2f}%")
+        print(f"Expectancy (media PnL trade): {m['expectancy']:.4f}")
+        print(f"Media R: {m['mean_R']:.2f}")
+        print(f"Max Drawdown: {m['max_dd']:.4f}\n")
 
         by_day = df.groupby(df['ts'].dt.date)['pnl'].sum().to_frame('pnl')
         print("By day:")
@@ -0,0 +1,95 @@
+import heapq
+from collections import Counter
+import pandas as pd
+from backtest.backtest import Backtester
+
+# tipi di evento: a parità di timestamp le uscite liberano posti e capitale prima delle nuove entrate
+EXIT, ENTRY = 0, 1
+
+class PortfolioBacktester(Backtester):
+    """
+    Backtest a livello di portafoglio: entrate e uscite di tutti i simboli in un'unica coda di eventi ordinata
+    per tempo (heap), con il portafoglio vivo (capitale impegnato, posizioni aperte, R realizzato del giorno).
+    Un segnale diventa trade solo se, al momento dell'entry:
+      - il simbolo non ha già una posizione aperta;
+      - le posizioni aperte sono meno di risk.max_positions;
+      - l'R realizzato del giorno è sopra -risk.daily_max_loss_R;
+      - sullo stesso livello del simbolo non si è entrati negli ultimi rules.level_cooldown_min minuti;
+      - c'è capitale: qty ridotta a (equity + PnL realizzato) * backtest.leverage - nozionale aperto.
+    Costo O(eventi · log eventi): l'uscita si simula solo per i segnali accettati.
+    """
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        risk = cfg['risk']
+        self.max_positions = int(risk.get('max_positions', 0))          # 0 = nessun limite
+        self.daily_max_loss_R = float(risk.get('daily_max_loss_R', 0))  # 0 = nessun limite
+        self.cooldown = pd.Timedelta(minutes=int(cfg['rules'].get('level_cooldown_min', 0)))
+        self.equity = float(risk.get('account_equity', 0))              # 0 = capitale illimitato
+        self.leverage = float(cfg['backtest'].get('leverage', 1.0))
+        self.skipped = Counter()
+
+    def simulate(self, signals, data_map, arrays=None):
+        if arrays is None:
+            arrays = {s: self._bar_arrays(df) for s, df in data_map.items()}
+        events = []
+        for seq, sig in enumerate(signals):
+            ent = self._simulate_entry(data_map[sig[1]], sig[0], sig[2], sig[3])
+            if ent is not None:
+                events.append((ent[0], ENTRY, seq, sig, ent))
+        heapq.heapify(events)
+
+        notional = {}              # simbolo -> nozionale della posizione aperta
+        day_R = Counter()          # giorno (UTC) -> R realizzato
+        last_entry = {}            # (simbolo, livello) -> ts dell'ultima entry
+        realized = 0.0
+        records = []
+        self.skipped = Counter()
+        while events:
+            ts, kind, seq, sig, payload = heapq.heappop(events)
+            if kind == EXIT:
+                del notional[payload[1]]
+                realized += payload[6]
+                day_R[ts.date()] += payload[7]
+                continue
+
+            sym, side, qty, sl, tp = sig[1], sig[2], int(sig[4]), sig[5], sig[6]
+            key = (sym, sig[7] if len(sig) > 7 else None)
+            reason = self._reject(ts, sym, key, notional, day_R, last_entry)
+            if reason is None and self.equity > 0:
+                px = self._apply_costs(payload[1], side, qty)[0]
+                free = (self.equity + realized) * self.leverage - sum(notional.values())
+                qty = min(qty, int(free // px)) if px > 0 else 0
+                if qty <= 0:
+                    reason = 'capital'
+            if reason is not None:
+                self.skipped[reason] += 1
+                continue
+
+            ts_exit, rec = self._trade(data_map[sym], payload, sym, side, qty, sl, tp, arrays[sym])
+            notional[sym] = rec[3] * qty
+            last_entry[key] = ts
+            records.append(rec)
+            heapq.heappush(events, (ts_exit, EXIT, seq, None, rec))
+        return pd.DataFrame(records, columns=self.TRADE_COLS).sort_values('ts')
+
+    def _reject(self, ts, sym, key, notional, day_R, last_entry):
+        """Motivo per cui il portafoglio scarta un'entry (None = accettata)."""
+        if sym in notional:
+            return 'symbol_open'
+        if self.max_positions > 0 and len(notional) >= self.max_positions:
+            return 'max_positions'
+        if self.daily_max_loss_R > 0 and day_R[ts.date()] <= -self.daily_max_loss_R:
+            return 'daily_max_loss_R'
+        if self.cooldown > pd.Timedelta(0) and key in last_entry and ts - last_entry[key] < self.cooldown:
+            return 'level_cooldown'
+        return None
+
+    def report(self, df):
+        if self.skipped:
+            print("\nSegnali scartati dal portafoglio: " + ", ".join(f"{k}={v}" for k, v in sorted(self.skipped.items())))
+        return super().report(df)
+
+def make_backtester(cfg):
+    """PortfolioBacktester con backtest.portfolio: true, altrimenti il Backtester a segnali indipendenti."""
+    return PortfolioBacktester(cfg) if cfg['backtest'].get('portfolio', False) else Backtester(cfg)
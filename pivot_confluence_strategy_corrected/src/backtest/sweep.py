@@ -0,0 +1,105 @@
+import copy, itertools, os, tempfile, time
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from backtest.backtest import Backtester
+from backtest.portfolio import make_backtester
+from strategies.pivot_confluence import PivotConfluenceStrategy
+
+# parametri ammessi nella griglia -> sezione di config.yaml che li contiene
+SWEEP_PARAMS = {
+    'proximity_atr_1m': 'rules',
+    'volume_mult_break': 'rules',
+    'break_buffer_atr': 'rules',
+    'min_confluence': 'rules',
+    'stop_atr': 'risk',
+    'take_profit_atr': 'risk',
+}
+OHLCV = ['open', 'high', 'low', 'close', 'volume']
+
+def grid_from_cfg(cfg):
+    """Combinazioni della sezione `sweep` di config.yaml (liste di valori; i parametri assenti restano quelli del config)."""
+    sw = cfg.get('sweep', {}) or {}
+    unknown = set(sw) - set(SWEEP_PARAMS) - {'workers', 'out'}
+    if unknown:
+        raise ValueError(f"sweep: unsupported parameters {sorted(unknown)}")
+    keys = [k for k in SWEEP_PARAMS if k in sw]
+    values = [v if isinstance(v, list) else [v] for v in (sw[k] for k in keys)]
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+def apply_params(cfg, params):
+    c = copy.deepcopy(cfg)
+    for k, v in params.items():
+        c[SWEEP_PARAMS[k]][k] = v
+    return c
+
+# --- dati condivisi: un file mappato in memoria, per simbolo [ts int64 ns | OHLCV float64 (5 x n)] ---
+# i worker lo aprono in sola lettura: le pagine stanno una volta sola nella page cache del sistema
+def _pack(data_map, path):
+    layout, size = {}, 0
+    for sym, df in data_map.items():
+        n = len(df); layout[sym] = (size, n); size += n * 8 * 6
+    mm = np.memmap(path, dtype=np.uint8, mode='w+', shape=(max(size, 1),))
+    for sym, df in data_map.items():
+        off, n = layout[sym]
+        np.ndarray(n, dtype=np.int64, buffer=mm, offset=off)[:] = df.index.as_unit("ns").asi8
+        np.ndarray((5, n), dtype=np.float64, buffer=mm, offset=off + 8 * n)[:] = df[OHLCV].to_numpy(dtype=float).T
+    mm.flush(); del mm
+    return layout
+
+def _unpack(path, layout):
+    """DataFrame dei simboli come viste sul file mappato (nessuna copia dei prezzi)."""
+    mm = np.memmap(path, dtype=np.uint8, mode='r')
+    out = {}
+    for sym, (off, n) in layout.items():
+        ts = np.ndarray(n, dtype=np.int64, buffer=mm, offset=off)
+        px = np.ndarray((5, n), dtype=np.float64, buffer=mm, offset=off + 8 * n)
+        idx = pd.DatetimeIndex(ts.view('M8[ns]')).tz_localize('UTC').rename('timestamp')
+        out[sym] = pd.DataFrame(dict(zip(OHLCV, px)), index=idx, copy=False)
+    return out
+
+_W = {}
+
+def _init_worker(cfg, path, layout):
+    """Una volta per processo: mappa i dati e calcola gli indicatori (non dipendono dai parametri della griglia)."""
+    data_map = _unpack(path, layout)
+    base = PivotConfluenceStrategy(cfg); base.on_backtest_init(data_map)
+    bt = make_backtester(cfg)
+    _W.update(data_map=data_map, dm=base.dm, bt=bt,
+              arrays={s: bt._bar_arrays(df) for s, df in data_map.items()}, cfg=cfg)
+
+def _evaluate(params):
+    cfg = apply_params(_W['cfg'], params)
+    strat = PivotConfluenceStrategy(cfg); strat.dm = _W['dm']
+    bt = make_backtester(cfg)
+    trades = bt.simulate(strat.generate_signals(), _W['data_map'], _W['arrays'])
+    return {**params, **bt.summarize(trades)}
+
+def run_sweep(cfg, workers=None, out=None):
+    """
+    Valuta tutte le combinazioni della griglia `sweep` su un pool di processi: i CSV si leggono una volta,
+    i prezzi passano ai worker tramite un file mappato in memoria. Scrive una tabella riassuntiva ordinata per expectancy.
+    """
+    grid = grid_from_cfg(cfg)
+    if not grid:
+        print("Empty sweep grid (add a `sweep:` section to the config)")
+        return pd.DataFrame()
+    sw = cfg.get('sweep', {}) or {}
+    workers = int(workers or sw.get('workers') or 0) or os.cpu_count() or 1
+    out = out or sw.get('out') or 'sweep_results.csv'
+
+    data_map = Backtester(cfg).load_data()
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix='sweep_') as tmp:
+        path = os.path.join(tmp, 'bars.bin')
+        layout = _pack(data_map, path)
+        with Pool(processes=min(workers, len(grid)), initializer=_init_worker, initargs=(cfg, path, layout)) as pool:
+            rows = pool.map(_evaluate, grid, chunksize=max(1, len(grid) // (4 * workers)))
+
+    res = pd.DataFrame(rows).sort_values(['expectancy', 'trades'], ascending=[False, False])
+    res.to_csv(out, index=False)
+    print(f"\n=== SWEEP: {len(grid)} combinazioni, {workers} worker, {time.perf_counter() - t0:.1f}s ===")
+    with pd.option_context('display.float_format', '{:.4f}'.format):
+        print(res.head(20).to_string(index=False))
+    print(f"\nRisultati esportati in: {out}")
+    return res
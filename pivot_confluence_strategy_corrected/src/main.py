@@ -1,21 +1,49 @@
-import argparse, yaml
+import argparse, sys, time, yaml
 from backtest.backtest import Backtester
+from backtest.portfolio import make_backtester
 from strategies.pivot_confluence import PivotConfluenceStrategy
 
 def load_cfg(path):
     with open(path, 'r') as f:
         return yaml.safe_load(f)
 
+def run_parity(cfg):
+    """Confronta i segnali di generate_signals con on_bar_backtest barra per barra sullo stesso periodo."""
+    bt = Backtester(cfg)
+    data_map = bt.load_data()
+    t0 = time.perf_counter()
+    fast_strat = PivotConfluenceStrategy(cfg); fast_strat.on_backtest_init(data_map)
+    fast = fast_strat.generate_signals(data_map)
+    t1 = time.perf_counter()
+    slow_strat = PivotConfluenceStrategy(cfg); slow_strat.on_backtest_init(data_map)
+    bt.vectorized = False
+    slow = bt.signals(slow_strat, data_map)
+    t2 = time.perf_counter()
+    diff = [(a, b) for a, b in zip(fast, slow) if a != b]
+    print(f"Vectorized: {len(fast)} signals in {t1 - t0:.3f}s | bar-by-bar: {len(slow)} signals in {t2 - t1:.3f}s")
+    for a, b in diff[:10]:
+        print("  vectorized:", a, "\n  bar-by-bar:", b)
+    ok = len(fast) == len(slow) and not diff
+    print("PARITY OK" if ok else "PARITY MISMATCH")
+    return ok
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--mode', default='backtest')
     parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--workers', type=int, default=None, help='processi per --mode sweep (default: sweep.workers o CPU)')
+    parser.add_argument('--out', default=None, help='CSV dei risultati di --mode sweep')
     args = parser.parse_args()
     cfg = load_cfg(args.config)
     if args.mode == 'backtest':
-        bt = Backtester(cfg)
+        bt = make_backtester(cfg)
         strat = PivotConfluenceStrategy(cfg)
         bt.run(strat)
+    elif args.mode == 'sweep':
+        from backtest.sweep import run_sweep
+        run_sweep(cfg, workers=args.workers, out=args.out)
+    elif args.mode == 'parity':
+        sys.exit(0 if run_parity(cfg) else 1)
     else:
         print("Unsupported mode")
 
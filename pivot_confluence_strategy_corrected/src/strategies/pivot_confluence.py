@@ -1,10 +1,11 @@
 import math
+import numpy as np
 import pandas as pd
 from typing import Dict, Any, List, Tuple
 from dataclasses import dataclass
 from .strategy_utils import Trade, Position
 from utils.indicators import atr, rolling_median_vol, vwap
-from utils.levels import floor_pivots, opening_range
+from utils.levels import daily_levels
 from utils.confluence import ConfluenceScorer
 
 @dataclass
@@ -77,28 +78,23 @@ class PivotConfluenceStrategy:
             d['pdl'] = d.groupby('date')['low'].transform('min').shift(1)
             d['pdc'] = d.groupby('date')['close'].transform('last').shift(1)
 
+            # Pivot (PP/R1/S1) e opening range della giornata, una volta per simbolo-giorno
+            or_min = int(self.cfg['levels'].get('opening_range_min', 5))
+            d = d.join(daily_levels(d, d['date'], or_min))
+
             self.dm[sym] = d
 
-    def _near_any_level(self, row: pd.Series, day_df: pd.DataFrame) -> Tuple[bool, float, str]:
+    # ordine di controllo dei livelli: il primo entro la soglia è il target
+    LEVELS = (('PP', 'pp'), ('R1', 'r1'), ('S1', 's1'), ('ORH', 'orh'), ('ORL', 'orl'),
+              ('VWAP', 'vwap'), ('PDH', 'pdh'), ('PDL', 'pdl'), ('PDC', 'pdc'))
+
+    def _near_any_level(self, row: pd.Series) -> Tuple[bool, float, str]:
         atrv = row.get('atr1m', None)
         if atrv is None or pd.isna(atrv) or atrv <= 0:
             return False, None, None
 
-        prev_day = day_df.iloc[:-1] if len(day_df) > 1 else day_df
-        piv = floor_pivots(prev_day) if len(prev_day) > 0 else {'PP': None, 'R1': None, 'S1': None}
-        candidates = {'PP': piv.get('PP'), 'R1': piv.get('R1'), 'S1': piv.get('S1')}
-
-        or_min = int(self.cfg['levels'].get('opening_range_min', 5))
-        if len(day_df) >= max(1, or_min):
-            orh, orl = opening_range(day_df, minutes=or_min)
-            candidates['ORH'] = orh; candidates['ORL'] = orl
-
-        if pd.notna(row.get('vwap')): candidates['VWAP'] = float(row['vwap'])
-        if pd.notna(row.get('pdh')):  candidates['PDH']  = float(row['pdh'])
-        if pd.notna(row.get('pdl')):  candidates['PDL']  = float(row['pdl'])
-        if pd.notna(row.get('pdc')):  candidates['PDC']  = float(row['pdc'])
-
-        for nm, lv in candidates.items():
+        for nm, col in self.LEVELS:
+            lv = row.get(col)
             if lv is None or pd.isna(lv):
                 continue
             if abs(row['close'] - lv) <= self.params.proximity_atr * atrv:
@@ -168,16 +164,12 @@ class PivotConfluenceStrategy:
         near_map: Dict[str, bool] = {}
 
         # confluence map
-        all_syms = self.cfg['universe']['main'] + sorted({
-            x for lst in self.cfg['universe'].get('confirms', {}).values() for x in lst
-        })
-        for sym in all_syms:
+        for sym in self._all_symbols():
             d = self.dm.get(sym)
             if d is None or ts not in d.index:
                 continue
             row = d.loc[ts]
-            day_df = d[d['date'] == ts.date()]
-            near, _, _ = self._near_any_level(row, day_df)
+            near, _, _ = self._near_any_level(row)
             near_map[sym] = bool(near)
 
         # signals
@@ -186,9 +178,8 @@ class PivotConfluenceStrategy:
             if d is None or ts not in d.index:
                 continue
             row = d.loc[ts]
-            day_df = d[d['date'] == ts.date()]
 
-            near, target, _lname = self._near_any_level(row, day_df)
+            near, target, lname = self._near_any_level(row)
             if not near or target is None:
                 continue
 
@@ -217,9 +208,93 @@ class PivotConfluenceStrategy:
             if sl is None or tp is None:
                 continue
 
-            signals.append([ts, sym, side, float(entry), int(qty), float(sl), float(tp)])
+            signals.append([ts, sym, side, float(entry), int(qty), float(sl), float(tp), lname])
 
         return signals
 
+    # --- percorso vettoriale: stessi segnali di on_bar_backtest, calcolati su tutte le barre insieme ---
+    def _near_levels(self, d: pd.DataFrame):
+        """Per ogni barra: vicino a un livello?, livello target e nome (il primo entro soglia, ordine LEVELS)."""
+        close = d['close'].to_numpy(dtype=float); atrv = d['atr1m'].to_numpy(dtype=float)
+        ok_atr = atrv > 0
+        conds, values = [], []
+        for _nm, col in self.LEVELS:
+            lv = d[col].to_numpy(dtype=float)
+            with np.errstate(invalid='ignore'):
+                conds.append(ok_atr & ~np.isnan(lv) & (np.abs(close - lv) <= self.params.proximity_atr * atrv))
+            values.append(lv)
+        near = np.logical_or.reduce(conds)
+        target = np.select(conds, values, default=np.nan)
+        name = np.select(conds, [nm for nm, _ in self.LEVELS], default=None)
+        return near, target, name
+
+    def _all_symbols(self):
+        return self.cfg['universe']['main'] + sorted({
+            x for lst in self.cfg['universe'].get('confirms', {}).values() for x in lst
+        })
+
+    def generate_signals(self, data_map: Dict[str, pd.DataFrame] = None) -> List[list]:
+        """
+        Tutti i segnali del periodo in un colpo solo: prossimità ai livelli, confluenza, filtro candela,
+        trigger di rottura con volume e filtri di trend come colonne booleane sull'intero frame.
+        Stesso risultato (e stesso ordine: timestamp, poi simbolo di universe.main) di on_bar_backtest
+        chiamato su ogni timestamp; verificabile con `--mode parity`.
+        """
+        if data_map is not None and not self.dm:
+            self.on_backtest_init(data_map)
+        near_cols = {}
+        levels = {}
+        for sym in self._all_symbols():
+            d = self.dm.get(sym)
+            if d is None: continue
+            levels[sym] = self._near_levels(d)
+            near_cols[sym] = pd.Series(levels[sym][0], index=d.index)
+
+        out = []
+        for rank, sym in enumerate(self.cfg['universe']['main']):
+            d = self.dm.get(sym)
+            if d is None: continue
+            near, target, name = levels[sym]
+            near_at = pd.DataFrame({s: v.reindex(d.index, fill_value=False) for s, v in near_cols.items()}, index=d.index)
+            conf = self.confluence.score_frame(sym, near_at).to_numpy()
+            o, c = d['open'].to_numpy(dtype=float), d['close'].to_numpy(dtype=float)
+            atrv = d['atr1m'].to_numpy(dtype=float)
+            vol, vmed = d['volume'].to_numpy(dtype=float), d['vol_med'].to_numpy(dtype=float)
+
+            with np.errstate(invalid='ignore'):
+                candle_ok = (np.ones(len(d), dtype=bool) if self.min_body_atr <= 0
+                             else (atrv > 0) & (np.abs(c - o) >= self.min_body_atr * atrv))
+                vol_ok = ~np.isnan(vol) & ~np.isnan(vmed) & (vol >= self.params.volume_mult_break * vmed)
+                is_long = ~np.isnan(target) & (c > target + self.buf_mult * atrv) & (o <= target)
+                is_short = ~np.isnan(target) & (c < target - self.buf_mult * atrv) & (o >= target)
+            side_buy = is_long
+            mask = near & (conf >= self.min_conf) & candle_ok & vol_ok & (is_long | is_short)
+            mask &= np.where(side_buy, self._trend_mask(d, 'buy'), self._trend_mask(d, 'sell'))
+
+            for i in np.flatnonzero(mask):
+                side = "buy" if side_buy[i] else "sell"
+                a = float(atrv[i])
+                entry = (target[i] + self.buf_mult * a) if side == "buy" else (target[i] - self.buf_mult * a)
+                qty = self._size_qty(float(entry), a)
+                if qty <= 0: continue
+                sl, tp = self._exit_prices(float(entry), a, side)
+                if sl is None or tp is None: continue
+                out.append((d.index[i], rank, [d.index[i], sym, side, float(entry), int(qty), float(sl), float(tp), name[i]]))
+        out.sort(key=lambda x: (x[0], x[1]))
+        return [sig for _, _, sig in out]
+
+    def _trend_mask(self, d: pd.DataFrame, side: str) -> np.ndarray:
+        """_passes_trend_filters su tutte le barre."""
+        c = d['close'].to_numpy(dtype=float)
+        ok = np.ones(len(d), dtype=bool)
+        with np.errstate(invalid='ignore'):
+            if self.use_ema:
+                ef, es = d['ema_fast'].to_numpy(dtype=float), d['ema_slow'].to_numpy(dtype=float)
+                ok &= ((c > ef) & (ef > es)) if side == "buy" else ((c < ef) & (ef < es))
+            if self.use_vwap_filter:
+                v = d['vwap'].to_numpy(dtype=float)
+                ok &= (c >= v) if side == "buy" else (c <= v)
+        return ok
+
     def on_poll(self, api, symbols):
         print("Poll tick - demo mode. Esporta CSV e usa backtest per ora.")
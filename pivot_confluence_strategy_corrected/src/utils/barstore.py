@@ -0,0 +1,92 @@
+import argparse, glob, os
+import numpy as np
+import pandas as pd
+
+# Archivio colonnare delle barre: un file .npy per simbolo, record (ts int64 ns UTC | OHLCV float64) ordinati per ts.
+# Si apre in memory-map: il filtro start/end è una searchsorted sui ts e si leggono solo le pagine del periodo
+# richiesto, senza parsing di stringhe.
+
+OHLCV = ('open', 'high', 'low', 'close', 'volume')
+BAR_DTYPE = np.dtype([('ts', '<i8')] + [(c, '<f8') for c in OHLCV])
+EXT = '.npy'
+
+def path_for(folder, symbol):
+    return os.path.join(folder, f"{symbol}{EXT}")
+
+def _ns(t):
+    t = pd.Timestamp(t)
+    t = t.tz_localize('UTC') if t.tzinfo is None else t.tz_convert('UTC')
+    return t.as_unit('ns').value
+
+def from_frame(df: pd.DataFrame) -> np.ndarray:
+    """DataFrame con indice temporale e colonne OHLCV -> record ordinati per ts (sui duplicati vince l'ultimo)."""
+    idx = pd.DatetimeIndex(df.index)
+    idx = idx.tz_localize('UTC') if idx.tz is None else idx.tz_convert('UTC')
+    rec = np.empty(len(df), dtype=BAR_DTYPE)
+    rec['ts'] = idx.as_unit('ns').asi8
+    for c in OHLCV:
+        rec[c] = df[c].to_numpy(dtype=float)
+    rec = rec[np.argsort(rec['ts'], kind='stable')]
+    return rec[np.r_[rec['ts'][1:] != rec['ts'][:-1], True]] if len(rec) else rec
+
+def to_frame(rec: np.ndarray) -> pd.DataFrame:
+    idx = pd.DatetimeIndex(np.asarray(rec['ts']).astype('M8[ns]')).tz_localize('UTC').rename('timestamp')
+    return pd.DataFrame({c: np.array(rec[c]) for c in OHLCV}, index=idx)
+
+def open_bars(path) -> np.ndarray:
+    """Record del file in memory-map (sola lettura); array vuoto se il file non esiste."""
+    if not os.path.exists(path):
+        return np.empty(0, dtype=BAR_DTYPE)
+    rec = np.load(path, mmap_mode='r')
+    if rec.dtype != BAR_DTYPE:
+        raise ValueError(f"{path}: unexpected dtype {rec.dtype}")
+    return rec
+
+def load_bars(path, start=None, end=None) -> pd.DataFrame:
+    """Barre con start <= ts <= end (estremi inclusi, come df.loc[start:end])."""
+    rec = open_bars(path)
+    ts = rec['ts']
+    i = 0 if start is None else int(ts.searchsorted(_ns(start), 'left'))
+    j = len(rec) if end is None else int(ts.searchsorted(_ns(end), 'right'))
+    return to_frame(rec[i:j])
+
+def last_ts(path):
+    rec = open_bars(path)
+    return pd.Timestamp(int(rec['ts'][-1]), tz='UTC') if len(rec) else None
+
+def save_bars(path, data):
+    """Scrittura atomica (file temporaneo + rename): un lettore vede sempre un file completo."""
+    rec = data if isinstance(data, np.ndarray) else from_frame(data)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        np.save(f, np.ascontiguousarray(rec, dtype=BAR_DTYPE))
+    os.replace(tmp, path)
+
+def merge_bars(path, df: pd.DataFrame) -> int:
+    """Unisce nuove barre al file (sui timestamp già presenti vincono le nuove); ritorna le righe aggiunte."""
+    new = from_frame(df)
+    old = np.array(open_bars(path))
+    n_old = len(old)
+    if n_old and len(new):
+        old = old[~np.isin(old['ts'], new['ts'])]
+    rec = np.concatenate([old, new])
+    save_bars(path, rec[np.argsort(rec['ts'], kind='stable')])
+    return len(rec) - n_old
+
+def read_csv(path) -> pd.DataFrame:
+    """CSV del backtest (timestamp ISO con offset + OHLCV)."""
+    df = pd.read_csv(path)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+    return df.set_index('timestamp').sort_index()
+
+def main():
+    ap = argparse.ArgumentParser(description="Converte i CSV di una cartella nell'archivio .npy")
+    ap.add_argument("folder", help="cartella con i file {SYMBOL}.csv")
+    args = ap.parse_args()
+    for csv in sorted(glob.glob(os.path.join(args.folder, "*.csv"))):
+        df = read_csv(csv)
+        save_bars(os.path.splitext(csv)[0] + EXT, df)
+        print(f"Saved {os.path.splitext(csv)[0] + EXT} ({len(df)} bars)")
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import pandas as pd
+
 class ConfluenceScorer:
     def __init__(self, cfg):
         self.cfg = cfg
@@ -10,3 +12,8 @@ class ConfluenceScorer:
             if near_map.get(c, False):
                 s += 1
         return s
+
+    def score_frame(self, sym, near):
+        """Versione vettoriale di score: near è un DataFrame di bool (una colonna per simbolo) allineato alle barre."""
+        cols = [c for c in self.map.get(sym, []) if c in near.columns]
+        return near[cols].sum(axis=1).astype(int) if cols else pd.Series(0, index=near.index)
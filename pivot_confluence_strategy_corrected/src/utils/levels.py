@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 def floor_pivots(prev_day_df: pd.DataFrame):
@@ -14,3 +15,26 @@ def opening_range(day_df: pd.DataFrame, minutes: int = 5):
         return None, None
     first = day_df.iloc[:minutes]
     return first['high'].max(), first['low'].min()
+
+def daily_levels(df: pd.DataFrame, dates, or_minutes: int = 5) -> pd.DataFrame:
+    """
+    PP/R1/S1 e ORH/ORL di ogni giornata come colonne allineate alle barre di df (dates = giorno di ogni barra).
+    Stessi valori di floor_pivots(giorno senza l'ultima barra) e opening_range(giorno, or_minutes)
+    (ORH/ORL solo se la giornata ha almeno or_minutes barre), calcolati una volta per giornata.
+    """
+    key = pd.Series(np.asarray(dates), index=df.index)
+    g = key.groupby(key, sort=False)
+    n = g.transform('size').to_numpy(); pos = g.cumcount().to_numpy()
+    by_day = lambda s, how: s.groupby(key, sort=False).transform(how)
+
+    body = (pos < n - 1) | (n == 1)           # giornata senza l'ultima barra
+    H = by_day(df['high'].where(body), 'max')
+    L = by_day(df['low'].where(body), 'min')
+    C = by_day(df['close'].where(pos == np.maximum(n - 2, 0)), 'max')
+    PP = (H + L + C) / 3.0
+
+    first = pos < or_minutes
+    has_or = n >= max(1, or_minutes)
+    orh = by_day(df['high'].where(first), 'max').where(has_or)
+    orl = by_day(df['low'].where(first), 'min').where(has_or)
+    return pd.DataFrame({'pp': PP, 'r1': 2*PP - L, 's1': 2*PP - H, 'orh': orh, 'orl': orl}, index=df.index)